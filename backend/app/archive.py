@@ -0,0 +1,135 @@
+"""Archiving old stock movements into a cold database.
+
+stock_movements gains a row for every sold line, cancellation and adjustment
+and is never trimmed, so a product's history gets slower to page through as
+it grows. archive_movements() moves the rows older than
+IMS_ARCHIVE_AFTER_MONTHS into the stock_movements table of a second SQLite
+file, which every connection has attached as "archive" (see app.database).
+Rows move ARCHIVE_BATCH at a time, each batch a unit of work on the writer, so
+copying, deleting and checkpointing a batch commit together. The checkpoint
+is a StockCheckpoint per product in the hot database: the stock level after
+its last archived movement. Copying skips rows the archive already holds, so a
+batch that overlaps an earlier one (e.g. after a restore) still goes through.
+
+product_movements() pages through a product's history newest first and only
+reads the archive once the page goes past the product's hot rows; archived
+rows are always older than the ones left behind.
+"""
+
+import os
+from datetime import datetime, timedelta
+from functools import partial
+from typing import List, Optional
+
+from sqlalchemy import Column, Index, MetaData, Table, delete, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .database import ARCHIVE_ENABLED
+from .models import Product, StockCheckpoint, StockMovement
+from .writer import run_write_sync
+
+# Movements younger than this stay in the hot database
+ARCHIVE_AFTER_MONTHS = int(os.getenv("IMS_ARCHIVE_AFTER_MONTHS", "12"))
+# Movements moved per unit of work
+ARCHIVE_BATCH = 5000
+
+archive_metadata = MetaData(schema="archive")
+archived_movements = Table(
+    "stock_movements", archive_metadata,
+    *(
+        Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+        for column in StockMovement.__table__.columns
+    ),
+    Index("ix_archive_stock_movements_product_created", "product_id", "created_at"),
+    Index("ix_archive_stock_movements_created", "created_at"),
+)
+
+_hot = StockMovement.__table__
+
+
+def _archive_batch(db: Session, cutoff: datetime) -> int:
+    """Move the oldest batch of movements before cutoff; runs as a unit of work on the writer"""
+    conn = db.connection()
+    # The newest row stays, so new movements never reuse an archived id
+    newest = conn.scalar(select(func.max(_hot.c.id)))
+    if newest is None:
+        return 0
+    rows = conn.execute(
+        select(_hot.c.id, _hot.c.product_id, _hot.c.new_stock, _hot.c.created_at)
+        .where(_hot.c.created_at < cutoff, _hot.c.id < newest)
+        .order_by(_hot.c.id)
+        .limit(ARCHIVE_BATCH)
+    ).all()
+    if not rows:
+        return 0
+    batch = (_hot.c.created_at < cutoff) & (_hot.c.id < newest) & (_hot.c.id <= rows[-1].id)
+
+    latest = {}
+    for row in rows:
+        current = latest.get(row.product_id)
+        if current is None or (row.created_at, row.id) > (current.created_at, current.id):
+            latest[row.product_id] = row
+    checkpoint = sqlite_insert(StockCheckpoint)
+    conn.execute(
+        checkpoint.on_conflict_do_update(
+            index_elements=["product_id", "as_of"],
+            set_={"stock": checkpoint.excluded.stock, "movement_id": checkpoint.excluded.movement_id},
+        ),
+        [
+            {"product_id": row.product_id, "as_of": row.created_at, "stock": row.new_stock, "movement_id": row.id}
+            for row in latest.values()
+        ],
+    )
+
+    conn.execute(
+        insert(archived_movements).prefix_with("OR IGNORE")
+        .from_select(list(_hot.c.keys()), select(_hot).where(batch))
+    )
+    conn.execute(delete(_hot).where(batch))
+    return len(rows)
+
+
+def newest_archived(conn) -> Optional[datetime]:
+    """created_at of the newest archived movement; the archive holds nothing after it"""
+    if not ARCHIVE_ENABLED:
+        return None
+    return conn.scalar(select(func.max(archived_movements.c.created_at)))
+
+
+def archive_movements(months: int = ARCHIVE_AFTER_MONTHS) -> dict:
+    """Move every stock movement older than `months` to the archive"""
+    if not ARCHIVE_ENABLED:
+        raise ValueError("Archiving needs SQLite and IMS_ARCHIVE enabled")
+    cutoff = datetime.utcnow() - timedelta(days=round(months * 30.44))
+    archived = 0
+    while True:
+        moved = run_write_sync(partial(_archive_batch, cutoff=cutoff))
+        archived += moved
+        if moved < ARCHIVE_BATCH:
+            break
+    return {"archived": archived, "cutoff": cutoff.isoformat(timespec="seconds")}
+
+
+def product_movements(db: Session, product: Product, skip: int, limit: int) -> List[object]:
+    """A page of the product's movements, newest first, from the hot rows then the archive"""
+    movements = db.query(StockMovement)\
+        .filter(StockMovement.product_id == product.id)\
+        .order_by(StockMovement.created_at.desc())\
+        .offset(skip).limit(limit).all()
+    if not ARCHIVE_ENABLED or len(movements) >= limit:
+        return movements
+
+    # The page runs past the hot rows
+    if movements or skip == 0:
+        hot = skip + len(movements)
+    else:
+        hot = db.query(func.count(StockMovement.id)).filter(StockMovement.product_id == product.id).scalar()
+    rows = db.execute(
+        select(archived_movements)
+        .where(archived_movements.c.product_id == product.id)
+        .order_by(archived_movements.c.created_at.desc())
+        .offset(max(skip - hot, 0))
+        .limit(limit - len(movements))
+    ).all()
+    return movements + [{**row._asdict(), "product": product} for row in rows]
@@ -0,0 +1,851 @@
+"""Online backups of the SQLite database.
+
+A backup runs as a background job. It copies the live database with SQLite's
+online backup API a batch of pages at a time and pauses after every step, so
+writers wait for one short step at most instead of the whole copy. The copy
+can then be compressed with gzip, or zstd when the zstandard package is
+installed. Jobs and their progress are kept in memory for the status endpoint.
+
+Backups are full copies (<name>.db) or incremental deltas (<name>.delta). Each
+backup has a JSON manifest (<name>.json) and a checksum of every page
+(<name>.pages). An incremental backup compares the pages of a fresh snapshot
+against its parent's checksums and stores only the pages that changed, so a
+chain is one full backup followed by deltas. Restoring an incremental backup
+replays its chain onto the full backup it starts from.
+
+When stock movements are archived (see app.archive), each backup also points
+its manifest at a snapshot of the archive database, taken after the main copy
+and shared by every backup taken while the archive did not change. A restore
+puts that snapshot back and then drops archived rows the restored database
+still holds, or that it never had, so the two files agree again.
+
+Every finished backup is also recorded in a catalogue (catalog.db in the backup
+directory) with its size, checksum, row counts and schema version, so listing
+backups is one indexed query instead of a stat and a manifest read per file.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import BinaryIO, Dict, List, Optional
+
+from sqlalchemy.engine import make_url
+
+from .database import ARCHIVE_ENABLED, ARCHIVE_PATH, DATABASE_URL
+from .paths import get_data_dir
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstd compression is optional
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = os.path.join(get_data_dir('database'), 'backups')
+BACKUP_PREFIX = "inventory_backup_"
+# Backups being written; renamed into place when complete
+TEMP_PREFIX = ".backup-"
+
+# Pages copied per step (4 KiB each by default) and the pause after each step
+BACKUP_PAGES = int(os.getenv("IMS_BACKUP_PAGES", "1024"))
+BACKUP_STEP_PAUSE = float(os.getenv("IMS_BACKUP_STEP_PAUSE_MS", "5")) / 1000.0
+# Restarts caused by concurrent writes before the copy is finished in one step
+MAX_RESTARTS = int(os.getenv("IMS_BACKUP_MAX_RESTARTS", "3"))
+# none, gzip or zstd
+BACKUP_COMPRESSION = os.getenv("IMS_BACKUP_COMPRESSION", "none")
+# full or incremental
+BACKUP_MODE = os.getenv("IMS_BACKUP_MODE", "full")
+# Incremental backups on top of one full backup before the next full one is taken
+MAX_CHAIN = int(os.getenv("IMS_BACKUP_MAX_CHAIN", "7"))
+# Full backups kept together with their incrementals; 0 keeps everything
+KEEP_CHAINS = int(os.getenv("IMS_BACKUP_KEEP_CHAINS", "8"))
+
+COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+KIND_EXTENSIONS = {"full": ".db", "incremental": ".delta"}
+BACKUP_MODES = tuple(KIND_EXTENSIONS)
+# Finished jobs remembered for the status endpoint
+MAX_FINISHED_JOBS = 50
+
+ARCHIVE_PREFIX = "archive_"
+
+CATALOG_PATH = os.path.join(BACKUP_DIR, "catalog.db")
+_CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    filename TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    parent TEXT,
+    base TEXT NOT NULL,
+    depth INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL,
+    page_size INTEGER,
+    page_count INTEGER,
+    changed_pages INTEGER,
+    compression TEXT NOT NULL,
+    checksum TEXT,
+    row_counts TEXT,
+    schema_version TEXT,
+    has_page_hashes INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_backups_created_at ON backups (created_at);
+CREATE INDEX IF NOT EXISTS ix_backups_base_depth ON backups (base, depth);
+"""
+_CATALOG_COLUMNS = (
+    "filename", "kind", "parent", "base", "depth", "size", "page_size", "page_count", "changed_pages",
+    "compression", "checksum", "row_counts", "schema_version", "has_page_hashes", "created_at",
+)
+
+PAGE_HASH_SIZE = 16
+DELTA_MAGIC = b"IMSDELTA1\n"
+_DELTA_HEADER = struct.Struct(">III")  # page size, page count, changed pages
+_PAGE_NUMBER = struct.Struct(">I")
+
+_jobs: "OrderedDict[str, BackupJob]" = OrderedDict()
+_jobs_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_cancel = threading.Event()
+_catalog_lock = threading.Lock()
+_catalog_ready = False
+
+
+class BackupCancelled(Exception):
+    """Raised from the progress callback to abort a backup on shutdown"""
+
+
+class _Restarted(Exception):
+    """The paged copy restarted too often because of concurrent writes"""
+
+
+class BackupJob:
+    def __init__(self, compression: str, kind: str = "full"):
+        self.id = uuid.uuid4().hex[:12]
+        self.compression = compression
+        self.kind = kind
+        self.status = "queued"  # queued, copying, hashing, writing, completed, failed, cancelled
+        self.filename: Optional[str] = None
+        self.parent: Optional[str] = None
+        self.pages_total = 0
+        self.pages_done = 0
+        self.changed_pages: Optional[int] = None
+        self.restarts = 0
+        self.size: Optional[int] = None
+        self.pruned: List[str] = []
+        self.error: Optional[str] = None
+        self.created_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    def as_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "kind": self.kind,
+            "backup_file": self.filename,
+            "parent": self.parent,
+            "compression": self.compression,
+            "pages_total": self.pages_total,
+            "pages_done": self.pages_done,
+            "changed_pages": self.changed_pages,
+            "restarts": self.restarts,
+            "progress": round(self.pages_done / self.pages_total, 4) if self.pages_total else 0.0,
+            "size": self.size,
+            "pruned": self.pruned,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+def database_path() -> str:
+    return make_url(DATABASE_URL).database
+
+
+def available_compressions() -> List[str]:
+    return [name for name in COMPRESSION_SUFFIXES if name != "zstd" or zstandard is not None]
+
+
+def _backup_endings():
+    for extension in KIND_EXTENSIONS.values():
+        for compression, suffix in COMPRESSION_SUFFIXES.items():
+            yield compression, extension + suffix
+
+
+def compression_of(filename: str) -> str:
+    for compression, ending in _backup_endings():
+        if compression != "none" and filename.endswith(ending):
+            return compression
+    return "none"
+
+
+def kind_of(filename: str) -> str:
+    return "incremental" if ".delta" in filename else "full"
+
+
+def is_backup_file(filename: str) -> bool:
+    return filename.startswith(BACKUP_PREFIX) and any(
+        filename.endswith(ending) for _, ending in _backup_endings()
+    )
+
+
+def _backup_filename(compression: str, kind: str = "full") -> str:
+    """Timestamped name, numbered when a backup was already taken in the same second"""
+    stem = f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    suffix = KIND_EXTENSIONS[kind] + COMPRESSION_SUFFIXES[compression]
+    filename, n = stem + suffix, 1
+    while os.path.exists(os.path.join(BACKUP_DIR, filename)):
+        n += 1
+        filename = f"{stem}_{n}{suffix}"
+    return filename
+
+
+def _copy_database(job: BackupJob, target: str):
+    """Paged online copy of the live database into target.
+
+    A write from another connection makes SQLite restart the copy. Under steady
+    write load a paged copy might never finish, so after MAX_RESTARTS the rest is
+    copied in a single step, which holds the read lock until it is done.
+    """
+    def progress(status, remaining, total):
+        done = total - remaining
+        if done < job.pages_done:
+            job.restarts += 1
+        job.pages_total = total
+        job.pages_done = done
+        if _cancel.is_set():
+            raise BackupCancelled()
+        if job.restarts >= MAX_RESTARTS:
+            raise _Restarted()
+        # Let writers in between steps
+        time.sleep(BACKUP_STEP_PAUSE)
+
+    src = sqlite3.connect(database_path())
+    # PRAGMA rather than a mode=ro URI, which would need the (often Windows) path escaped
+    src.execute("PRAGMA query_only = ON")
+    dst = sqlite3.connect(target)
+    try:
+        try:
+            src.backup(dst, pages=BACKUP_PAGES, progress=progress)
+        except _Restarted:
+            src.backup(dst)
+            job.pages_done = job.pages_total
+    finally:
+        dst.close()
+        src.close()
+
+
+def _open_output(path: str, compression: str) -> BinaryIO:
+    """Open a file for writing, compressing on the fly"""
+    if compression == "gzip":
+        return gzip.open(path, "wb", compresslevel=6)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(open(path, "wb"), closefd=True)
+    return open(path, "wb")
+
+
+def _compress(source: str, target: str, compression: str):
+    with open(source, "rb") as src, _open_output(target, compression) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def open_backup(path: str) -> BinaryIO:
+    """Open a backup for reading, decompressing it on the fly"""
+    compression = compression_of(os.path.basename(path))
+    if compression == "gzip":
+        return gzip.open(path, "rb")
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Restoring a .zst backup needs the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+
+# Manifests, page checksums and deltas
+
+def _manifest_path(filename: str) -> str:
+    return os.path.join(BACKUP_DIR, filename + ".json")
+
+
+def _hashes_path(filename: str) -> str:
+    return os.path.join(BACKUP_DIR, filename + ".pages")
+
+
+def read_manifest(filename: str) -> Optional[dict]:
+    """Manifest of a backup, or None for backups taken before manifests existed"""
+    try:
+        with open(_manifest_path(filename)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_manifest(filename: str, manifest: dict):
+    tmp_path = os.path.join(BACKUP_DIR, f"{TEMP_PREFIX}{uuid.uuid4().hex[:12]}.json")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, _manifest_path(filename))
+
+
+def _page_size(path: str) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _page_hashes(path: str, page_size: int) -> bytes:
+    """Concatenated BLAKE2b checksums of every page of a database file"""
+    hashes = bytearray()
+    with open(path, "rb") as f:
+        while True:
+            page = f.read(page_size)
+            if not page:
+                break
+            hashes += hashlib.blake2b(page, digest_size=PAGE_HASH_SIZE).digest()
+    return bytes(hashes)
+
+
+def _file_checksum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _snapshot_summary(path: str) -> dict:
+    """Row count of every table and a schema version (a hash of the schema's SQL)"""
+    conn = sqlite3.connect(path)
+    try:
+        schema = conn.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL ORDER BY type, name"
+        ).fetchall()
+        tables = [name for kind, name, _ in schema if kind == "table" and not name.startswith("sqlite_")]
+        row_counts = {table: conn.execute(f'SELECT count(*) FROM "{table}"').fetchone()[0] for table in tables}
+    finally:
+        conn.close()
+    schema_sql = "\n".join(sql for _, _, sql in schema)
+    return {
+        "row_counts": row_counts,
+        "schema_version": hashlib.sha256(schema_sql.encode()).hexdigest()[:16],
+    }
+
+
+def _changed_pages(hashes: bytes, parent_hashes: bytes) -> List[int]:
+    """1-based numbers of the pages whose checksum differs from the parent's"""
+    changed = []
+    for index in range(len(hashes) // PAGE_HASH_SIZE):
+        start = index * PAGE_HASH_SIZE
+        if hashes[start:start + PAGE_HASH_SIZE] != parent_hashes[start:start + PAGE_HASH_SIZE]:
+            changed.append(index + 1)
+    return changed
+
+
+def _write_delta(snapshot: str, target: str, compression: str, page_size: int, page_count: int,
+                 pages: List[int]):
+    with open(snapshot, "rb") as src, _open_output(target, compression) as dst:
+        dst.write(DELTA_MAGIC)
+        dst.write(_DELTA_HEADER.pack(page_size, page_count, len(pages)))
+        for page_number in pages:
+            src.seek((page_number - 1) * page_size)
+            dst.write(_PAGE_NUMBER.pack(page_number))
+            dst.write(src.read(page_size))
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise ValueError("Truncated incremental backup")
+        data += chunk
+    return data
+
+
+def _apply_delta(filename: str, target: str):
+    """Write the pages stored in an incremental backup into target"""
+    with open_backup(os.path.join(BACKUP_DIR, filename)) as src, open(target, "r+b") as dst:
+        if _read_exact(src, len(DELTA_MAGIC)) != DELTA_MAGIC:
+            raise ValueError(f"{filename} is not an incremental backup")
+        page_size, page_count, changed = _DELTA_HEADER.unpack(_read_exact(src, _DELTA_HEADER.size))
+        for _ in range(changed):
+            page_number, = _PAGE_NUMBER.unpack(_read_exact(src, _PAGE_NUMBER.size))
+            dst.seek((page_number - 1) * page_size)
+            dst.write(_read_exact(src, page_size))
+        dst.truncate(page_count * page_size)
+
+
+def backup_chain(filename: str) -> List[str]:
+    """The full backup an incremental one builds on, followed by every delta up to it"""
+    chain = [filename]
+    while kind_of(chain[0]) == "incremental":
+        manifest = read_manifest(chain[0])
+        parent = manifest.get("parent") if manifest else None
+        if not parent or not os.path.exists(os.path.join(BACKUP_DIR, parent)):
+            raise ValueError(f"Backup chain of {filename} is broken at {chain[0]}")
+        chain.insert(0, parent)
+    return chain
+
+
+def _incremental_parent() -> Optional[dict]:
+    """Catalogue entry of the newest backup, when a delta can be taken against it"""
+    with _catalog() as conn:
+        row = conn.execute(
+            "SELECT * FROM backups WHERE has_page_hashes ORDER BY created_at DESC LIMIT 1"
+        ).fetchone()
+    if row is None or row["depth"] >= MAX_CHAIN or not os.path.exists(_hashes_path(row["filename"])):
+        return None
+    return dict(row)
+
+
+def _materialize(filename: str, target: str):
+    """Rebuild the database a backup holds into target"""
+    chain = backup_chain(filename)
+    with open_backup(os.path.join(BACKUP_DIR, chain[0])) as src, open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    for delta in chain[1:]:
+        _apply_delta(delta, target)
+
+
+def _sqlite_copy(source: str, target: str):
+    """Copy one database file into another through the backup API, which takes
+    the proper locks and journals the write into target"""
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+# Archive snapshots
+
+def _archive_signature(path: str) -> Optional[str]:
+    """Identifies the archive's contents, or None when nothing has been archived.
+
+    The archive only changes by rows being added or removed, so their count
+    and ids are enough to tell two states apart.
+    """
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(path)
+    try:
+        if conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stock_movements'"
+        ).fetchone() is None:
+            return None
+        count, newest, total = conn.execute(
+            "SELECT count(*), coalesce(max(id), 0), coalesce(sum(id), 0) FROM stock_movements"
+        ).fetchone()
+    finally:
+        conn.close()
+    if not count:
+        return None
+    return hashlib.sha256(f"{count}:{newest}:{total}".encode()).hexdigest()[:16]
+
+
+def _snapshot_archive() -> Optional[str]:
+    """File name of a snapshot of the archive database in its current state, taking one if needed"""
+    if not ARCHIVE_ENABLED:
+        return None
+    signature = _archive_signature(ARCHIVE_PATH)
+    if signature is None:
+        return None
+    filename = f"{ARCHIVE_PREFIX}{signature}.db"
+    if os.path.exists(os.path.join(BACKUP_DIR, filename)):
+        return filename
+    copy_path = os.path.join(BACKUP_DIR, f"{TEMP_PREFIX}archive-{uuid.uuid4().hex[:12]}.db")
+    try:
+        _sqlite_copy(ARCHIVE_PATH, copy_path)
+        # Archiving may have run since the signature was read; name the copy by what it holds
+        filename = f"{ARCHIVE_PREFIX}{_archive_signature(copy_path)}.db"
+        os.replace(copy_path, os.path.join(BACKUP_DIR, filename))
+    finally:
+        if os.path.exists(copy_path):
+            os.remove(copy_path)
+    return filename
+
+
+def _reconcile_archive() -> int:
+    """Drop archived movements the restored database holds itself or never had; returns how many"""
+    if not ARCHIVE_ENABLED or _archive_signature(ARCHIVE_PATH) is None:
+        return 0
+    conn = sqlite3.connect(database_path())
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_PATH,))
+        with conn:
+            removed = conn.execute(
+                """
+                DELETE FROM archive.stock_movements
+                WHERE id IN (SELECT id FROM main.stock_movements)
+                   OR id > (SELECT coalesce(max(id), 0) FROM main.stock_movements)
+                """
+            ).rowcount
+    finally:
+        conn.close()
+    if removed:
+        logger.info("Removed %d archived stock movements the restored database does not match", removed)
+    return removed
+
+
+def _prune_archive_snapshots():
+    """Delete archive snapshots no manifest refers to any more"""
+    referenced = set()
+    for name in os.listdir(BACKUP_DIR):
+        if name.endswith(".json"):
+            manifest = read_manifest(name[:-len(".json")]) or {}
+            referenced.add(manifest.get("archive"))
+    for name in os.listdir(BACKUP_DIR):
+        if name.startswith(ARCHIVE_PREFIX) and name.endswith(".db") and name not in referenced:
+            os.remove(os.path.join(BACKUP_DIR, name))
+
+
+def restore_backup(filename: str) -> dict:
+    """Replace the live database with a backup.
+
+    The current database is first saved as a pre_restore backup. Compressed
+    and incremental backups are rebuilt into a temporary file, and every backup
+    is checked with PRAGMA quick_check before it overwrites anything. The
+    archive database is restored from the backup's snapshot, if it has one, and
+    reconciled with the restored database. Call this with no other connection
+    open, i.e. through maintenance.hot_swap().
+    """
+    backup_path = os.path.join(BACKUP_DIR, filename)
+    source = backup_path
+    if compression_of(filename) != "none" or kind_of(filename) == "incremental":
+        source = os.path.join(BACKUP_DIR, f"{TEMP_PREFIX}restore-{uuid.uuid4().hex[:12]}.db")
+    try:
+        if source != backup_path:
+            _materialize(filename, source)
+        check = sqlite3.connect(source)
+        try:
+            status = check.execute("PRAGMA quick_check").fetchone()[0]
+        finally:
+            check.close()
+        if status != "ok":
+            raise ValueError(f"Backup {filename} is damaged: {status}")
+
+        archive = (read_manifest(filename) or {}).get("archive")
+        if archive is not None and not os.path.exists(os.path.join(BACKUP_DIR, archive)):
+            raise ValueError(f"Archive snapshot {archive} of backup {filename} is missing")
+
+        current_backup = f"pre_restore_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+        _sqlite_copy(database_path(), os.path.join(BACKUP_DIR, current_backup))
+        current_archive = _snapshot_archive()
+        if current_archive is not None:
+            _write_manifest(current_backup, {"filename": current_backup, "archive": current_archive})
+        _sqlite_copy(source, database_path())
+        if archive is not None:
+            _sqlite_copy(os.path.join(BACKUP_DIR, archive), ARCHIVE_PATH)
+        reconciled = _reconcile_archive()
+    finally:
+        if source != backup_path and os.path.exists(source):
+            os.remove(source)
+    return {
+        "restored_from": filename,
+        "current_backup": current_backup,
+        "archive": archive,
+        "archive_rows_removed": reconciled,
+    }
+
+
+# Catalogue
+
+def _catalog_entry(filename: str, manifest: dict, size: int) -> dict:
+    return {
+        "filename": filename,
+        "kind": kind_of(filename),
+        "parent": manifest.get("parent"),
+        "base": manifest.get("base", filename),
+        "depth": manifest.get("depth", 0),
+        "size": size,
+        "page_size": manifest.get("page_size"),
+        "page_count": manifest.get("page_count"),
+        "changed_pages": manifest.get("changed_pages"),
+        "compression": compression_of(filename),
+        "checksum": manifest.get("checksum"),
+        "row_counts": json.dumps(manifest["row_counts"]) if manifest.get("row_counts") else None,
+        "schema_version": manifest.get("schema_version"),
+        "has_page_hashes": int(bool(manifest) and os.path.exists(_hashes_path(filename))),
+        "created_at": manifest.get("created_at"),
+    }
+
+
+def _save_entries(conn: sqlite3.Connection, entries: List[dict]):
+    placeholders = ", ".join(f":{column}" for column in _CATALOG_COLUMNS)
+    conn.executemany(
+        f"INSERT OR REPLACE INTO backups ({', '.join(_CATALOG_COLUMNS)}) VALUES ({placeholders})", entries
+    )
+
+
+def _open_catalog() -> sqlite3.Connection:
+    conn = sqlite3.connect(CATALOG_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+@contextmanager
+def _catalog():
+    """Connection to the catalogue; the first use creates it, filling it from the directory"""
+    global _catalog_ready
+    if not (_catalog_ready and os.path.exists(CATALOG_PATH)):
+        with _catalog_lock:
+            if not (_catalog_ready and os.path.exists(CATALOG_PATH)):
+                os.makedirs(BACKUP_DIR, exist_ok=True)
+                created = not os.path.exists(CATALOG_PATH)
+                conn = _open_catalog()
+                try:
+                    conn.executescript(_CATALOG_SCHEMA)
+                finally:
+                    conn.close()
+                if created:
+                    rebuild_catalog()
+                _catalog_ready = True
+    conn = _open_catalog()
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def rebuild_catalog() -> dict:
+    """Bring the catalogue in line with the backup directory.
+
+    Picks up backups copied in by hand or taken before the catalogue existed
+    (from their manifests, or the file alone) and drops entries whose file is gone.
+    """
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    conn = _open_catalog()
+    try:
+        with conn:
+            conn.executescript(_CATALOG_SCHEMA)
+            known = {row[0] for row in conn.execute("SELECT filename FROM backups")}
+            on_disk = {filename for filename in os.listdir(BACKUP_DIR) if is_backup_file(filename)}
+            added = []
+            for filename in sorted(on_disk - known):
+                file_stat = os.stat(os.path.join(BACKUP_DIR, filename))
+                entry = _catalog_entry(filename, read_manifest(filename) or {}, file_stat.st_size)
+                entry["created_at"] = entry["created_at"] or datetime.fromtimestamp(file_stat.st_ctime).isoformat()
+                added.append(entry)
+            _save_entries(conn, added)
+            removed = sorted(known - on_disk)
+            conn.executemany("DELETE FROM backups WHERE filename = ?", [(filename,) for filename in removed])
+    finally:
+        conn.close()
+    return {"added": len(added), "removed": len(removed)}
+
+
+def _entry_dict(row: sqlite3.Row) -> dict:
+    backup = dict(row)
+    backup["row_counts"] = json.loads(backup["row_counts"]) if backup["row_counts"] else None
+    backup["database_size"] = (backup["page_count"] or 0) * (backup["page_size"] or 0) or None
+    backup["has_page_hashes"] = bool(backup["has_page_hashes"])
+    return backup
+
+
+def list_backups(skip: int = 0, limit: Optional[int] = None) -> List[dict]:
+    """Backups with their lineage, newest first.
+
+    chain_size is what a restore reads: the base and every delta up to the backup.
+    """
+    with _catalog() as conn:
+        rows = conn.execute(
+            """
+            SELECT b.*, (
+                SELECT sum(c.size) FROM backups c WHERE c.base = b.base AND c.depth <= b.depth
+            ) AS chain_size
+            FROM backups b ORDER BY b.created_at DESC LIMIT ? OFFSET ?
+            """,
+            (-1 if limit is None else limit, skip),
+        ).fetchall()
+    return [_entry_dict(row) for row in rows]
+
+
+def count_backups() -> int:
+    with _catalog() as conn:
+        return conn.execute("SELECT count(*) FROM backups").fetchone()[0]
+
+
+def latest_backup() -> Optional[dict]:
+    backup_list = list_backups(limit=1)
+    return backup_list[0] if backup_list else None
+
+
+def prune_backups(keep: int = KEEP_CHAINS) -> List[str]:
+    """Delete all but the newest `keep` full backups and the incrementals built on them"""
+    if keep <= 0:
+        return []
+    with _catalog() as conn:
+        rows = conn.execute(
+            """
+            SELECT filename FROM backups WHERE base NOT IN (
+                SELECT filename FROM backups WHERE depth = 0 ORDER BY created_at DESC LIMIT ?
+            )
+            """,
+            (keep,),
+        ).fetchall()
+        deleted = [row["filename"] for row in rows]
+        for filename in deleted:
+            for path in (os.path.join(BACKUP_DIR, filename), _manifest_path(filename), _hashes_path(filename)):
+                if os.path.exists(path):
+                    os.remove(path)
+        conn.executemany("DELETE FROM backups WHERE filename = ?", [(filename,) for filename in deleted])
+    if deleted:
+        _prune_archive_snapshots()
+    return deleted
+
+
+def run_backup(job: BackupJob) -> BackupJob:
+    """Take the backup described by job; updates the job as it goes"""
+    if _cancel.is_set():
+        job.status = "cancelled"
+        job.finished_at = datetime.now()
+        return job
+
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    job.started_at = datetime.now()
+    copy_path = os.path.join(BACKUP_DIR, f"{TEMP_PREFIX}{job.id}.db")
+    output_path = os.path.join(BACKUP_DIR, f"{TEMP_PREFIX}{job.id}.part")
+    try:
+        job.status = "copying"
+        _copy_database(job, copy_path)
+        # After the main copy: rows archived in between are then in both, which a restore reconciles
+        archive = _snapshot_archive()
+
+        job.status = "hashing"
+        page_size = _page_size(copy_path)
+        hashes = _page_hashes(copy_path, page_size)
+        page_count = len(hashes) // PAGE_HASH_SIZE
+        summary = _snapshot_summary(copy_path)
+        parent = _incremental_parent() if job.kind == "incremental" else None
+        if parent is None or parent["page_size"] != page_size:
+            # Nothing to build on: first backup, chain at MAX_CHAIN or page size changed
+            parent = None
+            job.kind = "full"
+
+        job.status = "writing"
+        if parent is not None:
+            with open(_hashes_path(parent["filename"]), "rb") as f:
+                changed = _changed_pages(hashes, f.read())
+            _write_delta(copy_path, output_path, job.compression, page_size, page_count, changed)
+            job.parent = parent["filename"]
+            job.changed_pages = len(changed)
+        elif job.compression != "none":
+            _compress(copy_path, output_path, job.compression)
+        else:
+            os.replace(copy_path, output_path)
+
+        job.filename = _backup_filename(job.compression, job.kind)
+        with open(_hashes_path(job.filename), "wb") as f:
+            f.write(hashes)
+        manifest = {
+            "filename": job.filename,
+            "kind": job.kind,
+            "parent": job.parent,
+            "base": parent["base"] if parent else job.filename,
+            "depth": parent["depth"] + 1 if parent else 0,
+            "page_size": page_size,
+            "page_count": page_count,
+            "changed_pages": job.changed_pages,
+            "compression": job.compression,
+            "checksum": _file_checksum(output_path),
+            "archive": archive,
+            **summary,
+            "created_at": job.started_at.isoformat(),
+        }
+        _write_manifest(job.filename, manifest)
+        os.replace(output_path, os.path.join(BACKUP_DIR, job.filename))
+        job.size = os.path.getsize(os.path.join(BACKUP_DIR, job.filename))
+        with _catalog() as conn:
+            _save_entries(conn, [_catalog_entry(job.filename, manifest, job.size)])
+        job.pruned = prune_backups()
+        job.status = "completed"
+    except BackupCancelled:
+        job.status = "cancelled"
+    except Exception as exc:
+        logger.exception("Backup %s failed", job.id)
+        job.status = "failed"
+        job.error = str(exc)
+    finally:
+        for path in (copy_path, output_path):
+            if os.path.exists(path):
+                os.remove(path)
+        job.finished_at = datetime.now()
+    return job
+
+
+def start_backup(compression: Optional[str] = None, mode: Optional[str] = None) -> BackupJob:
+    """Queue a backup on the background worker; backups run one at a time"""
+    global _executor
+    compression = compression or BACKUP_COMPRESSION
+    mode = mode or BACKUP_MODE
+    if compression not in available_compressions():
+        raise ValueError(
+            f"Unsupported compression '{compression}'; available: {', '.join(available_compressions())}"
+        )
+    if mode not in BACKUP_MODES:
+        raise ValueError(f"Unsupported backup mode '{mode}'; available: {', '.join(BACKUP_MODES)}")
+    job = BackupJob(compression, mode)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        finished = [job_id for job_id, queued in _jobs.items() if queued.finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del _jobs[job_id]
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ims-backup")
+        _executor.submit(run_backup, job)
+    return job
+
+
+def get_job(job_id: str) -> Optional[BackupJob]:
+    return _jobs.get(job_id)
+
+
+def list_jobs() -> List[Dict]:
+    """Known jobs, newest first"""
+    with _jobs_lock:
+        jobs = list(_jobs.values())
+    return [job.as_dict() for job in reversed(jobs)]
+
+
+def wait_for_jobs(timeout: float) -> bool:
+    """Wait until no backup is queued or running; False on timeout"""
+    deadline = time.monotonic() + timeout
+    while True:
+        with _jobs_lock:
+            pending = any(not job.finished for job in _jobs.values())
+        if not pending:
+            return True
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.1)
+
+
+def shutdown():
+    """Abort the running backup and mark queued ones cancelled"""
+    global _executor
+    with _jobs_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        _cancel.set()
+        executor.shutdown(wait=True)
+        _cancel.clear()
@@ -0,0 +1,126 @@
+"""Weak ETags for list and detail endpoints, from per-table version counters.
+
+Every INSERT, UPDATE or DELETE is noted against its table on the connection
+that ran it, and the table's version goes up when that transaction commits:
+once as the COMMIT is issued and once more when the connection goes back to
+the pool, after it. A reader that takes its ETag between the two cannot keep
+data older than the ETag it was served. An endpoint guarded by conditional()
+gets an ETag made of the versions of the tables it reads, and a request whose
+If-None-Match holds that ETag is answered 304 before the endpoint runs, so
+nothing is queried or serialized. A restore bumps every table, and new image
+variants bump products.
+
+The counters only see writes made by this process, so ETags are on by default
+for SQLite only; IMS_ETAGS=1 enables them elsewhere (e.g. a single app
+instance on PostgreSQL), 0 disables them.
+"""
+
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, Optional
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+from . import database
+from .images import on_variants_written
+from .maintenance import register_warmup
+
+ETAGS_ENABLED = os.getenv("IMS_ETAGS", "1" if database.IS_SQLITE else "0") != "0"
+# Browsers keep the response but revalidate it on every use
+CACHE_CONTROL = "no-cache"
+
+_PENDING = "etag_pending_tables"
+_COMMITTED = "etag_committed_tables"
+
+# Counters restart with the process; the start time keeps old ETags from matching
+_epoch = format(int(time.time()), "x")
+_generation = 0
+_versions: Dict[str, int] = defaultdict(int)
+_lock = threading.Lock()
+
+
+def bump(tables: Iterable[str]):
+    with _lock:
+        for table in tables:
+            _versions[table] += 1
+
+
+def current_etag(tables: Iterable[str]) -> str:
+    versions = ".".join(str(_versions.get(table, 0)) for table in tables)
+    return f'W/"{_epoch}-{_generation}-{versions}"'
+
+
+def _matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison: W/"x" and "x" are the same validator
+    opaque = etag[2:]
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in header.split(","))
+
+
+def conditional(*tables: str):
+    """Route dependency: 304 when If-None-Match holds the current ETag of tables, else set it"""
+    def check(request: Request, response: Response):
+        if not ETAGS_ENABLED:
+            return
+        etag = current_etag(tables)
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        if _matches(request.headers.get("if-none-match"), etag):
+            raise HTTPException(status_code=304, headers=headers)
+        response.headers.update(headers)
+    return check
+
+
+@register_warmup
+def _invalidate_after_swap():
+    # A restore replaces every table without going through the engines
+    global _generation
+    with _lock:
+        _generation += 1
+
+
+@on_variants_written
+def _invalidate_products(names):
+    # A product's thumbnail_url / medium_url appear once its variants are written
+    bump(["products"])
+
+
+# Tracking writes
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _note_written_table(conn, cursor, statement, parameters, context, executemany):
+    if not (context.isinsert or context.isupdate or context.isdelete):
+        return
+    table = getattr(getattr(context.compiled, "statement", None), "table", None)
+    name = getattr(table, "name", None)
+    if name is not None:
+        conn.info.setdefault(_PENDING, set()).add(name)
+
+
+@event.listens_for(Engine, "commit")
+def _bump_on_commit(conn):
+    tables = conn.info.pop(_PENDING, None)
+    if tables:
+        bump(tables)
+        conn.info.setdefault(_COMMITTED, set()).update(tables)
+
+
+@event.listens_for(Engine, "rollback")
+def _discard_on_rollback(conn):
+    conn.info.pop(_PENDING, None)
+
+
+@event.listens_for(Pool, "checkin")
+def _bump_after_commit(dbapi_connection, connection_record):
+    if connection_record is None:
+        return
+    tables = connection_record.info.pop(_COMMITTED, None)
+    if tables:
+        bump(tables)
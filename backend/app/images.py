@@ -0,0 +1,199 @@
+"""Resized WebP variants of uploaded product images.
+
+Every original in the uploads dir can have a thumbnail and a medium-size
+variant next to it, named <name>_thumb.<hash>.webp and <name>_md.<hash>.webp
+after their own content: /uploads is cached as immutable, so a regenerated
+variant that came out different gets a new name rather than overwriting the
+old file (variants from before the hash, <name>_thumb.webp, are still served).
+Variants are generated on a small background thread pool after upload, so the
+request does not wait for the resize. Pillow is optional: without it no
+variants are made and clients fall back to the original.
+
+Which variants exist is kept in memory (listed at startup, then updated as
+variants are written or collected), so serializing a product derives its
+variant URLs without touching the disk. When an image has several files for
+one variant, the newest is served; the upload GC removes the others.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .paths import get_data_dir
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - Pillow is optional
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = get_data_dir('uploads')
+UPLOAD_URL_PREFIX = "/uploads/"
+# In-progress writes in the uploads dir; renamed into place when complete
+TEMP_PREFIX = ".upload-"
+
+# Longest edge in pixels; images are never upscaled
+VARIANTS: Dict[str, int] = {
+    "thumb": 160,
+    "md": 640,
+}
+WEBP_QUALITY = 80
+IMAGE_WORKERS = int(os.getenv("IMS_IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hex digits of the content hash in a variant's name
+DIGEST_LENGTH = 12
+
+_VARIANT_RE = re.compile(r"^(.+)_(%s)(?:\.[0-9a-f]+)?\.webp$" % "|".join(VARIANTS))
+
+_executor: Optional[ThreadPoolExecutor] = None
+# (original stem, variant) -> (mtime, name) of the newest file for it
+_available: Dict[Tuple[str, str], Tuple[float, str]] = {}
+_available_lock = threading.Lock()
+_written_hooks: List[Callable[[List[str]], None]] = []
+
+
+def variants_enabled() -> bool:
+    return Image is not None
+
+
+def variant_filename(filename: str, variant: str, digest: str) -> str:
+    stem = os.path.splitext(filename)[0]
+    return f"{stem}_{variant}.{digest}.webp"
+
+
+def _variant_key(filename: str) -> Optional[Tuple[str, str]]:
+    match = _VARIANT_RE.match(filename)
+    return (match.group(1), match.group(2)) if match else None
+
+
+def is_variant(filename: str) -> bool:
+    return _variant_key(filename) is not None
+
+
+def variant_url(image_url: Optional[str], variant: str) -> Optional[str]:
+    """URL of a variant of an uploaded image, or None when it has not been generated"""
+    if not image_url or not image_url.startswith(UPLOAD_URL_PREFIX):
+        return None
+    stem = os.path.splitext(image_url[len(UPLOAD_URL_PREFIX):])[0]
+    current = _available.get((stem, variant))
+    if current is None:
+        return None
+    return UPLOAD_URL_PREFIX + current[1]
+
+
+def load_variants():
+    """List the variants already in UPLOAD_DIR; run once at startup"""
+    with _available_lock:
+        _available.clear()
+    for entry in os.scandir(UPLOAD_DIR):
+        if entry.is_file() and is_variant(entry.name):
+            record_variant(entry.name, entry.stat().st_mtime)
+
+
+def record_variant(name: str, mtime: float):
+    """Note a variant file; the newest one per image and variant is served"""
+    key = _variant_key(name)
+    if key is None:
+        return
+    with _available_lock:
+        current = _available.get(key)
+        if current is None or (mtime, name) > current:
+            _available[key] = (mtime, name)
+
+
+def forget_variant(name: str):
+    key = _variant_key(name)
+    with _available_lock:
+        if key is not None and _available.get(key, (0, None))[1] == name:
+            del _available[key]
+
+
+def superseded_at(name: str) -> Optional[float]:
+    """mtime of the newer file that replaced variant `name`, or None while it is the one served"""
+    current = _available.get(_variant_key(name))
+    if current is None or current[1] == name:
+        return None
+    return current[0]
+
+
+def on_variants_written(hook: Callable[[List[str]], None]) -> Callable[[List[str]], None]:
+    """Call hook with the names of variants that became the ones served, e.g. to invalidate cached responses"""
+    _written_hooks.append(hook)
+    return hook
+
+
+def _write_variant(data: bytes, target: str):
+    # Same atomic write as uploads, so a half-written variant is never served
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, prefix=TEMP_PREFIX, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            buffer.write(data)
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def generate_variants(filename: str, force: bool = False) -> List[str]:
+    """Write the WebP variants of an uploaded image; returns the files written"""
+    if not variants_enabled():
+        return []
+    source = os.path.join(UPLOAD_DIR, filename)
+    stem = os.path.splitext(filename)[0]
+    written, served = [], []
+    try:
+        with Image.open(source) as image:
+            # Apply camera rotation before the EXIF data is dropped
+            image = ImageOps.exif_transpose(image)
+            image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+            for variant, size in VARIANTS.items():
+                if not force and (stem, variant) in _available:
+                    continue
+                resized = image.copy()
+                resized.thumbnail((size, size), Image.LANCZOS)
+                encoded = io.BytesIO()
+                resized.save(encoded, "WEBP", quality=WEBP_QUALITY, method=4)
+                data = encoded.getvalue()
+                name = variant_filename(filename, variant, hashlib.sha256(data).hexdigest()[:DIGEST_LENGTH])
+                target = os.path.join(UPLOAD_DIR, name)
+                if os.path.exists(target):
+                    # Came out the same as before: keep the file, it is the current one again
+                    os.utime(target)
+                else:
+                    _write_variant(data, target)
+                    written.append(name)
+                record_variant(name, os.path.getmtime(target))
+                served.append(name)
+    except Exception as exc:
+        # Uploads are untrusted: besides OSError, Pillow raises DecompressionBombError,
+        # SyntaxError and others for malformed or hostile files
+        logger.warning("Could not create variants for %s: %r", filename, exc)
+    if served:
+        for hook in _written_hooks:
+            hook(served)
+    return written
+
+
+def schedule_variants(filename: str) -> Optional[Future]:
+    """Generate the variants of a new upload in the background"""
+    global _executor
+    if not variants_enabled():
+        return None
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="ims-images")
+    return _executor.submit(generate_variants, filename)
+
+
+def shutdown():
+    """Finish queued variant jobs and stop the worker threads"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
@@ -0,0 +1,146 @@
+"""Maintenance windows for operations that replace the database under the app.
+
+hot_swap() closes a gate that answers new API requests with 503, pauses the
+scheduler, waits for in-flight requests, backup jobs and queued writes to
+finish, stops the writer (later writes wait in its queue) and disposes
+every engine's pool so no connection still points at the old file. It then runs
+the operation, brings the schema up to date, reopens the pools, runs the
+registered warmup hooks and reports how long each phase took.
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+from . import database
+from .writer import write_queue
+
+logger = logging.getLogger(__name__)
+
+# How long in-flight requests get to finish before the swap is given up
+DRAIN_TIMEOUT = 30.0
+# Seconds clients are told to wait before retrying during maintenance
+RETRY_AFTER = 5
+
+# Tables scanned after a swap so their pages are back in the OS cache
+WARM_TABLES = ("categories", "products", "product_images", "sales", "sales_items", "stock_movements", "settings")
+
+_warmup_hooks: List[Callable[[], None]] = []
+
+
+class MaintenanceGate:
+    def __init__(self):
+        self.active = False
+        self.in_flight = 0
+        # API requests seen since startup; the scheduler derives the request rate from it
+        self.requests = 0
+        self.reason = ""
+
+    @contextmanager
+    def track(self):
+        """Count a request as in flight for the duration of the block"""
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    async def drain(self, keep: int = 0, timeout: float = DRAIN_TIMEOUT) -> bool:
+        """Wait until at most `keep` requests are in flight; False on timeout"""
+        deadline = time.monotonic() + timeout
+        while self.in_flight > keep:
+            if time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+
+gate = MaintenanceGate()
+
+
+def register_warmup(hook: Callable[[], None]) -> Callable[[], None]:
+    """Run hook (on the thread pool) after every swap, e.g. to rebuild an in-memory cache"""
+    _warmup_hooks.append(hook)
+    return hook
+
+
+def _engines():
+    return [database.engine, database.read_engine, database.writer_engine]
+
+
+@register_warmup
+def _warm_pages():
+    # Open a connection on each pool and read the main tables back into the page cache
+    for engine in _engines():
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    with database.read_engine.connect() as conn:
+        for table in WARM_TABLES:
+            conn.execute(text(f"SELECT count(*) FROM {table}"))
+
+
+def _timed(timings: Dict[str, float], phase: str, started: float) -> float:
+    now = time.perf_counter()
+    timings[f"{phase}_ms"] = round((now - started) * 1000, 1)
+    return now
+
+
+async def hot_swap(operation: Callable[[], object], reason: str, keep: int = 1) -> dict:
+    """Run operation() with the database to itself and return the phase timings.
+
+    `keep` is the number of in-flight requests not waited for, normally the
+    request that asked for the swap.
+    """
+    from . import backups
+    from .scheduler import scheduler
+
+    if gate.active:
+        raise RuntimeError(f"Maintenance already in progress ({gate.reason})")
+    timings: Dict[str, float] = {}
+    started = phase_start = time.perf_counter()
+    gate.active, gate.reason = True, reason
+    paused = False
+    try:
+        # Scheduled tasks and backup jobs use the database outside of any request
+        paused = await scheduler.pause(DRAIN_TIMEOUT)
+        if not paused:
+            raise RuntimeError("A scheduled task is still running after the drain timeout; try again")
+        if not await gate.drain(keep=keep):
+            raise RuntimeError("Requests still running after the drain timeout; try again")
+        if not await run_in_threadpool(backups.wait_for_jobs, DRAIN_TIMEOUT):
+            raise RuntimeError("A backup is still running after the drain timeout; try again")
+        await run_in_threadpool(write_queue.stop)
+        phase_start = _timed(timings, "drain", phase_start)
+
+        for engine in _engines():
+            engine.dispose()
+        if database.async_engine is not None:
+            await database.async_engine.dispose()
+        phase_start = _timed(timings, "dispose", phase_start)
+
+        result = await run_in_threadpool(operation)
+        phase_start = _timed(timings, "operation", phase_start)
+
+        # The swapped-in database may predate the current schema
+        await run_in_threadpool(database.create_tables)
+        phase_start = _timed(timings, "migrate", phase_start)
+
+        for hook in _warmup_hooks:
+            try:
+                await run_in_threadpool(hook)
+            except Exception:
+                logger.exception("Warmup hook %s failed", getattr(hook, "__name__", hook))
+        _timed(timings, "warmup", phase_start)
+    finally:
+        write_queue.start()
+        if paused:
+            scheduler.resume()
+        gate.active, gate.reason = False, ""
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return {"result": result, "timings": timings}
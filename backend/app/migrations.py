@@ -0,0 +1,185 @@
+"""Data migrations run at startup, after create_all has added any new tables.
+
+Each migration is idempotent: it only touches rows still in the old shape, so
+running it on every start costs one cheap query once the data is migrated.
+"""
+
+import json
+import logging
+import time
+from typing import List
+
+from sqlalchemy import MetaData, bindparam, func, insert, inspect, select, update
+from sqlalchemy.engine import Connection, Engine
+
+from .database import Base
+from .models import DEFAULT_SETTINGS, Category, Product, ProductImage, Settings, default_setting_description
+
+logger = logging.getLogger(__name__)
+
+
+def _json_urls(value: str):
+    try:
+        urls = json.loads(value)
+    except ValueError:
+        return []
+    if not isinstance(urls, list):
+        return []
+    # Identical files share one URL; list each once
+    return list(dict.fromkeys(url for url in urls if isinstance(url, str) and url))
+
+
+def create_missing_indexes(conn: Connection, metadata: MetaData = Base.metadata):
+    """create_all skips tables that already exist, so add indexes declared on them since"""
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def add_missing_columns(conn: Connection) -> List[str]:
+    """create_all skips tables that already exist, so add columns declared on them since.
+
+    New columns need a server default (or to be nullable) to be added to a
+    table that already has rows. Returns the added columns as table.column.
+    """
+    inspector = inspect(conn)
+    ddl = conn.dialect.ddl_compiler(conn.dialect, None)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl.get_column_specification(column)}")
+                added.append(f"{table.name}.{column.name}")
+    if added:
+        logger.info("Added columns: %s", ", ".join(added))
+    return added
+
+
+def rebuild_category_counts(conn: Connection, fix: bool = True) -> List[dict]:
+    """Compare the category product counters with the products table.
+
+    Returns the categories whose counters are off, with the stored and actual
+    values, and corrects them unless fix is False.
+    """
+    actual = {
+        row.category_id: row
+        for row in conn.execute(
+            select(
+                Product.category_id,
+                func.count().label("product_count"),
+                func.count().filter(Product.is_active.isnot(False)).label("active_product_count"),
+            ).group_by(Product.category_id)
+        )
+    }
+    drift = []
+    for category in conn.execute(select(Category.id, Category.product_count, Category.active_product_count)):
+        row = actual.get(category.id)
+        expected = (row.product_count, row.active_product_count) if row else (0, 0)
+        if (category.product_count, category.active_product_count) != expected:
+            drift.append({
+                "category_id": category.id,
+                "product_count": category.product_count,
+                "active_product_count": category.active_product_count,
+                "expected_product_count": expected[0],
+                "expected_active_product_count": expected[1],
+            })
+    if fix and drift:
+        categories = Category.__table__
+        conn.execute(
+            update(categories)
+            .where(categories.c.id == bindparam("category_id"))
+            .values(
+                product_count=bindparam("expected_product_count"),
+                active_product_count=bindparam("expected_active_product_count"),
+                # A counter change is not an edit of the category
+                updated_at=categories.c.updated_at,
+            ),
+            [
+                {key: entry[key] for key in ("category_id", "expected_product_count", "expected_active_product_count")}
+                for entry in drift
+            ],
+        )
+        logger.info("Corrected product counters of %d categories", len(drift))
+    return drift
+
+
+def migrate_product_images(conn: Connection) -> int:
+    """Move the legacy products.images JSON lists into product_images rows.
+
+    The JSON column is cleared as each product is migrated, so products that
+    already have rows are never migrated twice. Returns the rows inserted.
+    """
+    products = conn.execute(
+        select(Product.id, Product.image_url, Product.images_json.label("images"))
+        .where(Product.images_json.isnot(None))
+    ).all()
+    if not products:
+        return 0
+
+    migrated = set(conn.execute(
+        select(ProductImage.product_id).distinct()
+        .where(ProductImage.product_id.in_([product.id for product in products]))
+    ).scalars())
+    rows = [
+        {
+            "product_id": product.id,
+            "url": url,
+            "position": position,
+            "is_primary": url == product.image_url,
+        }
+        for product in products if product.id not in migrated
+        for position, url in enumerate(_json_urls(product.images))
+    ]
+    if rows:
+        conn.execute(ProductImage.__table__.insert(), rows)
+    conn.execute(
+        update(Product.__table__)
+        .where(Product.__table__.c.id.in_([product.id for product in products]))
+        .values(images=None)
+    )
+    logger.info("Migrated %d product images from %d products", len(rows), len(products))
+    return len(rows)
+
+
+def seed_default_settings(conn: Connection) -> int:
+    """Insert the default settings that are missing, so reads never have to"""
+    existing = set(conn.execute(select(Settings.key).where(Settings.key.in_(DEFAULT_SETTINGS))).scalars())
+    rows = [
+        {"key": key, "value": value, "description": default_setting_description(key)}
+        for key, value in DEFAULT_SETTINGS.items()
+        if key not in existing
+    ]
+    if rows:
+        conn.execute(insert(Settings), rows)
+    return len(rows)
+
+
+def enable_incremental_vacuum(engine: Engine) -> bool:
+    """Switch an SQLite database to auto_vacuum=INCREMENTAL, so the scheduler's
+    incremental_vacuum task can hand free pages back to the file system.
+
+    The mode of an existing database only changes with a VACUUM, which
+    rewrites the file once; returns whether that happened.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+            return False
+        conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        started = time.perf_counter()
+        conn.exec_driver_sql("VACUUM")
+    logger.info("Switched the database to incremental auto_vacuum in %.1fs", time.perf_counter() - started)
+    return True
+
+
+def run_migrations(engine: Engine):
+    """Apply every data migration in one transaction"""
+    with engine.begin() as conn:
+        added = add_missing_columns(conn)
+        create_missing_indexes(conn)
+        migrate_product_images(conn)
+        seed_default_settings(conn)
+        if "categories.product_count" in added:
+            rebuild_category_counts(conn)
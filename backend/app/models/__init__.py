@@ -1,5 +1,8 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, ForeignKey, Boolean
-from sqlalchemy.orm import relationship
+import json
+
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, ForeignKey, Boolean, Index, UniqueConstraint
+from sqlalchemy import event, inspect, update
+from sqlalchemy.orm import column_property, relationship
 from sqlalchemy.sql import func
 from app.database import Base
 
@@ -10,6 +13,10 @@ class Category(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), unique=True, index=True, nullable=False)
     description = Column(Text, nullable=True)
+    # Kept up to date on every product insert, update and delete (see the Product
+    # mapper events below); app.migrations.rebuild_category_counts recomputes them
+    product_count = Column(Integer, nullable=False, default=0, server_default="0")
+    active_product_count = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -25,15 +32,17 @@ class Product(Base):
     description = Column(Text, nullable=True)
     sku = Column(String(100), unique=True, index=True, nullable=False)
     barcode = Column(String(100), unique=True, nullable=True)
-    category_id = Column(Integer, ForeignKey("categories.id"), nullable=False)
+    # active_history: the category counters need the old value even when it was not loaded
+    category_id = column_property(Column(Integer, ForeignKey("categories.id"), nullable=False), active_history=True)
     price = Column(Float, nullable=False)
     cost = Column(Float, nullable=False)
     stock_quantity = Column(Integer, default=0)
     min_stock_level = Column(Integer, default=10)
     unit = Column(String(50), default="pcs")
-    image_url = Column(String(500), nullable=True)  # Main product image URL/path
-    images = Column(Text, nullable=True)  # JSON array of multiple images
-    is_active = Column(Boolean, default=True)
+    image_url = Column(String(500), index=True, nullable=True)  # Main product image URL/path
+    # Legacy JSON array of images; moved into product_images at startup
+    images_json = Column("images", Text, nullable=True)
+    is_active = column_property(Column(Boolean, default=True), active_history=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -41,6 +50,98 @@ class Product(Base):
     category = relationship("Category", back_populates="products")
     sales_items = relationship("SalesItem", back_populates="product")
     stock_movements = relationship("StockMovement", back_populates="product")
+    product_images = relationship(
+        "ProductImage", back_populates="product", cascade="all, delete-orphan",
+        order_by="ProductImage.position"
+    )
+
+    @property
+    def images(self):
+        """Image URLs in display order as a JSON string, the format the API has always used"""
+        if not self.product_images:
+            return None
+        return json.dumps([image.url for image in self.product_images])
+
+    @images.setter
+    def images(self, value):
+        urls = json.loads(value) if value else []
+        # Keep the rows of images still listed; (product_id, url) is unique
+        current = {image.url: image for image in self.product_images}
+        rows = []
+        # Identical files share one URL; list each once
+        for position, url in enumerate(dict.fromkeys(urls)):
+            image = current.get(url) or ProductImage(url=url)
+            image.position = position
+            image.is_primary = url == self.image_url
+            rows.append(image)
+        self.product_images = rows
+
+
+class ProductImage(Base):
+    __tablename__ = "product_images"
+    __table_args__ = (UniqueConstraint("product_id", "url"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    url = Column(String(500), index=True, nullable=False)
+    position = Column(Integer, nullable=False, default=0)
+    is_primary = Column(Boolean, default=False)  # Same image as Product.image_url
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    # Relationships
+    product = relationship("Product", back_populates="product_images")
+
+
+# Category product counters. These run inside the flush, on the same connection,
+# so the counters commit or roll back together with the product change. Bulk
+# statements skip mapper events and call adjust_category_counts themselves.
+
+def _is_active(value) -> bool:
+    # None until the insert applies the column default (True)
+    return value is None or bool(value)
+
+
+def adjust_category_counts(connection, category_id, products: int, active: int):
+    if category_id is None or not (products or active):
+        return
+    categories = Category.__table__
+    connection.execute(
+        update(categories)
+        .where(categories.c.id == category_id)
+        .values(
+            product_count=categories.c.product_count + products,
+            active_product_count=categories.c.active_product_count + active,
+            # A counter change is not an edit of the category
+            updated_at=categories.c.updated_at,
+        )
+    )
+
+
+@event.listens_for(Product, "after_insert")
+def _count_inserted_product(mapper, connection, target):
+    adjust_category_counts(connection, target.category_id, 1, int(_is_active(target.is_active)))
+
+
+@event.listens_for(Product, "after_delete")
+def _count_deleted_product(mapper, connection, target):
+    adjust_category_counts(connection, target.category_id, -1, -int(_is_active(target.is_active)))
+
+
+@event.listens_for(Product, "after_update")
+def _count_updated_product(mapper, connection, target):
+    state = inspect(target)
+    category_history = state.attrs.category_id.history
+    active_history = state.attrs.is_active.history
+    if not (category_history.has_changes() or active_history.has_changes()):
+        return
+    old_category = category_history.deleted[0] if category_history.deleted else target.category_id
+    was_active = _is_active(active_history.deleted[0] if active_history.deleted else target.is_active)
+    is_active = _is_active(target.is_active)
+    if old_category == target.category_id:
+        adjust_category_counts(connection, old_category, 0, int(is_active) - int(was_active))
+    else:
+        adjust_category_counts(connection, old_category, -1, -int(was_active))
+        adjust_category_counts(connection, target.category_id, 1, int(is_active))
 
 
 class Sale(Base):
@@ -77,6 +178,8 @@ class SalesItem(Base):
 
 class StockMovement(Base):
     __tablename__ = "stock_movements"
+    # A product's history in date order, for paging and point-in-time stock
+    __table_args__ = (Index("ix_stock_movements_product_created", "product_id", "created_at"),)
 
     id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
@@ -92,6 +195,21 @@ class StockMovement(Base):
     product = relationship("Product", back_populates="stock_movements")
 
 
+class StockCheckpoint(Base):
+    """A product's stock level at a point in time, so balances can be worked
+    out without the movements before it (which may have been archived)"""
+    __tablename__ = "stock_checkpoints"
+    __table_args__ = (UniqueConstraint("product_id", "as_of"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    as_of = Column(DateTime(timezone=True), nullable=False)
+    stock = Column(Integer, nullable=False)
+    # Last movement the stock level includes; later movements have higher ids
+    movement_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 class Return(Base):
     __tablename__ = "returns"
 
@@ -126,6 +244,28 @@ class ReturnItem(Base):
     product = relationship("Product")
 
 
+# Seeded on startup (app.migrations.seed_default_settings) and by POST /api/settings/reset
+DEFAULT_SETTINGS = {
+    "theme": "light",
+    "currency": "BDT",
+    "currency_symbol": "Tk",
+    "company_name": "My Company",
+    "company_address": "",
+    "company_phone": "",
+    "company_email": "",
+    "company_tax_id": "",  # e.g., VAT/GST/TIN
+    "tax_rate": "0.0",
+    "low_stock_threshold": "10",
+    "backup_frequency": "weekly",
+    "auto_backup": "true",
+    "invoice_footer_notes": ""
+}
+
+
+def default_setting_description(key: str) -> str:
+    return f"Default {key.replace('_', ' ').title()} setting"
+
+
 class Settings(Base):
     __tablename__ = "settings"
 
@@ -0,0 +1,322 @@
+"""Bulk product import from CSV or XLSX.
+
+The upload is read row by row and handled IMPORT_CHUNK rows at a time: each
+chunk is validated on the thread pool, then written as one unit on the write
+queue. Inside the unit, categories, existing SKUs and barcodes are looked up
+with one IN query each, new products are bulk inserted, existing ones bulk
+updated (or skipped), and the matching stock movements are bulk inserted too.
+Rows that fail are collected into a per-row error report instead of aborting
+the import.
+"""
+
+import csv
+import io
+import os
+import time
+from collections import defaultdict
+from functools import partial
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .models import Category, Product, StockMovement, adjust_category_counts
+from .schemas import ProductImportRow
+from .writer import run_write
+
+# Rows validated and written per unit of work
+IMPORT_CHUNK = int(os.getenv("IMS_IMPORT_CHUNK", "1000"))
+# Rows listed in the error report; the counts always cover every row
+MAX_REPORTED_ERRORS = 1000
+# Largest import file accepted (the request body, checked in main.py)
+MAX_UPLOAD_SIZE = int(os.getenv("IMS_IMPORT_MAX_MB", "20")) * 1024 * 1024
+
+CONFLICT_MODES = ("update", "skip", "error")
+REQUIRED_FOR_NEW = ("name", "price", "cost")
+PRODUCT_FIELDS = (
+    "name", "description", "barcode", "price", "cost", "stock_quantity", "min_stock_level", "unit",
+    "image_url", "is_active",
+)
+# Column values of a new product when its row leaves them empty
+NEW_PRODUCT_DEFAULTS = {
+    "description": None, "barcode": None, "stock_quantity": 0, "min_stock_level": 10, "unit": "pcs",
+    "image_url": None, "is_active": True,
+}
+# Other spellings accepted in the header row
+HEADER_ALIASES = {
+    "category_name": "category",
+    "quantity": "stock_quantity",
+    "stock": "stock_quantity",
+    "min_stock": "min_stock_level",
+    "active": "is_active",
+}
+
+Row = Tuple[int, dict]
+
+
+def _header_name(value) -> str:
+    name = str(value or "").strip().lower().replace(" ", "_").replace("-", "_")
+    return HEADER_ALIASES.get(name, name)
+
+
+def _cell(value) -> Optional[str]:
+    """Cell value as text; spreadsheets hand back numbers such as SKUs as floats"""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value).strip()
+    return text or None
+
+
+def _csv_rows(file: BinaryIO) -> Iterator[list]:
+    yield from csv.reader(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""))
+
+
+def _xlsx_rows(file: BinaryIO) -> Iterator[tuple]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def read_rows(file: BinaryIO, filename: str) -> Tuple[List[str], Iterator[Row]]:
+    """The recognised columns and an iterator of (row number, {column: text}).
+
+    Raises ValueError for an unsupported file type or a header without sku.
+    """
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".csv":
+        rows = _csv_rows(file)
+    elif extension in (".xlsx", ".xlsm"):
+        rows = _xlsx_rows(file)
+    else:
+        raise ValueError("Upload a .csv or .xlsx file")
+
+    header = [_header_name(value) for value in next(rows, None) or []]
+    known = set(ProductImportRow.model_fields)
+    if "sku" not in header:
+        raise ValueError("The first row must be a header with at least a sku column")
+    columns = [(index, name) for index, name in enumerate(header) if name in known]
+
+    def records() -> Iterator[Row]:
+        for row_number, values in enumerate(rows, start=2):
+            record = {}
+            for index, name in columns:
+                value = _cell(values[index]) if index < len(values) else None
+                if value is not None:
+                    record[name] = value
+            if record:
+                yield row_number, record
+
+    return [name for _, name in columns], records()
+
+
+def _validate_chunk(records: Iterator[Row], seen_skus: Dict[str, int], seen_barcodes: Dict[str, str],
+                    errors: List[dict]) -> Optional[List[Tuple[int, ProductImportRow]]]:
+    """Read and validate the next chunk; None once the file is exhausted"""
+    chunk, valid = [], []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= IMPORT_CHUNK:
+            break
+    if not chunk:
+        return None
+    for row_number, record in chunk:
+        try:
+            row = ProductImportRow.model_validate(record)
+        except ValidationError as exc:
+            errors.append({
+                "row": row_number,
+                "sku": record.get("sku"),
+                "errors": [f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in exc.errors()],
+            })
+            continue
+        problems = []
+        if row.sku in seen_skus:
+            problems.append(f"SKU {row.sku} already appears on row {seen_skus[row.sku]}")
+        if row.barcode and seen_barcodes.get(row.barcode, row.sku) != row.sku:
+            problems.append(f"Barcode {row.barcode} is also used by SKU {seen_barcodes[row.barcode]} in this file")
+        if problems:
+            errors.append({"row": row_number, "sku": row.sku, "errors": problems})
+            continue
+        seen_skus[row.sku] = row_number
+        if row.barcode:
+            seen_barcodes[row.barcode] = row.sku
+        valid.append((row_number, row))
+    return valid
+
+
+def _import_chunk(db: Session, rows: List[Tuple[int, ProductImportRow]], on_conflict: str,
+                  create_categories: bool) -> dict:
+    """Write one validated chunk; runs as a unit of work on the writer"""
+    result = {"created": 0, "updated": 0, "skipped": 0, "errors": [], "created_categories": []}
+
+    def reject(row_number: int, row: ProductImportRow, message: str):
+        result["errors"].append({"row": row_number, "sku": row.sku, "errors": [message]})
+
+    # Categories by name and by id, one query each
+    names = {row.category for _, row in rows if row.category and row.category_id is None}
+    category_ids = dict(db.execute(select(Category.name, Category.id).where(Category.name.in_(names))).all())
+    missing = sorted(names - set(category_ids))
+    if missing and create_categories:
+        created = db.execute(
+            insert(Category).returning(Category.id, Category.name), [{"name": name} for name in missing]
+        ).all()
+        category_ids.update({name: category_id for category_id, name in created})
+        result["created_categories"] = missing
+    known_ids = set(db.scalars(select(Category.id).where(
+        Category.id.in_({row.category_id for _, row in rows if row.category_id is not None})
+    )))
+
+    skus = [row.sku for _, row in rows]
+    existing = {
+        product.sku: product
+        for product in db.execute(
+            select(Product.id, Product.sku, Product.category_id, Product.is_active, Product.stock_quantity)
+            .where(Product.sku.in_(skus))
+        )
+    }
+    barcode_owners = dict(db.execute(
+        select(Product.barcode, Product.sku)
+        .where(Product.barcode.in_({row.barcode for _, row in rows if row.barcode}))
+    ).all())
+
+    inserts, updates, movements = [], [], []
+    # Category counter changes: category id -> [products, active products]
+    counts = defaultdict(lambda: [0, 0])
+    for row_number, row in rows:
+        current = existing.get(row.sku)
+        if current is not None and on_conflict == "skip":
+            result["skipped"] += 1
+            continue
+        if current is not None and on_conflict == "error":
+            reject(row_number, row, f"SKU {row.sku} already exists")
+            continue
+        if row.barcode and barcode_owners.get(row.barcode, row.sku) != row.sku:
+            reject(row_number, row, f"Barcode {row.barcode} belongs to SKU {barcode_owners[row.barcode]}")
+            continue
+
+        category_id = row.category_id
+        if category_id is not None and category_id not in known_ids:
+            reject(row_number, row, f"Category {category_id} not found")
+            continue
+        if category_id is None and row.category:
+            category_id = category_ids.get(row.category)
+            if category_id is None:
+                reject(row_number, row, f"Category '{row.category}' not found")
+                continue
+
+        values = {field: getattr(row, field) for field in PRODUCT_FIELDS if getattr(row, field) is not None}
+        if current is None:
+            missing_fields = [field for field in REQUIRED_FOR_NEW if field not in values]
+            if category_id is None:
+                missing_fields.append("category")
+            if missing_fields:
+                reject(row_number, row, f"New product needs {', '.join(missing_fields)}")
+                continue
+            inserts.append({**NEW_PRODUCT_DEFAULTS, **values, "sku": row.sku, "category_id": category_id})
+            counts[category_id][0] += 1
+            counts[category_id][1] += int(inserts[-1]["is_active"])
+            continue
+
+        if category_id is not None:
+            values["category_id"] = category_id
+        new_category = values.get("category_id", current.category_id)
+        was_active = current.is_active is not False
+        is_active = values.get("is_active", was_active)
+        if new_category != current.category_id or is_active != was_active:
+            counts[current.category_id][0] -= 1
+            counts[current.category_id][1] -= int(was_active)
+            counts[new_category][0] += 1
+            counts[new_category][1] += int(is_active)
+        stock = values.get("stock_quantity")
+        if stock is not None and stock != current.stock_quantity:
+            movements.append({
+                "product_id": current.id,
+                "movement_type": "adjustment",
+                "quantity": stock,
+                "previous_stock": current.stock_quantity or 0,
+                "new_stock": stock,
+                "notes": "Product import",
+            })
+        if values:
+            updates.append({"id": current.id, **values})
+        result["updated"] += 1
+
+    if inserts:
+        created = db.execute(insert(Product).returning(Product.id, Product.stock_quantity), inserts).all()
+        movements.extend(
+            {
+                "product_id": product_id,
+                "movement_type": "in",
+                "quantity": stock,
+                "previous_stock": 0,
+                "new_stock": stock,
+                "notes": "Initial stock",
+            }
+            for product_id, stock in created if stock and stock > 0
+        )
+        result["created"] = len(created)
+    if updates:
+        db.execute(update(Product), updates)
+    if movements:
+        db.execute(insert(StockMovement), movements)
+    connection = db.connection()
+    for category_id, (products, active) in counts.items():
+        adjust_category_counts(connection, category_id, products, active)
+    return result
+
+
+async def import_products(file: BinaryIO, filename: str, on_conflict: str = "update",
+                          create_categories: bool = False) -> dict:
+    """Import every row of an uploaded file and report what happened to each.
+
+    on_conflict decides what a row whose SKU already exists does: update the
+    product with the columns the row fills in, skip it, or report an error.
+    Raises ValueError for an unreadable file or an unknown mode.
+    """
+    if on_conflict not in CONFLICT_MODES:
+        raise ValueError(f"on_conflict must be one of {', '.join(CONFLICT_MODES)}")
+    started = time.perf_counter()
+    columns, records = await run_in_threadpool(read_rows, file, filename)
+
+    report = {"rows": 0, "created": 0, "updated": 0, "skipped": 0, "failed": 0, "created_categories": []}
+    errors: List[dict] = []
+    seen_skus: Dict[str, int] = {}
+    seen_barcodes: Dict[str, str] = {}
+    while True:
+        chunk_errors: List[dict] = []
+        rows = await run_in_threadpool(_validate_chunk, records, seen_skus, seen_barcodes, chunk_errors)
+        if rows is None:
+            break
+        report["rows"] += len(rows) + len(chunk_errors)
+        if rows:
+            try:
+                result = await run_write(partial(_import_chunk, rows=rows, on_conflict=on_conflict,
+                                                 create_categories=create_categories))
+            except Exception as exc:
+                # The chunk's savepoint was rolled back; none of its rows were written
+                result = {
+                    "errors": [{"row": n, "sku": row.sku, "errors": [f"Not saved: {exc}"]} for n, row in rows],
+                }
+            for key in ("created", "updated", "skipped"):
+                report[key] += result.get(key, 0)
+            report["created_categories"] += result.get("created_categories", [])
+            chunk_errors += result["errors"]
+        report["failed"] += len(chunk_errors)
+        errors += chunk_errors[:max(0, MAX_REPORTED_ERRORS - len(errors))]
+
+    errors.sort(key=lambda error: error["row"])
+    report.update(
+        columns=columns,
+        errors=errors,
+        errors_truncated=report["failed"] > len(errors),
+        duration_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+    return report
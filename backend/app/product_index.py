@@ -0,0 +1,241 @@
+"""In-memory barcode / SKU index for scanner lookups.
+
+GET /api/products/lookup resolves a scanned code with two dict lookups
+instead of a query. The index holds a ProductSimple for every active product,
+keyed by barcode and by SKU. It is built at startup (and after a restore) and
+kept current by session events: products flushed in a transaction are
+re-read once it commits, and bulk INSERT / UPDATE statements on products,
+whose rows the session cannot see, either name the ids (bulk updates by
+primary key) or trigger a rebuild. Re-reads and rebuilds run one at a time on
+the index's own thread, so a commit never waits on them and a row read earlier
+is never applied after one read later. Codes the index misses fall back to the
+database.
+
+The index only sees writes made by this process, so it is on by default for
+SQLite only; IMS_PRODUCT_INDEX=1 enables it elsewhere (e.g. a single app
+instance on PostgreSQL), 0 disables it.
+"""
+
+import logging
+import os
+import threading
+from typing import Dict, Iterable, Optional, Set
+
+from sqlalchemy import event, inspect, or_, select
+from sqlalchemy.orm import Session
+
+from . import database
+from .maintenance import register_warmup
+from .models import Product
+from .schemas import ProductSimple
+
+logger = logging.getLogger(__name__)
+
+INDEX_ENABLED = os.getenv("IMS_PRODUCT_INDEX", "1" if database.IS_SQLITE else "0") != "0"
+# Ids per IN list when re-reading changed products
+REFRESH_BATCH = 500
+
+_PENDING = "product_index_pending"
+_REBUILD = "product_index_rebuild"
+
+_COLUMNS = (
+    Product.id, Product.name, Product.sku, Product.barcode, Product.price, Product.stock_quantity,
+    Product.image_url, Product.is_active,
+)
+
+
+class ProductIndex:
+    def __init__(self):
+        self.by_barcode: Dict[str, ProductSimple] = {}
+        self.by_sku: Dict[str, ProductSimple] = {}
+        # id -> (sku, barcode), to drop a product's old codes when it changes
+        self._codes: Dict[int, tuple] = {}
+        self.ready = False
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Held from reading rows until they are applied, so an older read is never applied last
+        self._update_lock = threading.Lock()
+        self._running = False
+        self._stale = False
+        self._pending: Set[int] = set()
+
+    def get(self, code: str) -> Optional[ProductSimple]:
+        product = self.by_barcode.get(code) or self.by_sku.get(code)
+        if product is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return product
+
+    @staticmethod
+    def _add(by_barcode, by_sku, codes, row):
+        product = ProductSimple.model_validate(row._asdict())
+        by_sku[row.sku] = product
+        if row.barcode:
+            by_barcode[row.barcode] = product
+        codes[row.id] = (row.sku, row.barcode)
+
+    def build(self):
+        """Load every active product; the old index serves lookups until it is swapped"""
+        by_barcode, by_sku, codes = {}, {}, {}
+        with self._update_lock:
+            with database.read_engine.connect() as conn:
+                for row in conn.execute(select(*_COLUMNS).where(Product.is_active)):
+                    self._add(by_barcode, by_sku, codes, row)
+            with self._lock:
+                self.by_barcode, self.by_sku, self._codes = by_barcode, by_sku, codes
+                self.ready = True
+        logger.info("Product index built: %d products", len(codes))
+
+    def _refresh(self, product_ids: Iterable[int]):
+        """Re-read the given products and replace their entries"""
+        ids = sorted(set(product_ids))
+        with self._update_lock:
+            rows = []
+            with database.read_engine.connect() as conn:
+                for start in range(0, len(ids), REFRESH_BATCH):
+                    batch = ids[start:start + REFRESH_BATCH]
+                    rows += conn.execute(select(*_COLUMNS).where(Product.id.in_(batch))).all()
+            with self._lock:
+                for product_id in ids:
+                    sku, barcode = self._codes.pop(product_id, (None, None))
+                    if sku is not None and getattr(self.by_sku.get(sku), "id", None) == product_id:
+                        del self.by_sku[sku]
+                    if barcode and getattr(self.by_barcode.get(barcode), "id", None) == product_id:
+                        del self.by_barcode[barcode]
+                for row in rows:
+                    if row.is_active is not False:
+                        self._add(self.by_barcode, self.by_sku, self._codes, row)
+
+    def refresh(self, product_ids: Iterable[int]):
+        """Re-read the given products on the index thread"""
+        with self._lock:
+            self._pending.update(product_ids)
+            self._start()
+
+    def rebuild_in_background(self):
+        with self._lock:
+            self._stale = True
+            self._start()
+
+    def _start(self):
+        # Called with _lock held
+        if not self._running:
+            self._running = True
+            threading.Thread(target=self._update_loop, name="ims-product-index", daemon=True).start()
+
+    def _update_loop(self):
+        while True:
+            with self._lock:
+                stale, product_ids = self._stale, self._pending
+                if not (stale or product_ids):
+                    self._running = False
+                    return
+                # A rebuild reads everything committed before it, queued ids included
+                self._stale, self._pending = False, set()
+            try:
+                if stale:
+                    self.build()
+                else:
+                    self._refresh(product_ids)
+            except Exception:
+                logger.exception("Product index update failed")
+                if not stale:
+                    with self._lock:
+                        self._stale = True
+
+    def stats(self) -> dict:
+        return {
+            "enabled": INDEX_ENABLED,
+            "ready": self.ready,
+            "products": len(self._codes),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+index = ProductIndex()
+
+
+def start():
+    """Build the index in the background; lookups use the database until it is ready"""
+    if INDEX_ENABLED:
+        index.rebuild_in_background()
+
+
+@register_warmup
+def _rebuild_after_swap():
+    # A restore replaces every product
+    if INDEX_ENABLED:
+        index.build()
+
+
+def lookup(db: Session, code: str) -> Optional[ProductSimple]:
+    """Active product whose barcode (preferred) or SKU is code"""
+    if INDEX_ENABLED and index.ready:
+        product = index.get(code)
+        if product is not None:
+            return product
+    row = db.execute(
+        select(*_COLUMNS)
+        .where(or_(Product.barcode == code, Product.sku == code), Product.is_active)
+        .order_by((Product.barcode == code).desc())
+        .limit(1)
+    ).first()
+    if row is None:
+        return None
+    if INDEX_ENABLED and index.ready:
+        index.refresh([row.id])
+    return ProductSimple.model_validate(row._asdict())
+
+
+# Keeping the index current
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed_products(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Product):
+            state = inspect(obj)
+            product_id = state.key[1][0] if state.key else state.dict.get("id")
+            if product_id is not None:
+                session.info.setdefault(_PENDING, set()).add(product_id)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_statements(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ is not Product:
+        return
+    session, parameters = orm_execute_state.session, orm_execute_state.parameters
+    if orm_execute_state.is_update and isinstance(parameters, list) and all("id" in p for p in parameters):
+        session.info.setdefault(_PENDING, set()).update(p["id"] for p in parameters)
+    else:
+        session.info[_REBUILD] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_committed_products(session):
+    # Releasing a SAVEPOINT fires this too; other connections only see the outer commit
+    if session.in_nested_transaction():
+        return
+    product_ids = session.info.pop(_PENDING, None)
+    rebuild = session.info.pop(_REBUILD, False)
+    if not (INDEX_ENABLED and index.ready):
+        return
+    # Queued for the index thread: the committing thread (often the writer) does not wait on a query
+    if rebuild:
+        index.rebuild_in_background()
+    elif product_ids:
+        index.refresh(product_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending_products(session):
+    # Products from a rolled back SAVEPOINT stay pending; re-reading them is harmless
+    if session.in_nested_transaction():
+        return
+    session.info.pop(_PENDING, None)
+    session.info.pop(_REBUILD, None)
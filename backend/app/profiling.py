@@ -0,0 +1,173 @@
+"""On-demand request profiling.
+
+A request that carries the ``X-IMS-Profile`` header set to the secret from
+``IMS_PROFILE_SECRET`` is sampled while it runs. The samples are written under
+the data dir as a collapsed-stack file (one ``frame;frame;frame count`` line
+per unique stack) which flamegraph.pl, speedscope and inferno read directly.
+Only the newest IMS_PROFILE_KEEP files (default 100) are kept. Profiling is
+disabled when no secret is configured.
+"""
+
+import hmac
+import os
+import re
+import sys
+import threading
+import uuid
+from collections import Counter
+from contextvars import Context, ContextVar
+from typing import Optional
+
+from .paths import get_data_dir
+
+PROFILE_HEADER = "X-IMS-Profile"
+PROFILE_ID_HEADER = "X-IMS-Profile-Id"
+PROFILE_DIR = get_data_dir('profiles')
+
+# Sampling interval in seconds (IMS_PROFILE_INTERVAL_MS, default 1ms)
+SAMPLE_INTERVAL = float(os.getenv("IMS_PROFILE_INTERVAL_MS", "1")) / 1000.0
+# Profiles kept on disk; older ones are deleted as new ones are saved
+PROFILE_KEEP = int(os.getenv("IMS_PROFILE_KEEP", "100"))
+
+_PROFILE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+# Innermost frames of threads that are parked rather than doing work
+# (idle thread pool workers, the event loop waiting on its selector).
+_IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+}
+
+# Frames that run a callback inside a contextvars.Context: asyncio callbacks
+# (task steps), anyio worker threads (run_in_threadpool) and write units
+_DISPATCH_FRAMES = {
+    ("events.py", "_run"),
+    ("_asyncio.py", "run"),
+    ("writer.py", "_execute"),
+}
+
+# The sampler of the request being handled, as seen by the code handling it
+_active: ContextVar[Optional["StackSampler"]] = ContextVar("ims_profile_sampler", default=None)
+
+
+def get_profile_secret() -> Optional[str]:
+    """Return the configured profiling secret, or None when profiling is off"""
+    return os.getenv("IMS_PROFILE_SECRET") or None
+
+
+def is_authorized(header_value: Optional[str]) -> bool:
+    """Check a header value against the configured secret"""
+    secret = get_profile_secret()
+    if not secret or not header_value:
+        return False
+    return hmac.compare_digest(header_value.encode(), secret.encode())
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}"
+
+
+def _frame_context(frame) -> Optional[Context]:
+    values = frame.f_locals
+    for value in values.values():
+        if isinstance(value, Context):
+            return value
+    # asyncio.Handle keeps it on itself
+    context = getattr(values.get("self"), "_context", None)
+    return context if isinstance(context, Context) else None
+
+
+class StackSampler:
+    """Background thread that samples the Python stacks of the threads serving one request.
+
+    Handlers run on the thread pool and write units on the writer thread while
+    the middleware awaits on the event loop, so a tracing profiler attached to
+    the calling thread would miss the work entirely. Every thread is looked at,
+    but a stack only counts when the callback it is running (an event loop
+    step, a thread pool job or a write unit) runs in this request's context:
+    other requests served at the same time and idle threads are left out.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ims-profiler", daemon=True)
+        self._token = None
+
+    def start(self):
+        """Start sampling; call from the request's task so the code it awaits is attributed to it"""
+        self._token = _active.set(self)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def detach(self):
+        if self._token is not None:
+            _active.reset(self._token)
+            self._token = None
+
+    def _serves_request(self, frame) -> bool:
+        # The innermost dispatching frame tells which context the running code belongs to
+        while frame is not None:
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in _DISPATCH_FRAMES:
+                context = _frame_context(frame)
+                if context is not None:
+                    return context.get(_active) is self
+            frame = frame.f_back
+        return False
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+                    continue
+                if not self._serves_request(frame):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.reverse()
+                self.samples[";".join(stack)] += 1
+
+
+def _prune_profiles(keep: int = PROFILE_KEEP):
+    if keep <= 0:
+        return
+    entries = [entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".folded")]
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[keep:]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def save_profile(sampler: StackSampler) -> str:
+    """Write the sampler's stacks as a collapsed-stack file and return its id; blocking"""
+    profile_id = uuid.uuid4().hex
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.folded")
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in sampler.samples.most_common():
+            f.write(f"{stack} {count}\n")
+    _prune_profiles()
+    return profile_id
+
+
+def get_profile_path(profile_id: str) -> Optional[str]:
+    """Return the file path for a profile id, or None if it does not exist"""
+    if not _PROFILE_ID_RE.match(profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.folded")
+    return path if os.path.exists(path) else None
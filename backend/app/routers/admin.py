@@ -0,0 +1,52 @@
+from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import FileResponse
+from typing import Optional
+
+from app import database, migrations, profiling
+from app.scheduler import scheduler
+
+router = APIRouter()
+
+
+@router.get("/profiles/{profile_id}")
+def download_profile(profile_id: str, x_ims_profile: Optional[str] = Header(None)):
+    """Download a request profile as a collapsed-stack (flamegraph) file"""
+    if not profiling.is_authorized(x_ims_profile):
+        raise HTTPException(status_code=403, detail="Profiling is disabled or the secret is invalid")
+
+    path = profiling.get_profile_path(profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    return FileResponse(
+        path,
+        media_type="text/plain",
+        filename=f"profile_{profile_id}.folded"
+    )
+
+
+@router.get("/maintenance")
+def get_maintenance_status():
+    """Scheduler state, its tasks and the history of recent runs (newest first)"""
+    return {**scheduler.status(), "history": list(reversed(scheduler.history))}
+
+
+@router.post("/maintenance/{task}")
+async def run_maintenance_task(task: str):
+    """Run a maintenance task now, whatever the current load"""
+    if task not in scheduler.tasks:
+        raise HTTPException(status_code=404, detail="Unknown maintenance task")
+    if not scheduler.tasks[task].enabled:
+        raise HTTPException(status_code=400, detail="This task only applies to the SQLite database")
+    return await scheduler.run_task(task)
+
+
+@router.get("/category-counts")
+def verify_category_counts():
+    """Categories whose product counters disagree with the products table.
+
+    Nothing is changed; POST /maintenance/category_counts corrects them.
+    """
+    with database.read_engine.connect() as conn:
+        drift = migrations.rebuild_category_counts(conn, fix=False)
+    return {"ok": not drift, "drift": drift}
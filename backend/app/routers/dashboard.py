@@ -1,9 +1,9 @@
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, select
 from datetime import datetime, date, timedelta
 from typing import List
-from app.database import get_db
+from app.database import get_async_db
+from app.sql import time_bucket
 from app.models import Product, Sale, Category, SalesItem, Return
 from app.schemas import (
     DashboardKPIs, SalesChartData, CategoryDistribution, LowStockProduct
@@ -13,58 +13,64 @@ router = APIRouter()
 
 
 @router.get("/kpis", response_model=DashboardKPIs)
-def get_dashboard_kpis(db: Session = Depends(get_db)):
+async def get_dashboard_kpis(db=Depends(get_async_db)):
     """Get key performance indicators for the dashboard"""
     
     # Total products (active only)
-    total_products = db.query(Product).filter(Product.is_active).count()
+    total_products = await db.scalar(
+        select(func.count(Product.id)).where(Product.is_active)
+    )
     
     # Today's sales
     today = date.today()
     today_start = datetime.combine(today, datetime.min.time())
     today_end = datetime.combine(today, datetime.max.time())
     
-    today_sales = db.query(
-        func.coalesce(func.sum(Sale.final_amount), 0).label('total'),
-        func.count(Sale.id).label('count')
-    ).filter(
-        Sale.created_at >= today_start,
-        Sale.created_at <= today_end
-    ).first()
+    today_sales = (await db.execute(
+        select(
+            func.coalesce(func.sum(Sale.final_amount), 0).label('total'),
+            func.count(Sale.id).label('count')
+        ).where(
+            Sale.created_at >= today_start,
+            Sale.created_at <= today_end
+        )
+    )).first()
 
     # Today's refunded returns (subtract from revenue when payment is actually made)
-    today_refunds = db.query(
-        func.coalesce(func.sum(Return.total_amount), 0)
-    ).filter(
-        Return.status == 'refunded',
-        Return.processed_at.isnot(None),  # only processed refunds
-        Return.processed_at >= today_start,
-        Return.processed_at <= today_end,
-    ).scalar() or 0
+    today_refunds = await db.scalar(
+        select(func.coalesce(func.sum(Return.total_amount), 0)).where(
+            Return.status == 'refunded',
+            Return.processed_at.isnot(None),  # only processed refunds
+            Return.processed_at >= today_start,
+            Return.processed_at <= today_end,
+        )
+    ) or 0
     
     # Low stock count
-    low_stock_count = db.query(Product).filter(
-        Product.stock_quantity <= Product.min_stock_level,
-        Product.is_active
-    ).count()
+    low_stock_count = await db.scalar(
+        select(func.count(Product.id)).where(
+            Product.stock_quantity <= Product.min_stock_level,
+            Product.is_active
+        )
+    )
     
     # This month's revenue
     first_day_of_month = today.replace(day=1)
     month_start = datetime.combine(first_day_of_month, datetime.min.time())
     
-    monthly_sales = db.query(
-        func.coalesce(func.sum(Sale.final_amount), 0)
-    ).filter(
-        Sale.created_at >= month_start
-    ).scalar() or 0
+    monthly_sales = await db.scalar(
+        select(func.coalesce(func.sum(Sale.final_amount), 0)).where(
+            Sale.created_at >= month_start
+        )
+    ) or 0
 
-    monthly_refunds = db.query(
-        func.coalesce(func.sum(Return.total_amount), 0)
-    ).filter(
-        Return.status == 'refunded',
-        Return.processed_at.isnot(None),
-        Return.processed_at >= month_start
-    ).scalar() or 0
+    monthly_refunds = await db.scalar(
+        select(func.coalesce(func.sum(Return.total_amount), 0)).where(
+            Return.status == 'refunded',
+            Return.processed_at.isnot(None),
+            Return.processed_at >= month_start
+        )
+    ) or 0
 
     # Net values
     total_sales_today_net = float(today_sales.total) - float(today_refunds)
@@ -80,26 +86,25 @@ def get_dashboard_kpis(db: Session = Depends(get_db)):
 
 
 @router.get("/sales-chart", response_model=List[SalesChartData])
-def get_sales_chart_data(days: int = 7, db: Session = Depends(get_db)):
+async def get_sales_chart_data(days: int = 7, db=Depends(get_async_db)):
     """Sales data for charts with smart aggregation:
     - days == 1: last 24 hours, hourly buckets
     - days == 12: last 12 months, monthly buckets
     - else: last N days, daily buckets
-    Uses SQLite-friendly strftime grouping and returns label strings in `date`.
+    Groups by dialect-aware time buckets and returns label strings in `date`.
     """
     now = datetime.now()
 
     # Hourly: last 24 hours
     if days == 1:
         start_dt = now - timedelta(hours=24)
-        key_expr = func.strftime('%Y-%m-%d %H:00', Sale.created_at)
-        rows = (
-            db.query(key_expr.label('k'), func.coalesce(func.sum(Sale.final_amount), 0).label('total'))
-            .filter(Sale.created_at >= start_dt)
+        key_expr = time_bucket('hour', Sale.created_at)
+        rows = (await db.execute(
+            select(key_expr.label('k'), func.coalesce(func.sum(Sale.final_amount), 0).label('total'))
+            .where(Sale.created_at >= start_dt)
             .group_by('k')
             .order_by('k')
-            .all()
-        )
+        )).all()
         data_map = {r.k: float(r.total) for r in rows}
         out: List[SalesChartData] = []
         cur = start_dt.replace(minute=0, second=0, microsecond=0)
@@ -114,14 +119,13 @@ def get_sales_chart_data(days: int = 7, db: Session = Depends(get_db)):
     # Monthly: last 12 months
     if days == 12:
         start_dt = (now - timedelta(days=365)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        key_expr = func.strftime('%Y-%m', Sale.created_at)
-        rows = (
-            db.query(key_expr.label('k'), func.coalesce(func.sum(Sale.final_amount), 0).label('total'))
-            .filter(Sale.created_at >= start_dt)
+        key_expr = time_bucket('month', Sale.created_at)
+        rows = (await db.execute(
+            select(key_expr.label('k'), func.coalesce(func.sum(Sale.final_amount), 0).label('total'))
+            .where(Sale.created_at >= start_dt)
             .group_by('k')
             .order_by('k')
-            .all()
-        )
+        )).all()
         data_map = {r.k: float(r.total) for r in rows}
         out: List[SalesChartData] = []
         cur = start_dt
@@ -140,14 +144,13 @@ def get_sales_chart_data(days: int = 7, db: Session = Depends(get_db)):
     # Daily: last N days (7, 30, etc.)
     end_d = date.today()
     start_d = end_d - timedelta(days=days - 1)
-    key_expr = func.strftime('%Y-%m-%d', Sale.created_at)
-    rows = (
-        db.query(key_expr.label('k'), func.coalesce(func.sum(Sale.final_amount), 0).label('total'))
-        .filter(key_expr >= start_d.strftime('%Y-%m-%d'), key_expr <= end_d.strftime('%Y-%m-%d'))
+    key_expr = time_bucket('day', Sale.created_at)
+    rows = (await db.execute(
+        select(key_expr.label('k'), func.coalesce(func.sum(Sale.final_amount), 0).label('total'))
+        .where(key_expr >= start_d.strftime('%Y-%m-%d'), key_expr <= end_d.strftime('%Y-%m-%d'))
         .group_by('k')
         .order_by('k')
-        .all()
-    )
+    )).all()
     data_map = {r.k: float(r.total) for r in rows}
     out: List[SalesChartData] = []
     cur_d = start_d
@@ -160,18 +163,19 @@ def get_sales_chart_data(days: int = 7, db: Session = Depends(get_db)):
 
 
 @router.get("/category-distribution", response_model=List[CategoryDistribution])
-def get_category_distribution(db: Session = Depends(get_db)):
+async def get_category_distribution(db=Depends(get_async_db)):
     """Get product distribution by category for pie chart"""
     
     # Get product count by category
-    category_data = db.query(
-        Category.name.label('category'),
-        func.count(Product.id).label('count')
-    ).join(Product, Category.id == Product.category_id)\
-     .filter(Product.is_active)\
-     .group_by(Category.id, Category.name)\
-     .order_by(desc(func.count(Product.id)))\
-     .all()
+    category_data = (await db.execute(
+        select(
+            Category.name.label('category'),
+            func.count(Product.id).label('count')
+        ).join(Product, Category.id == Product.category_id)
+         .where(Product.is_active)
+         .group_by(Category.id, Category.name)
+         .order_by(desc(func.count(Product.id)))
+    )).all()
     
     total_products = sum(row.count for row in category_data)
     
@@ -191,23 +195,24 @@ def get_category_distribution(db: Session = Depends(get_db)):
 
 
 @router.get("/low-stock-products", response_model=List[LowStockProduct])
-def get_low_stock_products(limit: int = 10, db: Session = Depends(get_db)):
+async def get_low_stock_products(limit: int = 10, db=Depends(get_async_db)):
     """Get products with low stock for alerts"""
     
-    products = db.query(
-        Product.id,
-        Product.name,
-        Product.sku,
-        Product.stock_quantity,
-        Product.min_stock_level,
-        Category.name.label('category_name')
-    ).join(Category, Product.category_id == Category.id)\
-     .filter(
-         Product.stock_quantity <= Product.min_stock_level,
-         Product.is_active
-     ).order_by(Product.stock_quantity)\
-     .limit(limit)\
-     .all()
+    products = (await db.execute(
+        select(
+            Product.id,
+            Product.name,
+            Product.sku,
+            Product.stock_quantity,
+            Product.min_stock_level,
+            Category.name.label('category_name')
+        ).join(Category, Product.category_id == Category.id)
+         .where(
+             Product.stock_quantity <= Product.min_stock_level,
+             Product.is_active
+         ).order_by(Product.stock_quantity)
+         .limit(limit)
+    )).all()
     
     return [
         LowStockProduct(
@@ -222,45 +227,55 @@ def get_low_stock_products(limit: int = 10, db: Session = Depends(get_db)):
 
 
 @router.get("/recent-sales")
-def get_recent_sales(limit: int = 5, db: Session = Depends(get_db)):
+async def get_recent_sales(limit: int = 5, db=Depends(get_async_db)):
     """Get recent sales for dashboard"""
     
-    recent_sales = db.query(Sale)\
-        .order_by(desc(Sale.created_at))\
-        .limit(limit)\
-        .all()
+    recent_sales = (await db.execute(
+        select(Sale.id, Sale.sale_number, Sale.final_amount, Sale.created_at)
+        .order_by(desc(Sale.created_at))
+        .limit(limit)
+    )).all()
+    
+    # Count items for all listed sales in one query instead of lazy-loading each sale's items
+    sale_ids = [sale.id for sale in recent_sales]
+    items_counts = dict((await db.execute(
+        select(SalesItem.sale_id, func.count(SalesItem.id))
+        .where(SalesItem.sale_id.in_(sale_ids))
+        .group_by(SalesItem.sale_id)
+    )).all()) if sale_ids else {}
     
     return [
         {
             "id": sale.id,
             "sale_number": sale.sale_number,
             "final_amount": sale.final_amount,
-            "items_count": len(sale.sales_items),
+            "items_count": items_counts.get(sale.id, 0),
             "created_at": sale.created_at.isoformat()
         } for sale in recent_sales
     ]
 
 
 @router.get("/top-selling-products")
-def get_top_selling_products(limit: int = 5, db: Session = Depends(get_db)):
+async def get_top_selling_products(limit: int = 5, db=Depends(get_async_db)):
     """Get top selling products by quantity"""
     
     # Get sales data for last 30 days
     thirty_days_ago = datetime.now() - timedelta(days=30)
     
-    top_products = db.query(
-        Product.id,
-        Product.name,
-        Product.sku,
-        func.sum(SalesItem.quantity).label('total_sold'),
-        func.sum(SalesItem.total_price).label('total_revenue')
-    ).join(SalesItem, Product.id == SalesItem.product_id)\
-     .join(Sale, SalesItem.sale_id == Sale.id)\
-     .filter(Sale.created_at >= thirty_days_ago)\
-     .group_by(Product.id, Product.name, Product.sku)\
-     .order_by(desc(func.sum(SalesItem.quantity)))\
-     .limit(limit)\
-     .all()
+    top_products = (await db.execute(
+        select(
+            Product.id,
+            Product.name,
+            Product.sku,
+            func.sum(SalesItem.quantity).label('total_sold'),
+            func.sum(SalesItem.total_price).label('total_revenue')
+        ).join(SalesItem, Product.id == SalesItem.product_id)
+         .join(Sale, SalesItem.sale_id == Sale.id)
+         .where(Sale.created_at >= thirty_days_ago)
+         .group_by(Product.id, Product.name, Product.sku)
+         .order_by(desc(func.sum(SalesItem.quantity)))
+         .limit(limit)
+    )).all()
     
     return [
         {
@@ -274,46 +289,44 @@ def get_top_selling_products(limit: int = 5, db: Session = Depends(get_db)):
 
 
 @router.get("/sales-vs-returns")
-def get_sales_vs_returns_data(period: str = "7", db: Session = Depends(get_db)):
-    """Get sales vs returns comparison data for different periods (SQLite-safe)."""
+async def get_sales_vs_returns_data(period: str = "7", db=Depends(get_async_db)):
+    """Get sales vs returns comparison data for different periods."""
     end_dt = datetime.now()
 
     if period == "1":  # Last 24 hours
         start_dt = end_dt - timedelta(days=1)
         fmt = "%Y-%m-%d %H:00"
         step = "hour"
-        key_expr = func.strftime('%Y-%m-%d %H:00', Sale.created_at)
-        r_key_expr = func.strftime('%Y-%m-%d %H:00', Return.created_at)
+        key_expr = time_bucket('hour', Sale.created_at)
+        r_key_expr = time_bucket('hour', Return.created_at)
     elif period == "12":  # Last 12 months
         start_dt = end_dt - timedelta(days=365)
         fmt = "%Y-%m"
         step = "month"
-        key_expr = func.strftime('%Y-%m', Sale.created_at)
-        r_key_expr = func.strftime('%Y-%m', Return.created_at)
+        key_expr = time_bucket('month', Sale.created_at)
+        r_key_expr = time_bucket('month', Return.created_at)
     else:  # 7 or 30 days
         days = 7 if period == "7" else 30
         start_dt = end_dt - timedelta(days=days)
         fmt = "%Y-%m-%d"
         step = "day"
-        key_expr = func.strftime('%Y-%m-%d', Sale.created_at)
-        r_key_expr = func.strftime('%Y-%m-%d', Return.created_at)
+        key_expr = time_bucket('day', Sale.created_at)
+        r_key_expr = time_bucket('day', Return.created_at)
 
     # Sales sums grouped by key
-    s_rows = (
-        db.query(key_expr.label('k'), func.coalesce(func.sum(Sale.final_amount), 0).label('total'))
-        .filter(Sale.created_at >= start_dt)
+    s_rows = (await db.execute(
+        select(key_expr.label('k'), func.coalesce(func.sum(Sale.final_amount), 0).label('total'))
+        .where(Sale.created_at >= start_dt)
         .group_by('k')
         .order_by('k')
-        .all()
-    )
+    )).all()
     # Returns sums grouped by key
-    r_rows = (
-        db.query(r_key_expr.label('k'), func.coalesce(func.sum(Return.total_amount), 0).label('total'))
-        .filter(Return.created_at >= start_dt)
+    r_rows = (await db.execute(
+        select(r_key_expr.label('k'), func.coalesce(func.sum(Return.total_amount), 0).label('total'))
+        .where(Return.created_at >= start_dt)
         .group_by('k')
         .order_by('k')
-        .all()
-    )
+    )).all()
 
     s_dict = {row.k: float(row.total) for row in s_rows}
     r_dict = {row.k: float(row.total) for row in r_rows}
@@ -1,47 +1,83 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
-from app.database import get_db
+from datetime import datetime, timezone
+from app.database import get_read_db, get_async_db
+from app.writer import run_write
+from app import archive, etags, product_import, product_index, stock_history, stocktake, storage
 from app.models import Product, Category, StockMovement
 from app.schemas import (
-    Product as ProductSchema, ProductCreate, ProductUpdate,
-    StockMovement as StockMovementSchema, StockMovementCreate
+    Product as ProductSchema, ProductCreate, ProductUpdate, ProductSimple,
+    StockMovement as StockMovementSchema, StockMovementCreate, BulkStockUpdate
 )
 
 router = APIRouter()
 
+# Products are served with their category and images
+product_etag = Depends(etags.conditional("products", "categories", "product_images"))
 
-@router.get("/", response_model=List[ProductSchema])
-def get_products(
+
+@router.get("/", response_model=List[ProductSchema], dependencies=[product_etag])
+async def get_products(
     skip: int = 0,
     limit: int = 100,
     category_id: Optional[int] = None,
     search: Optional[str] = None,
     is_active: Optional[bool] = None,
-    db: Session = Depends(get_db)
+    db=Depends(get_async_db)
 ):
     """Get all products with optional filtering"""
-    query = db.query(Product)
+    # Categories and images for the whole page in one query each
+    query = select(Product).options(selectinload(Product.category), selectinload(Product.product_images))
     
     if category_id:
-        query = query.filter(Product.category_id == category_id)
+        query = query.where(Product.category_id == category_id)
     
     if search:
-        query = query.filter(
+        query = query.where(
             (Product.name.contains(search)) | 
             (Product.sku.contains(search)) | 
             (Product.description.contains(search))
         )
     
     if is_active is not None:
-        query = query.filter(Product.is_active == is_active)
+        query = query.where(Product.is_active == is_active)
     
-    products = query.offset(skip).limit(limit).all()
+    # Explicit order keeps pages stable on databases without rowid order (PostgreSQL)
+    query = query.order_by(Product.id)
+    products = (await db.execute(query.offset(skip).limit(limit))).scalars().all()
     return products
 
 
-@router.get("/{product_id}", response_model=ProductSchema)
-def get_product(product_id: int, db: Session = Depends(get_db)):
+# Declared before /{product_id} so "lookup" is not taken for an id
+@router.get("/lookup", response_model=ProductSimple)
+def lookup_product(code: str, db: Session = Depends(get_read_db)):
+    """Find the active product with this barcode or SKU, e.g. for a scan at the till"""
+    product = product_index.lookup(db, code.strip())
+    if product is None:
+        raise HTTPException(status_code=404, detail="No product with this barcode or SKU")
+    return product
+
+
+# Declared before /{product_id} so "stock-as-of" is not taken for an id
+@router.get("/stock-as-of")
+def get_stock_as_of(date: str, category_id: Optional[int] = None, db: Session = Depends(get_read_db)):
+    """Every product's stock level and value at a past time; a date alone means the end of that day"""
+    try:
+        when = datetime.fromisoformat(date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date must be YYYY-MM-DD or an ISO date and time")
+    if len(date) <= 10:
+        when = when.replace(hour=23, minute=59, second=59, microsecond=999999)
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+    return stock_history.stock_as_of(db, when, category_id)
+
+
+@router.get("/{product_id}", response_model=ProductSchema, dependencies=[product_etag])
+def get_product(product_id: int, db: Session = Depends(get_read_db)):
     """Get a specific product by ID"""
     product = db.query(Product).filter(Product.id == product_id).first()
     if not product:
@@ -50,122 +86,182 @@ def get_product(product_id: int, db: Session = Depends(get_db)):
 
 
 @router.post("/", response_model=ProductSchema)
-def create_product(product: ProductCreate, db: Session = Depends(get_db)):
+async def create_product(product: ProductCreate):
     """Create a new product"""
-    # Check if category exists
-    category = db.query(Category).filter(Category.id == product.category_id).first()
-    if not category:
-        raise HTTPException(status_code=404, detail="Category not found")
-    
-    # Check if SKU already exists
-    existing_product = db.query(Product).filter(Product.sku == product.sku).first()
-    if existing_product:
-        raise HTTPException(status_code=400, detail="SKU already exists")
-    
-    db_product = Product(**product.model_dump())
-    db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
-    
-    # Create initial stock movement if stock_quantity > 0
-    if db_product.stock_quantity > 0:
-        stock_movement = StockMovement(
-            product_id=db_product.id,
-            movement_type="in",
-            quantity=db_product.stock_quantity,
-            previous_stock=0,
-            new_stock=db_product.stock_quantity,
-            notes="Initial stock"
-        )
-        db.add(stock_movement)
-        db.commit()
-    
-    return db_product
-
-
-@router.put("/{product_id}", response_model=ProductSchema)
-def update_product(product_id: int, product: ProductUpdate, db: Session = Depends(get_db)):
-    """Update a product"""
-    db_product = db.query(Product).filter(Product.id == product_id).first()
-    if not db_product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    # Check if category exists if being updated
-    if product.category_id:
+    def unit(db: Session):
+        # Check if category exists
         category = db.query(Category).filter(Category.id == product.category_id).first()
         if not category:
             raise HTTPException(status_code=404, detail="Category not found")
-    
-    # Check if SKU already exists if being updated
-    if product.sku and product.sku != db_product.sku:
+        
+        # Check if SKU already exists
         existing_product = db.query(Product).filter(Product.sku == product.sku).first()
         if existing_product:
             raise HTTPException(status_code=400, detail="SKU already exists")
-    
-    # Update product fields
-    update_data = product.model_dump(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(db_product, field, value)
-    
-    db.commit()
-    db.refresh(db_product)
-    return db_product
+        
+        db_product = Product(**product.model_dump())
+        db.add(db_product)
+        db.flush()
+        
+        # Create initial stock movement if stock_quantity > 0
+        if db_product.stock_quantity > 0:
+            stock_movement = StockMovement(
+                product_id=db_product.id,
+                movement_type="in",
+                quantity=db_product.stock_quantity,
+                previous_stock=0,
+                new_stock=db_product.stock_quantity,
+                notes="Initial stock"
+            )
+            db.add(stock_movement)
+            db.flush()
+        
+        db.refresh(db_product)
+        return ProductSchema.model_validate(db_product)
+
+    return await run_write(unit)
+
+
+@router.post("/import")
+async def import_products(
+    file: UploadFile = File(...),
+    on_conflict: str = "update",
+    create_categories: bool = False
+):
+    """Create or update products in bulk from a CSV or XLSX file.
+
+    The first row names the columns (sku plus any of the product fields; a
+    category name can be given instead of category_id). Rows whose SKU exists
+    are updated with the cells they fill in, skipped or reported, depending on
+    on_conflict. Returns the counts and the errors of each rejected row.
+    """
+    try:
+        return await product_import.import_products(
+            file.file, file.filename, on_conflict=on_conflict, create_categories=create_categories
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.put("/{product_id}", response_model=ProductSchema)
+async def update_product(product_id: int, product: ProductUpdate):
+    """Update a product"""
+    def unit(db: Session):
+        db_product = db.query(Product).filter(Product.id == product_id).first()
+        if not db_product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        
+        # Check if category exists if being updated
+        if product.category_id:
+            category = db.query(Category).filter(Category.id == product.category_id).first()
+            if not category:
+                raise HTTPException(status_code=404, detail="Category not found")
+        
+        # Check if SKU already exists if being updated
+        if product.sku and product.sku != db_product.sku:
+            existing_product = db.query(Product).filter(Product.sku == product.sku).first()
+            if existing_product:
+                raise HTTPException(status_code=400, detail="SKU already exists")
+        
+        # Update product fields
+        update_data = product.model_dump(exclude_unset=True)
+        for field, value in update_data.items():
+            setattr(db_product, field, value)
+        if "image_url" in update_data and "images" not in update_data:
+            db.flush()
+            storage.set_primary_image(db, product_id, db_product.image_url)
+        
+        db.flush()
+        db.refresh(db_product)
+        return ProductSchema.model_validate(db_product)
+
+    return await run_write(unit)
 
 
 @router.delete("/{product_id}")
-def delete_product(product_id: int, db: Session = Depends(get_db)):
+async def delete_product(product_id: int):
     """Delete a product (soft delete by setting is_active to False)"""
-    db_product = db.query(Product).filter(Product.id == product_id).first()
-    if not db_product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    db_product.is_active = False
-    db.commit()
-    return {"message": "Product deactivated successfully"}
+    def unit(db: Session):
+        db_product = db.query(Product).filter(Product.id == product_id).first()
+        if not db_product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        
+        db_product.is_active = False
+        return {"message": "Product deactivated successfully"}
+
+    return await run_write(unit)
 
 
 @router.post("/{product_id}/stock", response_model=StockMovementSchema)
-def update_stock(
-    product_id: int,
-    movement: StockMovementCreate,
-    db: Session = Depends(get_db)
-):
+async def update_stock(product_id: int, movement: StockMovementCreate):
     """Update product stock with movement tracking"""
-    product = db.query(Product).filter(Product.id == product_id).first()
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    previous_stock = product.stock_quantity
-    
-    if movement.movement_type == "in":
-        new_stock = previous_stock + movement.quantity
-    elif movement.movement_type == "out":
-        new_stock = previous_stock - movement.quantity
-        if new_stock < 0:
-            raise HTTPException(status_code=400, detail="Insufficient stock")
-    elif movement.movement_type == "adjustment":
-        new_stock = movement.quantity
-    else:
-        raise HTTPException(status_code=400, detail="Invalid movement type")
-    
-    # Update product stock
-    product.stock_quantity = new_stock
-    
-    # Create stock movement record
-    db_movement = StockMovement(
-        product_id=product_id,
-        movement_type=movement.movement_type,
-        quantity=movement.quantity,
-        previous_stock=previous_stock,
-        new_stock=new_stock,
-        notes=movement.notes
-    )
-    
-    db.add(db_movement)
-    db.commit()
-    db.refresh(db_movement)
-    
-    return db_movement
+    def unit(db: Session):
+        product = db.query(Product).filter(Product.id == product_id).with_for_update().first()
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        
+        previous_stock = product.stock_quantity
+        
+        if movement.movement_type == "in":
+            new_stock = previous_stock + movement.quantity
+        elif movement.movement_type == "out":
+            new_stock = previous_stock - movement.quantity
+            if new_stock < 0:
+                raise HTTPException(status_code=400, detail="Insufficient stock")
+        elif movement.movement_type == "adjustment":
+            new_stock = movement.quantity
+        else:
+            raise HTTPException(status_code=400, detail="Invalid movement type")
+        
+        # Update product stock
+        product.stock_quantity = new_stock
+        
+        # Create stock movement record
+        db_movement = StockMovement(
+            product_id=product_id,
+            movement_type=movement.movement_type,
+            quantity=movement.quantity,
+            previous_stock=previous_stock,
+            new_stock=new_stock,
+            notes=movement.notes
+        )
+        
+        db.add(db_movement)
+        db.flush()
+        db.refresh(db_movement)
+        return StockMovementSchema.model_validate(db_movement)
+
+    return await run_write(unit)
+
+
+@router.post("/stock/bulk")
+async def bulk_update_stock(stock_update: BulkStockUpdate, dry_run: bool = False):
+    """Set (mode=count, e.g. a stocktake) or change (mode=delta) the stock of many products at once.
+
+    Quantities for the same product are added up. All stock levels and movements
+    are written in one transaction; dry_run only reports the variance.
+    """
+    try:
+        quantities = stocktake.quantities_from_items(stock_update.items, stock_update.mode)
+        return await stocktake.update_stock_levels(quantities, stock_update.mode, stock_update.notes, dry_run)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/stock/bulk/csv")
+async def bulk_update_stock_csv(
+    file: UploadFile = File(...),
+    mode: str = "count",
+    notes: Optional[str] = None,
+    dry_run: bool = False
+):
+    """Like /stock/bulk, from scanner output: one code (barcode or SKU) per line,
+    optionally followed by a quantity; each line without one counts as one unit"""
+    try:
+        quantities = await run_in_threadpool(stocktake.quantities_from_csv, file.file, mode)
+        return await stocktake.update_stock_levels(quantities, mode, notes, dry_run)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.get("/{product_id}/movements", response_model=List[StockMovementSchema])
@@ -173,25 +269,21 @@ def get_product_movements(
     product_id: int,
     skip: int = 0,
     limit: int = 50,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get stock movement history for a product"""
     product = db.query(Product).filter(Product.id == product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    movements = db.query(StockMovement)\
-        .filter(StockMovement.product_id == product_id)\
-        .order_by(StockMovement.created_at.desc())\
-        .offset(skip).limit(limit).all()
-    
-    return movements
+    return archive.product_movements(db, product, skip, limit)
 
 
 @router.get("/low-stock/", response_model=List[ProductSchema])
-def get_low_stock_products(db: Session = Depends(get_db)):
+def get_low_stock_products(db: Session = Depends(get_read_db)):
     """Get products with stock below minimum level"""
     products = db.query(Product)\
+        .options(selectinload(Product.category), selectinload(Product.product_images))\
         .filter(Product.stock_quantity <= Product.min_stock_level)\
         .filter(Product.is_active)\
         .all()
@@ -13,7 +13,7 @@ from openpyxl.styles import Font, Alignment, PatternFill
 from openpyxl.utils import get_column_letter
 import csv
 
-from app.database import get_db
+from app.database import get_read_db
 from app.models import Product, Sale, Category
 from app.schemas import ReportRequest
 
@@ -175,7 +175,7 @@ def create_csv_report(headers: list, data: list) -> bytes:
 
 
 @router.post("/generate")
-async def generate_report(request: ReportRequest, db: Session = Depends(get_db)):
+def generate_report(request: ReportRequest, db: Session = Depends(get_read_db)):
     """Generate a report based on the request"""
     
     # Parse dates if provided
@@ -202,18 +202,18 @@ async def generate_report(request: ReportRequest, db: Session = Depends(get_db))
     
     # Generate report based on type
     if request.report_type == "sales":
-        return await generate_sales_report(start_date, end_date, request.format, db)
+        return generate_sales_report(start_date, end_date, request.format, db)
     elif request.report_type == "inventory":
-        return await generate_inventory_report(request.format, db)
+        return generate_inventory_report(request.format, db)
     elif request.report_type == "categories":
-        return await generate_categories_report(request.format, db)
+        return generate_categories_report(request.format, db)
     elif request.report_type == "low_stock":
-        return await generate_low_stock_report(request.format, db)
+        return generate_low_stock_report(request.format, db)
     else:
         raise HTTPException(status_code=400, detail="Invalid report type")
 
 
-async def generate_sales_report(start_date: Optional[datetime], end_date: Optional[datetime], format: str, db: Session):
+def generate_sales_report(start_date: Optional[datetime], end_date: Optional[datetime], format: str, db: Session):
     """Generate sales report"""
     
     # Build query
@@ -294,7 +294,7 @@ async def generate_sales_report(start_date: Optional[datetime], end_date: Option
         )
 
 
-async def generate_inventory_report(format: str, db: Session):
+def generate_inventory_report(format: str, db: Session):
     """Generate inventory report"""
     
     # Get all active products with category info
@@ -367,7 +367,7 @@ async def generate_inventory_report(format: str, db: Session):
         )
 
 
-async def generate_categories_report(format: str, db: Session):
+def generate_categories_report(format: str, db: Session):
     """Generate categories report"""
     
     # Get categories with product counts
@@ -422,7 +422,7 @@ async def generate_categories_report(format: str, db: Session):
         )
 
 
-async def generate_low_stock_report(format: str, db: Session):
+def generate_low_stock_report(format: str, db: Session):
     """Generate low stock report (products below minimum stock)"""
     products = db.query(
         Product.name,
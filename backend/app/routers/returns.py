@@ -8,7 +8,8 @@ from typing import List, Optional
 from datetime import datetime
 
 from app.database import get_db
-from app.models import Return, ReturnItem, Product, Sale, Settings as SettingsModel
+from app.writer import run_write
+from app.models import Return, ReturnItem, Product, Sale, StockMovement, Settings as SettingsModel
 from app.schemas import Return as ReturnSchema, ReturnCreate
 import uuid
 
@@ -121,7 +122,7 @@ def get_returns(
     if status:
         query = query.filter(Return.status == status)
     
-    returns = query.offset(skip).limit(limit).all()
+    returns = query.order_by(Return.id).offset(skip).limit(limit).all()
     return returns
 
 
@@ -135,75 +136,86 @@ def get_return(return_id: int, db: Session = Depends(get_db)):
 
 
 @router.post("/", response_model=ReturnSchema)
-def create_return(return_data: ReturnCreate, db: Session = Depends(get_db)):
+async def create_return(return_data: ReturnCreate):
     """Create a new return"""
-    
-    # Validate products exist and calculate total
-    total_amount = 0
-    for item in return_data.items:
-        product = db.query(Product).filter(Product.id == item.product_id).first()
-        if not product:
-            raise HTTPException(status_code=404, detail=f"Product {item.product_id} not found")
-        total_amount += item.quantity * item.unit_price
-    
-    # Create return record
-    db_return = Return(
-        return_number=generate_return_number(),
-        original_sale_id=return_data.original_sale_id,
-        total_amount=total_amount,
-        refund_method=return_data.refund_method,
-        reason=return_data.reason,
-        status=return_data.status
-    )
-    
-    db.add(db_return)
-    db.flush()  # Get the return ID
-    
-    # Create return items
-    for item in return_data.items:
-        db_item = ReturnItem(
-            return_id=db_return.id,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            unit_price=item.unit_price,
-            total_price=item.quantity * item.unit_price,
-            condition=item.condition
+    def unit(db: Session):
+        # Validate products exist and calculate total
+        total_amount = 0
+        for item in return_data.items:
+            product = db.query(Product).filter(Product.id == item.product_id).first()
+            if not product:
+                raise HTTPException(status_code=404, detail=f"Product {item.product_id} not found")
+            total_amount += item.quantity * item.unit_price
+        
+        # Create return record
+        db_return = Return(
+            return_number=generate_return_number(),
+            original_sale_id=return_data.original_sale_id,
+            total_amount=total_amount,
+            refund_method=return_data.refund_method,
+            reason=return_data.reason,
+            status=return_data.status
         )
-        db.add(db_item)
-    
-    db.commit()
-    db.refresh(db_return)
-    return db_return
+        
+        db.add(db_return)
+        db.flush()  # Get the return ID
+        
+        # Create return items
+        for item in return_data.items:
+            db_item = ReturnItem(
+                return_id=db_return.id,
+                product_id=item.product_id,
+                quantity=item.quantity,
+                unit_price=item.unit_price,
+                total_price=item.quantity * item.unit_price,
+                condition=item.condition
+            )
+            db.add(db_item)
+        
+        db.flush()
+        db.refresh(db_return)
+        return ReturnSchema.model_validate(db_return)
+
+    return await run_write(unit)
 
 
 @router.put("/{return_id}/status")
-def update_return_status(
-    return_id: int,
-    status: str,
-    db: Session = Depends(get_db)
-):
+async def update_return_status(return_id: int, status: str):
     """Update return status (approve, reject, complete)"""
-    return_order = db.query(Return).filter(Return.id == return_id).first()
-    if not return_order:
-        raise HTTPException(status_code=404, detail="Return not found")
-    
-    return_order.status = status
-    
-    # If approving return, update stock quantities (do not mark processed yet)
-    if status == "approved":
-        for item in return_order.return_items:
-            product = db.query(Product).filter(Product.id == item.product_id).first()
-            if product:
-                # Add returned items back to stock if condition is good
-                if item.condition == "good":
-                    product.stock_quantity += item.quantity
-
-    # When refund is paid out, mark as processed (used for revenue subtraction)
-    if status == "refunded":
-        return_order.processed_at = datetime.now()
-    
-    db.commit()
-    return {"message": f"Return status updated to {status}"}
+    def unit(db: Session):
+        return_order = db.query(Return).filter(Return.id == return_id).first()
+        if not return_order:
+            raise HTTPException(status_code=404, detail="Return not found")
+        
+        previous_status = return_order.status
+        return_order.status = status
+        
+        # If approving return, update stock quantities (do not mark processed yet)
+        if status == "approved" and previous_status != "approved":
+            for item in return_order.return_items:
+                product = db.query(Product).filter(Product.id == item.product_id).with_for_update().first()
+                if product:
+                    # Add returned items back to stock if condition is good
+                    if item.condition == "good":
+                        previous_stock = product.stock_quantity
+                        product.stock_quantity = previous_stock + item.quantity
+                        db.add(StockMovement(
+                            product_id=item.product_id,
+                            movement_type="in",
+                            quantity=item.quantity,
+                            previous_stock=previous_stock,
+                            new_stock=product.stock_quantity,
+                            reference_id=return_order.id,
+                            notes=f"Return #{return_order.return_number} approved"
+                        ))
+
+        # When refund is paid out, mark as processed (used for revenue subtraction)
+        if status == "refunded":
+            return_order.processed_at = datetime.now()
+        
+        return {"message": f"Return status updated to {status}"}
+
+    return await run_write(unit)
 
 
 @router.delete("/{return_id}")
@@ -3,11 +3,13 @@ import io
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import func, desc, select
 from typing import List, Optional
 from datetime import datetime, date
-from app.database import get_db
+import uuid
+from app.database import get_db, get_read_db, get_async_db
+from app.writer import run_write
 from app.models import Sale, SalesItem, Product, StockMovement, Settings as SettingsModel
 from app.schemas import Sale as SaleSchema, SaleCreate
 
@@ -17,7 +19,8 @@ router = APIRouter()
 def generate_sale_number():
     """Generate a unique sale number"""
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    return f"SALE-{timestamp}"
+    # Several tills can ring up sales within the same second
+    return f"SALE-{timestamp}-{uuid.uuid4().hex[:6].upper()}"
 
 
 # -------- Invoice (PDF) Generation --------
@@ -126,30 +129,34 @@ def _build_sale_invoice_pdf(db: Session, sale: Sale) -> bytes:
 
 
 @router.get("/", response_model=List[SaleSchema])
-def get_sales(
+async def get_sales(
     skip: int = 0,
     limit: int = 100,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    db: Session = Depends(get_db)
+    db=Depends(get_async_db)
 ):
     """Get all sales with optional date filtering"""
-    query = db.query(Sale)
+    query = select(Sale).options(
+        selectinload(Sale.sales_items).selectinload(SalesItem.product)
+    )
     
     if start_date:
         start_dt = datetime.fromisoformat(start_date)
-        query = query.filter(Sale.created_at >= start_dt)
+        query = query.where(Sale.created_at >= start_dt)
     
     if end_date:
         end_dt = datetime.fromisoformat(end_date)
-        query = query.filter(Sale.created_at <= end_dt)
+        query = query.where(Sale.created_at <= end_dt)
     
-    sales = query.order_by(desc(Sale.created_at)).offset(skip).limit(limit).all()
+    sales = (await db.execute(
+        query.order_by(desc(Sale.created_at)).offset(skip).limit(limit)
+    )).scalars().all()
     return sales
 
 
 @router.get("/{sale_id}", response_model=SaleSchema)
-def get_sale(sale_id: int, db: Session = Depends(get_db)):
+def get_sale(sale_id: int, db: Session = Depends(get_read_db)):
     """Get a specific sale by ID"""
     sale = db.query(Sale).filter(Sale.id == sale_id).first()
     if not sale:
@@ -158,81 +165,85 @@ def get_sale(sale_id: int, db: Session = Depends(get_db)):
 
 
 @router.post("/", response_model=SaleSchema)
-def create_sale(sale: SaleCreate, db: Session = Depends(get_db)):
+async def create_sale(sale: SaleCreate):
     """Create a new sale"""
     if not sale.items:
         raise HTTPException(status_code=400, detail="Sale must have at least one item")
-    
-    # Calculate totals
-    total_amount = 0
-    for item in sale.items:
-        # Verify product exists and has sufficient stock
-        product = db.query(Product).filter(Product.id == item.product_id).first()
-        if not product:
-            raise HTTPException(status_code=404, detail=f"Product with ID {item.product_id} not found")
+
+    def unit(db: Session):
+        # Calculate totals
+        total_amount = 0
+        for item in sale.items:
+            # Verify product exists and has sufficient stock. The row lock keeps other
+            # app instances on a shared PostgreSQL database from racing us (no-op on SQLite)
+            product = db.query(Product).filter(Product.id == item.product_id).with_for_update().first()
+            if not product:
+                raise HTTPException(status_code=404, detail=f"Product with ID {item.product_id} not found")
+            
+            if product.stock_quantity < item.quantity:
+                raise HTTPException(
+                    status_code=400, 
+                    detail=f"Insufficient stock for product {product.name}. Available: {product.stock_quantity}, Required: {item.quantity}"
+                )
+            
+            total_amount += item.quantity * item.unit_price
         
-        if product.stock_quantity < item.quantity:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Insufficient stock for product {product.name}. Available: {product.stock_quantity}, Required: {item.quantity}"
-            )
+        # Calculate final amount
+        final_amount = total_amount - sale.discount + sale.tax
         
-        total_amount += item.quantity * item.unit_price
-    
-    # Calculate final amount
-    final_amount = total_amount - sale.discount + sale.tax
-    
-    # Create sale
-    db_sale = Sale(
-        sale_number=generate_sale_number(),
-        total_amount=total_amount,
-        discount=sale.discount,
-        tax=sale.tax,
-        final_amount=final_amount,
-        payment_method=sale.payment_method,
-        notes=sale.notes
-    )
-    
-    db.add(db_sale)
-    db.flush()  # Get the sale ID
-    
-    # Create sale items and update stock
-    for item in sale.items:
-        # Create sales item
-        db_item = SalesItem(
-            sale_id=db_sale.id,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            unit_price=item.unit_price,
-            total_price=item.quantity * item.unit_price
+        # Create sale
+        db_sale = Sale(
+            sale_number=generate_sale_number(),
+            total_amount=total_amount,
+            discount=sale.discount,
+            tax=sale.tax,
+            final_amount=final_amount,
+            payment_method=sale.payment_method,
+            notes=sale.notes
         )
-        db.add(db_item)
         
-        # Update product stock
-        product = db.query(Product).filter(Product.id == item.product_id).first()
-        previous_stock = product.stock_quantity
-        new_stock = previous_stock - item.quantity
-        product.stock_quantity = new_stock
+        db.add(db_sale)
+        db.flush()  # Get the sale ID
         
-        # Create stock movement
-        stock_movement = StockMovement(
-            product_id=item.product_id,
-            movement_type="out",
-            quantity=item.quantity,
-            previous_stock=previous_stock,
-            new_stock=new_stock,
-            reference_id=db_sale.id,
-            notes=f"Sale #{db_sale.sale_number}"
-        )
-        db.add(stock_movement)
-    
-    db.commit()
-    db.refresh(db_sale)
-    return db_sale
+        # Create sale items and update stock
+        for item in sale.items:
+            # Create sales item
+            db_item = SalesItem(
+                sale_id=db_sale.id,
+                product_id=item.product_id,
+                quantity=item.quantity,
+                unit_price=item.unit_price,
+                total_price=item.quantity * item.unit_price
+            )
+            db.add(db_item)
+            
+            # Update product stock
+            product = db.query(Product).filter(Product.id == item.product_id).first()
+            previous_stock = product.stock_quantity
+            new_stock = previous_stock - item.quantity
+            product.stock_quantity = new_stock
+            
+            # Create stock movement
+            stock_movement = StockMovement(
+                product_id=item.product_id,
+                movement_type="out",
+                quantity=item.quantity,
+                previous_stock=previous_stock,
+                new_stock=new_stock,
+                reference_id=db_sale.id,
+                notes=f"Sale #{db_sale.sale_number}"
+            )
+            db.add(stock_movement)
+        
+        db.flush()
+        db.refresh(db_sale)
+        return SaleSchema.model_validate(db_sale)
+
+    return await run_write(unit)
 
 
 @router.get("/{sale_id}/invoice")
-def download_sale_invoice(sale_id: int, db: Session = Depends(get_db)):
+def download_sale_invoice(sale_id: int, db: Session = Depends(get_read_db)):
     """Download PDF invoice for a sale"""
     sale = db.query(Sale).filter(Sale.id == sale_id).first()
     if not sale:
@@ -247,41 +258,42 @@ def download_sale_invoice(sale_id: int, db: Session = Depends(get_db)):
 
 
 @router.delete("/{sale_id}")
-def cancel_sale(sale_id: int, db: Session = Depends(get_db)):
+async def cancel_sale(sale_id: int):
     """Cancel a sale and restore stock"""
-    sale = db.query(Sale).filter(Sale.id == sale_id).first()
-    if not sale:
-        raise HTTPException(status_code=404, detail="Sale not found")
-    
-    # Restore stock for each item
-    for item in sale.sales_items:
-        product = db.query(Product).filter(Product.id == item.product_id).first()
-        if product:
-            previous_stock = product.stock_quantity
-            new_stock = previous_stock + item.quantity
-            product.stock_quantity = new_stock
-            
-            # Create stock movement for reversal
-            stock_movement = StockMovement(
-                product_id=item.product_id,
-                movement_type="in",
-                quantity=item.quantity,
-                previous_stock=previous_stock,
-                new_stock=new_stock,
-                reference_id=sale.id,
-                notes=f"Sale #{sale.sale_number} cancelled"
-            )
-            db.add(stock_movement)
-    
-    # Delete the sale (cascade will delete sales items)
-    db.delete(sale)
-    db.commit()
-    
-    return {"message": "Sale cancelled and stock restored"}
+    def unit(db: Session):
+        sale = db.query(Sale).filter(Sale.id == sale_id).first()
+        if not sale:
+            raise HTTPException(status_code=404, detail="Sale not found")
+        
+        # Restore stock for each item
+        for item in sale.sales_items:
+            product = db.query(Product).filter(Product.id == item.product_id).with_for_update().first()
+            if product:
+                previous_stock = product.stock_quantity
+                new_stock = previous_stock + item.quantity
+                product.stock_quantity = new_stock
+                
+                # Create stock movement for reversal
+                stock_movement = StockMovement(
+                    product_id=item.product_id,
+                    movement_type="in",
+                    quantity=item.quantity,
+                    previous_stock=previous_stock,
+                    new_stock=new_stock,
+                    reference_id=sale.id,
+                    notes=f"Sale #{sale.sale_number} cancelled"
+                )
+                db.add(stock_movement)
+        
+        # Delete the sale (cascade will delete sales items)
+        db.delete(sale)
+        return {"message": "Sale cancelled and stock restored"}
+
+    return await run_write(unit)
 
 
 @router.get("/today/summary")
-def get_today_sales_summary(db: Session = Depends(get_db)):
+def get_today_sales_summary(db: Session = Depends(get_read_db)):
     """Get today's sales summary"""
     today = date.today()
     today_start = datetime.combine(today, datetime.min.time())
@@ -306,7 +318,7 @@ def get_today_sales_summary(db: Session = Depends(get_db)):
 def get_monthly_sales_summary(
     year: int = None,
     month: int = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get monthly sales summary"""
     if not year:
@@ -333,7 +345,7 @@ def get_monthly_sales_summary(
         "month": month,
         "daily_sales": [
             {
-                "date": row.date.isoformat(),
+                "date": str(row.date),  # SQLite returns a string, other dialects a date
                 "total": float(row.total),
                 "count": row.count
             } for row in sales_data
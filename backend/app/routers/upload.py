@@ -1,12 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from sqlalchemy import delete, func, select
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+import hashlib
 import os
-import uuid
+import tempfile
 from typing import List
 
-from app.database import get_db
+from app.database import get_db, get_read_db
 from app.paths import get_data_dir
-from app.models import Product
+from app import images, storage
+from app.models import Product, ProductImage
 
 router = APIRouter(prefix="/upload", tags=["upload"])
 
@@ -15,6 +19,16 @@ UPLOAD_DIR = get_data_dir('uploads')
 
 ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+MAX_FILES = 10
+# Whole request bodies: every file at its limit plus multipart framing
+MULTIPART_OVERHEAD = 1024 * 1024
+MAX_REQUEST_SIZE = MAX_FILES * MAX_FILE_SIZE + MULTIPART_OVERHEAD
+MAX_SINGLE_REQUEST_SIZE = MAX_FILE_SIZE + MULTIPART_OVERHEAD
+CHUNK_SIZE = 64 * 1024
+
+
+class FileTooLarge(Exception):
+    """Raised by save_upload as soon as an upload passes its size limit"""
 
 
 def get_file_extension(filename: str) -> str:
@@ -22,11 +36,48 @@ def get_file_extension(filename: str) -> str:
     return os.path.splitext(filename)[1].lower()
 
 
-def generate_unique_filename(original_filename: str) -> str:
-    """Generate a unique filename while preserving extension"""
-    extension = get_file_extension(original_filename)
-    unique_name = str(uuid.uuid4())
-    return f"{unique_name}{extension}"
+def _write_chunk(buffer, digest, chunk: bytes):
+    digest.update(chunk)
+    buffer.write(chunk)
+
+
+def _store_upload(tmp_path: str, target: str):
+    try:
+        # Same content already stored: keep that file, refreshed so GC sees a new upload
+        os.utime(target)
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        os.replace(tmp_path, target)
+
+
+async def save_upload(file: UploadFile, max_size: int = MAX_FILE_SIZE) -> str:
+    """Stream an upload into UPLOAD_DIR under its content-addressed name and return that name.
+
+    Chunks are hashed and written to a temporary file on the thread pool, then
+    renamed into place, so a half-written image is never served. Identical
+    content maps to the same file and is stored once. Reading stops as soon as
+    the file passes max_size.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, prefix=storage.TEMP_PREFIX, suffix=".part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise FileTooLarge(file.filename)
+                await run_in_threadpool(_write_chunk, buffer, digest, chunk)
+        filename = storage.content_filename(digest.hexdigest(), file.filename)
+        await run_in_threadpool(_store_upload, tmp_path, os.path.join(UPLOAD_DIR, filename))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return filename
 
 
 @router.post("/product-image/{product_id}")
@@ -49,22 +100,17 @@ async def upload_product_image(
             detail="Invalid file type. Allowed: jpg, jpeg, png, gif, webp"
         )
     
-    # Validate file size
-    contents = await file.read()
-    if len(contents) > MAX_FILE_SIZE:
+    # Save file, enforcing the size limit while streaming
+    try:
+        filename = await save_upload(file)
+    except FileTooLarge:
         raise HTTPException(status_code=400, detail="File size too large (max 5MB)")
-    
-    # Generate unique filename
-    filename = generate_unique_filename(file.filename)
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    
-    # Save file
-    with open(file_path, "wb") as buffer:
-        buffer.write(contents)
+    images.schedule_variants(filename)
     
     # Update product image URL
     image_url = f"/uploads/{filename}"
     product.image_url = image_url
+    storage.set_primary_image(db, product_id, image_url)
     db.commit()
     
     return {
@@ -90,16 +136,12 @@ async def upload_product_image_temp(
             detail="Invalid file type. Allowed: jpg, jpeg, png, gif, webp"
         )
 
-    # Validate file size
-    contents = await file.read()
-    if len(contents) > MAX_FILE_SIZE:
+    # Generate unique filename and save, enforcing the size limit while streaming
+    try:
+        filename = await save_upload(file)
+    except FileTooLarge:
         raise HTTPException(status_code=400, detail="File size too large (max 5MB)")
-
-    # Generate unique filename and save
-    filename = generate_unique_filename(file.filename)
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    with open(file_path, "wb") as buffer:
-        buffer.write(contents)
+    images.schedule_variants(filename)
 
     image_url = f"/uploads/{filename}"
     return {
@@ -122,8 +164,8 @@ async def upload_multiple_product_images(
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    if len(files) > 10:
-        raise HTTPException(status_code=400, detail="Maximum 10 images allowed")
+    if len(files) > MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Maximum {MAX_FILES} images allowed")
     
     uploaded_images = []
     
@@ -132,38 +174,39 @@ async def upload_multiple_product_images(
         if get_file_extension(file.filename) not in ALLOWED_EXTENSIONS:
             continue  # Skip invalid files
         
-        # Validate file size
-        contents = await file.read()
-        if len(contents) > MAX_FILE_SIZE:
+        # Save file, enforcing the size limit while streaming
+        try:
+            filename = await save_upload(file)
+        except FileTooLarge:
             continue  # Skip large files
-        
-        # Generate unique filename
-        filename = generate_unique_filename(file.filename)
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            buffer.write(contents)
+        images.schedule_variants(filename)
         
         image_url = f"/uploads/{filename}"
         uploaded_images.append(image_url)
     
-    # Update product images (store as JSON string)
-    import json
-    current_images = json.loads(product.images) if product.images else []
-    current_images.extend(uploaded_images)
-    product.images = json.dumps(current_images)
-    
+    # Identical files share one URL; add each once, after the existing images
+    existing = set(db.scalars(select(ProductImage.url).where(ProductImage.product_id == product_id)))
+    new_urls = [url for url in dict.fromkeys(uploaded_images) if url not in existing]
+    next_position = db.query(func.coalesce(func.max(ProductImage.position) + 1, 0))\
+        .filter(ProductImage.product_id == product_id).scalar()
+
+    db.add_all(
+        ProductImage(product_id=product_id, url=url, position=position, is_primary=url == product.image_url)
+        for position, url in enumerate(new_urls, start=next_position)
+    )
+
     # Set main image if not already set
     if not product.image_url and uploaded_images:
         product.image_url = uploaded_images[0]
-    
+        db.flush()
+        storage.set_primary_image(db, product_id, product.image_url)
+
     db.commit()
-    
+
     return {
         "message": f"Uploaded {len(uploaded_images)} images successfully",
         "uploaded_images": uploaded_images,
-        "total_images": len(current_images)
+        "total_images": len(existing) + len(new_urls)
     }
 
 
@@ -182,20 +225,28 @@ async def delete_product_image(
     # Remove from main image
     if product.image_url == image_url:
         product.image_url = None
-    
+
     # Remove from additional images
-    if product.images:
-        import json
-        current_images = json.loads(product.images)
-        if image_url in current_images:
-            current_images.remove(image_url)
-            product.images = json.dumps(current_images)
-    
-    # Delete physical file
-    filename = image_url.split('/')[-1]
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    db.execute(
+        delete(ProductImage)
+        .where(ProductImage.product_id == product_id, ProductImage.url == image_url)
+    )
     
     db.commit()
-    return {"message": "Image deleted successfully"}
\ No newline at end of file
+
+    # The file stays: another product or a form still being filled in may use it.
+    # collect_garbage() removes it once unreferenced past the grace period.
+    
+    return {"message": "Image deleted successfully"}
+
+
+@router.post("/gc")
+def collect_upload_garbage(
+    grace_hours: float = storage.GC_GRACE_HOURS,
+    dry_run: bool = False,
+    db: Session = Depends(get_read_db)
+):
+    """Delete uploaded images no product references, once older than grace_hours"""
+    if grace_hours < 0:
+        raise HTTPException(status_code=400, detail="grace_hours must not be negative")
+    return storage.collect_garbage(db, grace_hours=grace_hours, dry_run=dry_run)
@@ -0,0 +1,313 @@
+"""In-process scheduler for backups and database upkeep.
+
+A loop started from the app lifespan wakes up every IMS_SCHEDULER_INTERVAL
+seconds and runs whichever tasks are due: the automatic backup configured by
+the auto_backup / backup_frequency settings (followed by retention pruning and
+a resync of the backup catalogue), PRAGMA optimize, ANALYZE, a check of the
+category product counters, stock checkpoints, stock movement archiving,
+incremental vacuum, WAL checkpoints and upload garbage collection. Tasks only
+run while the app is quiet: when the request rate since the last tick is above
+IMS_SCHEDULER_BUSY_RPS the scheduler backs off, doubling its wait each time,
+until traffic drops. Every run, skip and deferral is kept in a short in-memory
+history for the admin API.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Deque, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from . import archive, backups, database, migrations, stock_history, storage
+from .maintenance import gate
+from .models import Settings as SettingsModel
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.getenv("IMS_SCHEDULER", "1") != "0"
+# Seconds between checks, and before the first one after startup
+TICK_INTERVAL = float(os.getenv("IMS_SCHEDULER_INTERVAL", "60"))
+START_DELAY = float(os.getenv("IMS_SCHEDULER_START_DELAY", "60"))
+# Requests per second above which maintenance waits for a quieter moment
+BUSY_RPS = float(os.getenv("IMS_SCHEDULER_BUSY_RPS", "2"))
+# Longest wait while backing off, in ticks
+MAX_BACKOFF = 16
+HISTORY_SIZE = 200
+# Rows sampled per index by ANALYZE; keeps it fast on large databases
+ANALYSIS_LIMIT = 1000
+
+BACKUP_FREQUENCIES = {
+    "daily": timedelta(days=1),
+    "weekly": timedelta(weeks=1),
+    "monthly": timedelta(days=30),
+}
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def _run_statements(*statements: str) -> str:
+    with database.engine.connect() as conn:
+        for statement in statements:
+            result = conn.exec_driver_sql(statement)
+            rows = result.fetchall() if result.returns_rows else []
+        conn.commit()
+    return ", ".join(str(tuple(row)) for row in rows) or "ok"
+
+
+def _setting(key: str, default: str) -> str:
+    db = database.ReadSessionLocal()
+    try:
+        value = db.query(SettingsModel.value).filter(SettingsModel.key == key).scalar()
+    finally:
+        db.close()
+    return default if value is None else value
+
+
+def _last_backup_time() -> Optional[datetime]:
+    latest = backups.latest_backup()
+    return datetime.fromisoformat(latest["created_at"]) if latest else None
+
+
+def backup_due(now: datetime) -> Optional[str]:
+    """Why a backup is due now, or None"""
+    if _setting("auto_backup", "true") != "true":
+        return None
+    frequency = _setting("backup_frequency", "weekly")
+    last = _last_backup_time()
+    if last is None:
+        return "no backup yet"
+    if now - last >= BACKUP_FREQUENCIES.get(frequency, BACKUP_FREQUENCIES["weekly"]):
+        return f"last backup {last.isoformat(timespec='seconds')} is older than {frequency}"
+    return None
+
+
+def run_scheduled_backup() -> str:
+    job = backups.start_backup()
+    while not job.finished:
+        time.sleep(0.5)
+    if job.status != "completed":
+        raise RuntimeError(job.error or f"backup {job.status}")
+    return f"{job.kind} backup {job.filename} ({job.size} bytes)"
+
+
+def prune_backups() -> str:
+    deleted = backups.prune_backups()
+    return f"deleted {len(deleted)} old backups" if deleted else "nothing to delete"
+
+
+def sync_backup_catalog() -> str:
+    report = backups.rebuild_catalog()
+    return f"added {report['added']}, removed {report['removed']} catalogue entries"
+
+
+def verify_category_counts() -> str:
+    with database.engine.begin() as conn:
+        drift = migrations.rebuild_category_counts(conn)
+    if not drift:
+        return "all category counters match"
+    return "corrected categories " + ", ".join(str(entry["category_id"]) for entry in drift)
+
+
+def archive_stock_movements() -> str:
+    if not database.ARCHIVE_ENABLED:
+        return "skipped: archiving is disabled"
+    report = archive.archive_movements()
+    return f"archived {report['archived']} movements from before {report['cutoff']}"
+
+
+def write_stock_checkpoints() -> str:
+    return f"checkpointed {stock_history.write_checkpoints()} products"
+
+
+def incremental_vacuum() -> str:
+    with database.engine.connect() as conn:
+        mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+        if mode != 2:
+            return "skipped: auto_vacuum is not INCREMENTAL"
+        freelist = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+    _run_statements("PRAGMA incremental_vacuum")
+    return f"released {freelist} free pages"
+
+
+def wal_checkpoint() -> str:
+    with database.engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA journal_mode").scalar() != "wal":
+            return "skipped: not in WAL mode"
+        busy, log_frames, checkpointed = conn.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)").one()
+    return f"checkpointed {checkpointed} of {log_frames} frames" + (" (busy)" if busy else "")
+
+
+def collect_upload_garbage() -> str:
+    db = database.ReadSessionLocal()
+    try:
+        report = storage.collect_garbage(db)
+    finally:
+        db.close()
+    return f"deleted {report['deleted_files']} files, {report['reclaimed_bytes']} bytes"
+
+
+class ScheduledTask:
+    def __init__(self, name: str, run: Callable[[], str], interval: Optional[float] = None,
+                 due: Optional[Callable[[datetime], Optional[str]]] = None, sqlite_only: bool = True):
+        self.name = name
+        self.run = run
+        self.interval = interval
+        self._due = due
+        self.sqlite_only = sqlite_only
+        self.last_run: Optional[datetime] = None
+        self.last_status: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return database.IS_SQLITE or not self.sqlite_only
+
+    def due(self, now: datetime) -> Optional[str]:
+        if self._due is not None:
+            return self._due(now)
+        if self.last_run is None:
+            return "not run since startup"
+        if (now - self.last_run).total_seconds() >= self.interval:
+            return f"every {self.interval / HOUR:g}h"
+        return None
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "enabled": self.enabled,
+            "interval_seconds": self.interval,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "last_status": self.last_status,
+        }
+
+
+class MaintenanceScheduler:
+    def __init__(self, tasks: List[ScheduledTask]):
+        self.tasks: Dict[str, ScheduledTask] = {task.name: task for task in tasks}
+        self.history: Deque[dict] = deque(maxlen=HISTORY_SIZE)
+        self.request_rate = 0.0
+        self.backoff = 1
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def start(self):
+        if SCHEDULER_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="ims-scheduler")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def pause(self, timeout: float) -> bool:
+        """Wait for the running task, then hold off every other one until resume().
+        False (and not paused) on timeout"""
+        try:
+            await asyncio.wait_for(self._lock.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def resume(self):
+        self._lock.release()
+
+    def _record(self, task: str, status: str, detail: str, started: float, started_at: datetime):
+        self.history.append({
+            "task": task,
+            "status": status,  # ok, skipped, failed, deferred
+            "detail": detail,
+            "started_at": started_at.isoformat(timespec="seconds"),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+
+    async def run_task(self, name: str, reason: str = "requested") -> dict:
+        """Run one task now, regardless of load; one task runs at a time"""
+        task = self.tasks[name]
+        async with self._lock:
+            started, started_at = time.perf_counter(), datetime.now()
+            try:
+                detail = await run_in_threadpool(task.run)
+                status = "skipped" if detail.startswith("skipped") else "ok"
+            except Exception as exc:
+                logger.exception("Scheduled task %s failed", name)
+                status, detail = "failed", str(exc)
+            task.last_run, task.last_status = started_at, status
+            self._record(name, status, f"{reason}: {detail}", started, started_at)
+        return self.history[-1]
+
+    async def tick(self, elapsed: float, requests: int):
+        """Run the due tasks unless the app is busy; returns False when it backed off"""
+        self.request_rate = requests / elapsed if elapsed > 0 else 0.0
+        now = datetime.now()
+        due = []
+        for task in self.tasks.values():
+            if not task.enabled:
+                continue
+            reason = await run_in_threadpool(task.due, now)
+            if reason:
+                due.append((task, reason))
+        if not due:
+            return True
+        if gate.active or self.request_rate > BUSY_RPS:
+            names = ", ".join(task.name for task, _ in due)
+            detail = f"{self.request_rate:.1f} req/s; waiting to run {names}"
+            if not self.history or self.history[-1]["detail"] != detail:
+                self._record("scheduler", "deferred", detail, time.perf_counter(), now)
+            return False
+        for index, (task, reason) in enumerate(due):
+            # A restore may have started while the previous task ran
+            if gate.active:
+                names = ", ".join(task.name for task, _ in due[index:])
+                self._record("scheduler", "deferred", f"maintenance in progress; waiting to run {names}",
+                             time.perf_counter(), datetime.now())
+                return False
+            await self.run_task(task.name, reason)
+        return True
+
+    async def _loop(self):
+        await asyncio.sleep(START_DELAY)
+        last_time, last_requests = time.monotonic(), gate.requests
+        while True:
+            now, requests = time.monotonic(), gate.requests
+            try:
+                idle = await self.tick(now - last_time, requests - last_requests)
+            except Exception:
+                logger.exception("Scheduler tick failed")
+                idle = True
+            last_time, last_requests = now, requests
+            self.backoff = 1 if idle else min(self.backoff * 2, MAX_BACKOFF)
+            await asyncio.sleep(TICK_INTERVAL * self.backoff)
+
+    def status(self) -> dict:
+        return {
+            "enabled": SCHEDULER_ENABLED,
+            "running": self._task is not None and not self._task.done(),
+            "request_rate": round(self.request_rate, 2),
+            "busy_threshold_rps": BUSY_RPS,
+            "backoff": self.backoff,
+            "tasks": [task.as_dict() for task in self.tasks.values()],
+        }
+
+
+scheduler = MaintenanceScheduler([
+    ScheduledTask("backup", run_scheduled_backup, due=backup_due),
+    ScheduledTask("prune_backups", prune_backups, interval=DAY),
+    ScheduledTask("backup_catalog", sync_backup_catalog, interval=DAY),
+    ScheduledTask("optimize", lambda: _run_statements("PRAGMA optimize"), interval=6 * HOUR),
+    ScheduledTask("analyze", lambda: _run_statements(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}", "ANALYZE"),
+                  interval=7 * DAY),
+    ScheduledTask("category_counts", verify_category_counts, interval=7 * DAY, sqlite_only=False),
+    ScheduledTask("stock_checkpoints", write_stock_checkpoints, interval=DAY, sqlite_only=False),
+    ScheduledTask("archive_movements", archive_stock_movements, interval=DAY),
+    ScheduledTask("incremental_vacuum", incremental_vacuum, interval=DAY),
+    ScheduledTask("wal_checkpoint", wal_checkpoint, interval=HOUR),
+    ScheduledTask("upload_gc", collect_upload_garbage, interval=DAY, sqlite_only=False),
+])
@@ -1,7 +1,9 @@
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field, computed_field
 from typing import Optional, List
 from datetime import datetime
 
+from app.images import variant_url
+
 
 # Category Schemas
 class CategoryBase(BaseModel):
@@ -33,6 +35,7 @@ class CategoryWithStats(CategoryBase):
     created_at: datetime
     updated_at: Optional[datetime] = None
     product_count: int = 0
+    active_product_count: int = 0
     is_active: bool = True
 
 
@@ -73,6 +76,26 @@ class ProductUpdate(BaseModel):
     is_active: Optional[bool] = None
 
 
+class ProductImportRow(BaseModel):
+    """One row of a product import. Only sku is required here: name, category,
+    price and cost are checked once it is known whether the product is new."""
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    sku: str = Field(min_length=1)
+    name: Optional[str] = None
+    description: Optional[str] = None
+    barcode: Optional[str] = None
+    category: Optional[str] = None  # category name, as an alternative to category_id
+    category_id: Optional[int] = None
+    price: Optional[float] = None
+    cost: Optional[float] = None
+    stock_quantity: Optional[int] = None
+    min_stock_level: Optional[int] = None
+    unit: Optional[str] = None
+    image_url: Optional[str] = None
+    is_active: Optional[bool] = None
+
+
 class Product(ProductBase):
     model_config = ConfigDict(from_attributes=True)
     
@@ -81,6 +104,17 @@ class Product(ProductBase):
     created_at: datetime
     updated_at: Optional[datetime] = None
 
+    # Resized WebP copies of image_url; None until generated (or without Pillow)
+    @computed_field
+    @property
+    def thumbnail_url(self) -> Optional[str]:
+        return variant_url(self.image_url, "thumb")
+
+    @computed_field
+    @property
+    def medium_url(self) -> Optional[str]:
+        return variant_url(self.image_url, "md")
+
 
 class ProductSimple(BaseModel):
     model_config = ConfigDict(from_attributes=True)
@@ -92,6 +126,11 @@ class ProductSimple(BaseModel):
     stock_quantity: int
     image_url: Optional[str] = None
 
+    @computed_field
+    @property
+    def thumbnail_url(self) -> Optional[str]:
+        return variant_url(self.image_url, "thumb")
+
 
 # Sales Schemas
 class SalesItemBase(BaseModel):
@@ -146,6 +185,20 @@ class StockMovementCreate(StockMovementBase):
     pass
 
 
+class BulkStockItem(BaseModel):
+    """Quantity for one product, identified by id, SKU or barcode"""
+    product_id: Optional[int] = None
+    sku: Optional[str] = None
+    barcode: Optional[str] = None
+    quantity: int
+
+
+class BulkStockUpdate(BaseModel):
+    mode: str = "count"  # count: quantity is what was counted; delta: quantity is added (negative removes)
+    items: List[BulkStockItem]
+    notes: Optional[str] = None
+
+
 class StockMovement(StockMovementBase):
     model_config = ConfigDict(from_attributes=True)
     
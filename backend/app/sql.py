@@ -0,0 +1,58 @@
+"""Portable SQL expressions for queries that differ between database dialects"""
+
+from sqlalchemy import String
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.sql.visitors import InternalTraversal
+
+# Bucket keys are strings in these formats on every dialect, so routers can
+# build the same keys in Python with datetime.strftime
+BUCKET_FORMATS = {
+    "hour": "%Y-%m-%d %H:00",
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m",
+}
+
+_POSTGRES_FORMATS = {
+    "hour": "YYYY-MM-DD HH24:00",
+    "day": "YYYY-MM-DD",
+    "month": "YYYY-MM",
+}
+
+
+class time_bucket(FunctionElement):
+    """Truncate a timestamp to an hour, day or month and render it as a key string.
+
+    time_bucket("day", Sale.created_at) compiles to strftime('%Y-%m-%d', ...) on
+    SQLite and to_char(date_trunc('day', ...), 'YYYY-MM-DD') on PostgreSQL.
+    """
+
+    type = String()
+    name = "time_bucket"
+    inherit_cache = True
+    # The unit is part of the SQL text, so it has to be part of the cache key too
+    _traverse_internals = FunctionElement._traverse_internals + [("unit", InternalTraversal.dp_string)]
+
+    def __init__(self, unit: str, column):
+        if unit not in BUCKET_FORMATS:
+            raise ValueError(f"Unsupported time bucket: {unit}")
+        self.unit = unit
+        super().__init__(column)
+
+
+@compiles(time_bucket)
+def _time_bucket_default(element, compiler, **kw):
+    # SQLite, and the fallback for dialects without a dedicated form
+    return "strftime('%s', %s)" % (
+        BUCKET_FORMATS[element.unit],
+        compiler.process(element.clauses, **kw),
+    )
+
+
+@compiles(time_bucket, "postgresql")
+def _time_bucket_postgresql(element, compiler, **kw):
+    return "to_char(date_trunc('%s', %s), '%s')" % (
+        element.unit,
+        compiler.process(element.clauses, **kw),
+        _POSTGRES_FORMATS[element.unit],
+    )
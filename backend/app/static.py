@@ -0,0 +1,161 @@
+"""Static file serving for /uploads.
+
+Uploaded files and their image variants are never rewritten in place: new
+content always gets a new name (a content hash, or a UUID for older uploads).
+That lets ImmutableStaticFiles tell clients to cache them forever, derive a
+strong ETag from the name alone and answer revalidations with 304 without
+looking at the disk.
+"""
+
+import mimetypes
+import os
+import re
+import stat
+from typing import Optional, Set, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Precompressed copies next to a file (<name>.br, <name>.gz), in order of preference
+SIDECARS = (("br", ".br"), ("gzip", ".gz"))
+SIDECAR_SUFFIXES = tuple(suffix for _, suffix in SIDECARS)
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def etag_for(name: str, encoding: Optional[str] = None) -> str:
+    """Strong ETag from a file name; the name changes whenever the content does.
+    Each content encoding is a different representation, so it gets its own tag."""
+    stem = os.path.splitext(name)[0]
+    return f'"{stem}-{encoding}"' if encoding else f'"{stem}"'
+
+
+def _matching_etag(if_none_match: str, name: str) -> Optional[str]:
+    """The ETag of `name` that the client already has, if any"""
+    etags = [etag_for(name), *(etag_for(name, encoding) for encoding, _ in SIDECARS)]
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip().removeprefix("W/")
+        if candidate == "*":
+            return etags[0]
+        if candidate in etags:
+            return candidate
+    return None
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single `bytes=` range into inclusive (start, end).
+
+    Returns None when the header should be ignored (multiple or malformed
+    ranges; the whole file is sent) and raises 416 when it cannot be satisfied.
+    """
+    match = _RANGE_RE.match(header.strip())
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    else:
+        # Suffix range: the last N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start >= size or size == 0:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def accepted_encodings(header: str) -> Set[str]:
+    """The sidecar encodings an Accept-Encoding header allows, i.e. with q > 0.
+
+    A "*" entry covers the encodings not listed; "gzip;q=0" refuses gzip.
+    """
+    qualities = {}
+    for part in header.split(","):
+        coding, *params = (item.strip() for item in part.split(";"))
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    default = qualities.get("*", 0.0)
+    return {encoding for encoding, _ in SIDECARS if qualities.get(encoding, default) > 0}
+
+
+def _read_range(path: str, start: int, end: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start + 1)
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """StaticFiles for write-once files: immutable caching, name-based ETags,
+    byte ranges and precompressed .br / .gz sidecars"""
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+        name = os.path.basename(path)
+        # In-progress uploads and other dotfiles are not served
+        if not name or name.startswith("."):
+            raise HTTPException(status_code=404)
+
+        request_headers = Headers(scope=scope)
+        cache_headers = {"Cache-Control": CACHE_CONTROL, "ETag": etag_for(name)}
+        cached_etag = _matching_etag(request_headers.get("if-none-match", ""), name)
+        if cached_etag:
+            # Answered from the name alone, without touching the disk
+            return Response(status_code=304, headers={
+                "Cache-Control": CACHE_CONTROL, "ETag": cached_etag, "Vary": "Accept-Encoding",
+            })
+
+        full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path)
+        if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+            raise HTTPException(status_code=404)
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+        range_header = request_headers.get("range")
+        if range_header:
+            byte_range = parse_range(range_header, stat_result.st_size)
+            if byte_range is not None:
+                start, end = byte_range
+                headers = {
+                    **cache_headers,
+                    "Accept-Ranges": "bytes",
+                    "Content-Range": f"bytes {start}-{end}/{stat_result.st_size}",
+                    # Ranges are always of the identity encoding, but a cache must not
+                    # serve this to a client that negotiated a sidecar
+                    "Vary": "Accept-Encoding",
+                }
+                body = b"" if scope["method"] == "HEAD" else \
+                    await anyio.to_thread.run_sync(_read_range, full_path, start, end)
+                response = Response(body, status_code=206, headers=headers, media_type=media_type)
+                response.headers["Content-Length"] = str(end - start + 1)
+                return response
+
+        headers = {**cache_headers, "Accept-Ranges": "bytes", "Vary": "Accept-Encoding"}
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+        for encoding, suffix in SIDECARS:
+            if encoding not in accepted:
+                continue
+            sidecar_path, sidecar_stat = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+            if sidecar_stat is not None and stat.S_ISREG(sidecar_stat.st_mode):
+                headers["Content-Encoding"] = encoding
+                headers["ETag"] = etag_for(name, encoding)
+                return FileResponse(sidecar_path, stat_result=sidecar_stat, headers=headers,
+                                    media_type=media_type, method=scope["method"])
+
+        return FileResponse(full_path, stat_result=stat_result, headers=headers,
+                            media_type=media_type, method=scope["method"])
@@ -0,0 +1,199 @@
+"""Stock levels at a point in time, from checkpoints rather than the whole ledger.
+
+write_checkpoints() (run daily by the scheduler) stores a StockCheckpoint for
+every product whose stock may have changed since its last one, together with
+the id of the last movement it includes: movement timestamps only have second
+resolution, ids tell exactly which side of the checkpoint a movement is on. A
+product's stock at time T is then the new_stock of its last movement up to T
+that the latest checkpoint before T does not include, or the checkpoint itself
+when there is none, so answering reads at most one checkpoint interval of
+movements per product. Products with no checkpoint before T take their last
+movement before T, or the stock before their first later movement (or their
+current stock), each found with one seek on the (product_id, created_at)
+index. Archived movements are only read when T is older than the newest of
+them.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, func, insert, literal, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from .archive import archived_movements, newest_archived
+from .models import Product, StockCheckpoint, StockMovement
+from .writer import run_write_sync
+
+# Product ids per IN list
+LOOKUP_BATCH = 500
+
+_hot = StockMovement.__table__
+
+
+def _latest_checkpoints(when: Optional[datetime] = None):
+    """Each product's latest checkpoint row at or before `when`"""
+    latest = select(StockCheckpoint.product_id, func.max(StockCheckpoint.as_of).label("as_of"))
+    if when is not None:
+        latest = latest.where(StockCheckpoint.as_of <= when)
+    latest = latest.group_by(StockCheckpoint.product_id).subquery()
+    return (
+        select(StockCheckpoint.product_id, StockCheckpoint.as_of, StockCheckpoint.stock, StockCheckpoint.movement_id)
+        .join(latest, and_(StockCheckpoint.product_id == latest.c.product_id, StockCheckpoint.as_of == latest.c.as_of))
+        .subquery()
+    )
+
+
+def _after_checkpoint(movements, checkpoint):
+    """Movements the checkpoint does not include: those with a higher id, or (checkpoints
+    written before they recorded a movement id) those not older than it"""
+    return or_(
+        movements.c.id > checkpoint.c.movement_id,
+        and_(checkpoint.c.movement_id.is_(None), movements.c.created_at >= checkpoint.c.as_of),
+    )
+
+
+def _write_checkpoints(db: Session) -> int:
+    """Checkpoint products without one or with movements since; runs as a unit of work on the writer"""
+    latest = _latest_checkpoints()
+    last_movement = (
+        select(func.max(StockMovement.id)).where(StockMovement.product_id == Product.id).scalar_subquery()
+    )
+    changed = (
+        select(
+            Product.id,
+            literal(datetime.utcnow(), StockCheckpoint.as_of.type),
+            func.coalesce(Product.stock_quantity, 0),
+            # Archived movements keep the previous checkpoint's boundary
+            func.coalesce(last_movement, latest.c.movement_id, 0),
+        )
+        .outerjoin(latest, latest.c.product_id == Product.id)
+        .where(or_(
+            latest.c.product_id.is_(None),
+            latest.c.movement_id.is_(None),
+            latest.c.stock != func.coalesce(Product.stock_quantity, 0),
+            last_movement > latest.c.movement_id,
+        ))
+    )
+    result = db.execute(
+        insert(StockCheckpoint).from_select(["product_id", "as_of", "stock", "movement_id"], changed)
+    )
+    return result.rowcount
+
+
+def write_checkpoints() -> int:
+    """Checkpoint every product whose stock may have changed; returns how many were written"""
+    return run_write_sync(_write_checkpoints)
+
+
+def _sources(db: Session, when: datetime) -> list:
+    """The movement tables to read: the hot one, plus the archive when `when` predates its newest row"""
+    newest = newest_archived(db.connection())
+    if newest is None or when >= newest:
+        return [_hot]
+    return [_hot, archived_movements]
+
+
+def _movements(tables: list):
+    columns = ("id", "product_id", "previous_stock", "new_stock", "created_at")
+    selects = [select(*(table.c[name] for name in columns)) for table in tables]
+    return (selects[0] if len(selects) == 1 else union_all(*selects)).subquery()
+
+
+def _nearest_movements(db: Session, tables: list, product_ids: List[int], when: datetime,
+                       before: bool) -> Dict[int, object]:
+    """Each product's last movement at or before `when` (or its first one after it), found
+    with one seek on the (product_id, created_at) index per product and table"""
+    found: Dict[int, object] = {}
+    for table in tables:
+        seek = table.alias()
+        if before:
+            bound, order = seek.c.created_at <= when, (seek.c.created_at.desc(), seek.c.id.desc())
+        else:
+            bound, order = seek.c.created_at > when, (seek.c.created_at, seek.c.id)
+        nearest = (
+            select(seek.c.id).where(seek.c.product_id == Product.id, bound)
+            .order_by(*order).limit(1).correlate(Product).scalar_subquery()
+        )
+        for start in range(0, len(product_ids), LOOKUP_BATCH):
+            batch = product_ids[start:start + LOOKUP_BATCH]
+            rows = db.execute(
+                select(table.c.id, table.c.product_id, table.c.previous_stock, table.c.new_stock, table.c.created_at)
+                .where(table.c.id.in_(select(nearest).where(Product.id.in_(batch))))
+            )
+            for row in rows:
+                current = found.get(row.product_id)
+                if current is None or ((row.created_at, row.id) > (current.created_at, current.id)) == before:
+                    found[row.product_id] = row
+    return found
+
+
+def _first_per_product(db: Session, query, source, newest_first: bool) -> Dict[int, object]:
+    order = (source.c.created_at.desc(), source.c.id.desc()) if newest_first else (source.c.created_at, source.c.id)
+    ranked = query.add_columns(
+        func.row_number().over(partition_by=source.c.product_id, order_by=order).label("position")
+    ).subquery()
+    rows = db.execute(select(ranked).where(ranked.c.position == 1))
+    return {row.product_id: row for row in rows}
+
+
+def stock_as_of(db: Session, when: datetime, category_id: Optional[int] = None) -> dict:
+    """Every product's stock level at `when`, valued at its current cost"""
+    products_query = select(
+        Product.id, Product.sku, Product.name, Product.category_id, Product.stock_quantity, Product.cost
+    ).where(or_(Product.created_at.is_(None), Product.created_at <= when)).order_by(Product.id)
+    if category_id is not None:
+        products_query = products_query.where(Product.category_id == category_id)
+    products = db.execute(products_query).all()
+
+    latest = _latest_checkpoints(when)
+    checkpoints = dict(db.execute(select(latest.c.product_id, latest.c.stock)).all())
+
+    # Last movement after each product's checkpoint, up to `when`
+    tables = _sources(db, when)
+    source = _movements(tables)
+    since = (
+        select(source.c.id, source.c.product_id, source.c.new_stock, source.c.created_at)
+        .join(latest, latest.c.product_id == source.c.product_id)
+        .where(source.c.created_at <= when, _after_checkpoint(source, latest))
+    )
+    if category_id is not None:
+        since = since.where(source.c.product_id.in_(select(Product.id).where(Product.category_id == category_id)))
+    last_movements = _first_per_product(db, since, source, newest_first=True)
+
+    # No checkpoint before `when`: the last movement before it, else the stock before the first one after it
+    unchecked = [row.id for row in products if row.id not in checkpoints]
+    last_movements.update(_nearest_movements(db, tables, unchecked, when, before=True))
+    unknown = [product_id for product_id in unchecked if product_id not in last_movements]
+    next_movements = _nearest_movements(db, tables, unknown, when, before=False)
+
+    lines: List[dict] = []
+    sources = {"movement": 0, "checkpoint": 0, "next_movement": 0, "current": 0}
+    for row in products:
+        if row.id in last_movements:
+            stock, found = last_movements[row.id].new_stock, "movement"
+        elif row.id in checkpoints:
+            stock, found = checkpoints[row.id], "checkpoint"
+        elif row.id in next_movements:
+            stock, found = next_movements[row.id].previous_stock, "next_movement"
+        else:
+            stock, found = row.stock_quantity or 0, "current"
+        sources[found] += 1
+        cost = row.cost or 0
+        lines.append({
+            "product_id": row.id,
+            "sku": row.sku,
+            "name": row.name,
+            "category_id": row.category_id,
+            "stock": stock,
+            "cost": cost,
+            "value": round(stock * cost, 2),
+            "source": found,
+        })
+
+    return {
+        "as_of": when.isoformat(),
+        "products": len(lines),
+        "total_units": sum(line["stock"] for line in lines),
+        "total_value": round(sum(line["value"] for line in lines), 2),
+        "sources": sources,
+        "items": lines,
+    }
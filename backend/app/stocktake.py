@@ -0,0 +1,249 @@
+"""Bulk stock updates: stocktakes and batches of adjustments.
+
+Quantities arrive as a list of items or as scanner output (a CSV of codes,
+optionally with a quantity per line) and are summed per product first, so a
+product scanned in several places is counted once. In "count" mode the total
+is the new stock level; in "delta" mode it is added to the current one. The
+products are looked up with a few IN queries, and the stock levels and their
+StockMovement rows are written with bulk statements in a single unit of work.
+The result is a variance summary of what changed.
+"""
+
+import csv
+import io
+from collections import defaultdict
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .database import ReadSessionLocal
+from .models import Product, StockMovement
+from .schemas import BulkStockItem
+from .writer import run_write
+
+STOCK_MODES = ("count", "delta")
+# Identifiers per IN list; keeps each lookup under SQLite's variable limit
+LOOKUP_BATCH = 500
+
+# Largest scanner CSV accepted (the request body, checked in main.py)
+MAX_CSV_SIZE = 5 * 1024 * 1024
+
+CODE_COLUMNS = ("code", "barcode", "sku", "product_id")
+QUANTITY_COLUMNS = ("quantity", "qty", "count")
+
+# (kind, value): kind is product_id, sku, barcode or code (a barcode or SKU)
+Key = Tuple[str, str]
+
+
+def quantities_from_items(items: Iterable[BulkStockItem], mode: str) -> Dict[Key, int]:
+    """Sum the items' quantities per identifier.
+
+    Raises ValueError for an item without one and, in count mode, for a
+    negative count (it would otherwise cancel out another count of the product).
+    """
+    totals: Dict[Key, int] = defaultdict(int)
+    for index, item in enumerate(items):
+        sku = (item.sku or "").strip()
+        barcode = (item.barcode or "").strip()
+        if item.product_id is not None:
+            key = ("product_id", str(item.product_id))
+        elif sku:
+            key = ("sku", sku)
+        elif barcode:
+            key = ("barcode", barcode)
+        else:
+            raise ValueError(f"Item {index} needs a product_id, sku or barcode")
+        if mode == "count" and item.quantity < 0:
+            raise ValueError(f"Item {index}: counted quantity {item.quantity} is negative")
+        totals[key] += item.quantity
+    return dict(totals)
+
+
+def quantities_from_csv(file: BinaryIO, mode: str) -> Dict[Key, int]:
+    """Sum scanner output per code.
+
+    Lines are `code` (one unit per scan) or `code,quantity`. An optional header
+    row names the columns: code, barcode, sku or product_id, and quantity.
+    Raises ValueError for a quantity that is not a whole number, or that is
+    negative in count mode.
+    """
+    reader = csv.reader(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""))
+    totals: Dict[Key, int] = defaultdict(int)
+    kind, code_column, quantity_column = "code", 0, 1
+    for row_number, row in enumerate(reader, start=1):
+        cells = [cell.strip() for cell in row]
+        if row_number == 1:
+            names = [cell.lower().replace(" ", "_") for cell in cells]
+            code_names = [name for name in names if name in CODE_COLUMNS]
+            if code_names:
+                kind, code_column = code_names[0], names.index(code_names[0])
+                quantity_names = [name for name in names if name in QUANTITY_COLUMNS]
+                quantity_column = names.index(quantity_names[0]) if quantity_names else None
+                continue
+        code = cells[code_column] if code_column < len(cells) else ""
+        if not code:
+            continue
+        quantity = cells[quantity_column] if quantity_column is not None and quantity_column < len(cells) else ""
+        try:
+            count = int(quantity) if quantity else 1
+        except ValueError:
+            raise ValueError(f"Line {row_number}: quantity '{quantity}' is not a whole number")
+        if mode == "count" and count < 0:
+            raise ValueError(f"Line {row_number}: counted quantity {count} is negative")
+        totals[(kind, code)] += count
+    return dict(totals)
+
+
+def _batches(values: List[str]) -> Iterable[List[str]]:
+    for start in range(0, len(values), LOOKUP_BATCH):
+        yield values[start:start + LOOKUP_BATCH]
+
+
+def _find_products(db: Session, keys: Iterable[Key], lock: bool) -> Dict[Key, object]:
+    """Product rows (id, sku, name, stock, cost) for each identifier that matches one"""
+    wanted = defaultdict(set)
+    for kind, value in keys:
+        if kind == "code":
+            wanted["barcode"].add(value)
+            wanted["sku"].add(value)
+        elif kind == "product_id":
+            if value.isdigit():
+                wanted["id"].add(int(value))
+        else:
+            wanted[kind].add(value)
+
+    rows = {}
+    for column_name, values in wanted.items():
+        column = getattr(Product, column_name)
+        for batch in _batches(sorted(values)):
+            query = select(
+                Product.id, Product.sku, Product.barcode, Product.name, Product.stock_quantity, Product.cost
+            ).where(column.in_(batch))
+            if lock:
+                query = query.with_for_update()
+            for row in db.execute(query):
+                rows[row.id] = row
+
+    by_id = {str(row.id): row for row in rows.values()}
+    by_sku = {row.sku: row for row in rows.values()}
+    by_barcode = {row.barcode: row for row in rows.values() if row.barcode}
+    found = {}
+    for kind, value in keys:
+        if kind == "product_id":
+            row = by_id.get(value)
+        elif kind == "sku":
+            row = by_sku.get(value)
+        elif kind == "barcode":
+            row = by_barcode.get(value)
+        else:
+            row = by_barcode.get(value) or by_sku.get(value)
+        if row is not None:
+            found[(kind, value)] = row
+    return found
+
+
+def apply_quantities(db: Session, quantities: Dict[Key, int], mode: str, notes: Optional[str] = None,
+                     write: bool = True) -> dict:
+    """Work out each product's new stock level and, when write is set, store it.
+
+    Runs as a unit of work on the writer; with write=False it only reports
+    what would change.
+    """
+    products = _find_products(db, quantities, lock=write)
+    unknown = [{"kind": kind, "code": value, "quantity": quantity}
+               for (kind, value), quantity in quantities.items() if (kind, value) not in products]
+
+    totals: Dict[int, int] = defaultdict(int)
+    rows = {}
+    for key, quantity in quantities.items():
+        row = products.get(key)
+        if row is not None:
+            totals[row.id] += quantity
+            rows[row.id] = row
+
+    notes = notes or ("Stocktake" if mode == "count" else "Bulk stock update")
+    adjustments, errors, updates, movements = [], [], [], []
+    summary = {"units_over": 0, "units_short": 0, "value_over": 0.0, "value_short": 0.0}
+    for product_id, quantity in totals.items():
+        row = rows[product_id]
+        previous = row.stock_quantity or 0
+        new_stock = quantity if mode == "count" else previous + quantity
+        if new_stock < 0:
+            message = f"Counted quantity {quantity} is negative" if mode == "count" else \
+                f"Insufficient stock ({previous} in stock, change {quantity:+d})"
+            errors.append({"product_id": product_id, "sku": row.sku, "error": message})
+            continue
+        variance = new_stock - previous
+        if variance == 0:
+            continue
+        value = round(variance * (row.cost or 0), 2)
+        if variance > 0:
+            summary["units_over"] += variance
+            summary["value_over"] += value
+        else:
+            summary["units_short"] -= variance
+            summary["value_short"] -= value
+        adjustments.append({
+            "product_id": product_id,
+            "sku": row.sku,
+            "name": row.name,
+            "previous_stock": previous,
+            "new_stock": new_stock,
+            "variance": variance,
+            "variance_value": value,
+        })
+        updates.append({"id": product_id, "stock_quantity": new_stock})
+        if mode == "count":
+            movement_type, movement_quantity = "adjustment", new_stock
+        else:
+            movement_type, movement_quantity = ("in" if variance > 0 else "out"), abs(variance)
+        movements.append({
+            "product_id": product_id,
+            "movement_type": movement_type,
+            "quantity": movement_quantity,
+            "previous_stock": previous,
+            "new_stock": new_stock,
+            "notes": notes,
+        })
+
+    if write and updates:
+        db.execute(update(Product), updates)
+        db.execute(insert(StockMovement), movements)
+
+    return {
+        "mode": mode,
+        "dry_run": not write,
+        "lines": len(quantities),
+        "products": len(totals),
+        "unchanged": len(totals) - len(adjustments) - len(errors),
+        "adjusted": len(adjustments),
+        "units_over": summary["units_over"],
+        "units_short": summary["units_short"],
+        "net_units": summary["units_over"] - summary["units_short"],
+        "value_over": round(summary["value_over"], 2),
+        "value_short": round(summary["value_short"], 2),
+        "net_value": round(summary["value_over"] - summary["value_short"], 2),
+        "adjustments": sorted(adjustments, key=lambda line: abs(line["variance_value"]), reverse=True),
+        "unknown": unknown,
+        "errors": errors,
+    }
+
+
+def _preview(quantities: Dict[Key, int], mode: str, notes: Optional[str]) -> dict:
+    db = ReadSessionLocal()
+    try:
+        return apply_quantities(db, quantities, mode, notes, write=False)
+    finally:
+        db.close()
+
+
+async def update_stock_levels(quantities: Dict[Key, int], mode: str, notes: Optional[str] = None,
+                              dry_run: bool = False) -> dict:
+    """Apply the quantities in one transaction (or preview them) and return the variance summary"""
+    if mode not in STOCK_MODES:
+        raise ValueError(f"mode must be one of {', '.join(STOCK_MODES)}")
+    if dry_run:
+        return await run_in_threadpool(_preview, quantities, mode, notes)
+    return await run_write(lambda db: apply_quantities(db, quantities, mode, notes))
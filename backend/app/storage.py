@@ -0,0 +1,136 @@
+"""Content-addressed storage for uploaded images.
+
+Uploads are named after the SHA-256 of their content, so the same photo
+uploaded for many products is stored once. A file stays alive while any
+product references it through image_url or a product_images row;
+collect_garbage() removes files nobody references once they are older than a
+grace period, which covers images uploaded ahead of creating their product.
+"""
+
+import os
+import re
+import time
+from typing import Optional, Set
+
+from sqlalchemy import select, union, update
+from sqlalchemy.orm import Session
+
+from .images import (
+    TEMP_PREFIX, UPLOAD_DIR, UPLOAD_URL_PREFIX, forget_variant, is_variant, record_variant, superseded_at,
+)
+from .models import Product, ProductImage
+from .static import SIDECAR_SUFFIXES
+
+# Unreferenced uploads younger than this are kept (e.g. a product form still open)
+GC_GRACE_HOURS = float(os.getenv("IMS_UPLOAD_GC_GRACE_HOURS", "24"))
+
+
+def content_filename(digest: str, original_filename: str) -> str:
+    """Storage name for an upload: content hash plus the original extension"""
+    return f"{digest}{os.path.splitext(original_filename)[1].lower()}"
+
+
+def filename_from_url(image_url: Optional[str]) -> Optional[str]:
+    if not image_url or not image_url.startswith(UPLOAD_URL_PREFIX):
+        return None
+    return os.path.basename(image_url[len(UPLOAD_URL_PREFIX):])
+
+
+def referenced_filenames(db: Session) -> Set[str]:
+    """Uploads referenced by any product, active or not"""
+    urls = union(
+        select(Product.image_url).where(Product.image_url.isnot(None)),
+        select(ProductImage.url),
+    )
+    referenced = set()
+    for (url,) in db.execute(urls):
+        filename = filename_from_url(url)
+        if filename:
+            referenced.add(filename)
+    return referenced
+
+
+def set_primary_image(db: Session, product_id: int, image_url: Optional[str]):
+    """Flag the product_images row matching the product's new main image"""
+    db.execute(
+        update(ProductImage)
+        .where(ProductImage.product_id == product_id)
+        .values(is_primary=ProductImage.url == image_url if image_url else False)
+    )
+
+
+def _stem(name: str) -> str:
+    # Hash / UUID part shared by an upload and everything derived from it
+    return re.split(r"[._]", name, maxsplit=1)[0]
+
+
+def is_derived(name: str) -> bool:
+    """Variants and precompressed sidecars, which live and die with their original"""
+    return is_variant(name) or name.endswith(SIDECAR_SUFFIXES)
+
+
+def collect_garbage(db: Session, grace_hours: float = GC_GRACE_HOURS, dry_run: bool = False) -> dict:
+    """Delete unreferenced uploads older than the grace period.
+
+    Also removes derived files whose original is gone, variants replaced by a
+    regenerated file for longer than the grace period and temp files left
+    behind by interrupted uploads. Returns counts and the bytes reclaimed.
+    """
+    cutoff = time.time() - grace_hours * 3600
+    referenced = referenced_filenames(db)
+    entries = {entry.name: entry for entry in os.scandir(UPLOAD_DIR) if entry.is_file()}
+
+    report = {
+        "scanned": 0,
+        "referenced": 0,
+        "kept_recent": 0,
+        "deleted_files": 0,
+        "reclaimed_bytes": 0,
+        "dry_run": dry_run,
+    }
+
+    def remove(name: str):
+        report["deleted_files"] += 1
+        report["reclaimed_bytes"] += entries[name].stat().st_size
+        if not dry_run:
+            try:
+                os.remove(os.path.join(UPLOAD_DIR, name))
+            except FileNotFoundError:
+                pass
+            forget_variant(name)
+
+    kept_stems = set()
+    for name, entry in entries.items():
+        if name.startswith(TEMP_PREFIX):
+            if entry.stat().st_mtime < cutoff:
+                remove(name)
+            continue
+        if name.startswith(".") or is_derived(name):
+            continue
+        report["scanned"] += 1
+        if name in referenced:
+            report["referenced"] += 1
+        elif entry.stat().st_mtime >= cutoff:
+            report["kept_recent"] += 1
+        else:
+            remove(name)
+            continue
+        kept_stems.add(_stem(name))
+
+    # Derived files go with their original, or once it was deleted some other way
+    derived = [name for name in entries if is_derived(name) and not name.startswith(".")]
+    for name in derived:
+        if _stem(name) not in kept_stems:
+            remove(name)
+        elif is_variant(name):
+            # e.g. written by generate_image_variants.py while the app was running
+            record_variant(name, entries[name].stat().st_mtime)
+
+    # Variants (and their sidecars) replaced by a regenerated file, once clients had time to move on
+    for name in derived:
+        variant = next((name[:-len(suffix)] for suffix in SIDECAR_SUFFIXES if name.endswith(suffix)), name)
+        replaced = superseded_at(variant)
+        if _stem(name) in kept_stems and replaced is not None and replaced < cutoff:
+            remove(name)
+
+    return report
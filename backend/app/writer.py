@@ -0,0 +1,160 @@
+"""Single-writer queue for database writes.
+
+SQLite allows one writer at a time; handlers that each open their own write
+transaction on the thread pool end up fighting over the lock. Instead, routers
+submit a *unit of work* — a callable taking a Session — and await its result.
+A dedicated thread runs units one after another on its own connection.
+
+Units that are waiting together are group-committed: each runs inside a
+SAVEPOINT, so a unit that raises only rolls back its own changes, and the whole
+batch is made durable with a single COMMIT (one fsync).
+
+A unit must do all of its reads and writes through the session it is given and
+return plain data (e.g. a Pydantic model), never ORM objects. It runs in a copy
+of the submitter's contextvars, as run_in_threadpool does.
+
+Set IMS_WRITE_QUEUE=0 to run units directly on the thread pool instead.
+"""
+
+import asyncio
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from contextvars import Context, copy_context
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .database import SessionLocal, WriterSessionLocal
+
+WRITE_QUEUE_ENABLED = os.getenv("IMS_WRITE_QUEUE", "1") != "0"
+# Upper bound on units sharing one commit
+MAX_BATCH = int(os.getenv("IMS_WRITE_BATCH", "64"))
+
+WriteUnit = Callable[[Session], Any]
+
+
+class WriteQueue:
+    def __init__(self, session_factory=WriterSessionLocal, max_batch: int = MAX_BATCH):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.units = 0
+        self.commits = 0
+        self._queue: "queue.Queue[Optional[Tuple[WriteUnit, Future, Context]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def _spawn(self):
+        # Caller holds self._lock
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="ims-writer", daemon=True)
+            self._thread.start()
+
+    def start(self):
+        with self._lock:
+            self._stopped = False
+            self._spawn()
+
+    def stop(self):
+        """Finish the queued units, then stop the writer thread until start()"""
+        with self._lock:
+            self._stopped = True
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def submit(self, unit: WriteUnit) -> Future:
+        """Queue a unit, starting the writer on first use. While stopped (e.g.
+        during a database swap) units wait in the queue for the next start()."""
+        future: Future = Future()
+        with self._lock:
+            if not self._stopped:
+                self._spawn()
+            self._queue.put((unit, future, copy_context()))
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._execute(batch)
+            if stopping:
+                return
+
+    def _execute(self, batch: List[Tuple[WriteUnit, Future, Context]]):
+        db = self.session_factory()
+        completed: List[Tuple[Future, Any]] = []
+        try:
+            for unit, future, context in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                savepoint = db.begin_nested()
+                try:
+                    result = context.run(unit, db)
+                    savepoint.commit()
+                except BaseException as exc:
+                    savepoint.rollback()
+                    future.set_exception(exc)
+                else:
+                    completed.append((future, result))
+            db.commit()
+        except BaseException as exc:
+            db.rollback()
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        finally:
+            db.close()
+
+        self.units += len(completed)
+        self.commits += 1
+        for future, result in completed:
+            future.set_result(result)
+
+
+write_queue = WriteQueue()
+
+
+def _run_inline(unit: WriteUnit) -> Any:
+    db = SessionLocal()
+    try:
+        result = unit(db)
+        db.commit()
+        return result
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def run_write(unit: WriteUnit) -> Any:
+    """Run a unit of work on the writer and return its result once committed"""
+    if not WRITE_QUEUE_ENABLED:
+        return await run_in_threadpool(_run_inline, unit)
+    return await asyncio.wrap_future(write_queue.submit(unit))
+
+
+def run_write_sync(unit: WriteUnit) -> Any:
+    """run_write for callers already on a worker thread, such as scheduled tasks"""
+    if not WRITE_QUEUE_ENABLED:
+        return _run_inline(unit)
+    return write_queue.submit(unit).result()
@@ -0,0 +1,355 @@
+"""
+Shared setup for the endpoint benchmark suite.
+
+The suite runs the FastAPI app in-process with TestClient against a generated
+dataset, records p50/p95 latency and SQL queries per request for every case,
+writes the results as JSON and compares them with a stored baseline.
+Queries per request do not depend on the machine, so their baseline is
+committed (benchmarks/queries.json) and checked whenever the run uses the
+dataset it was recorded with (the defaults). Latencies do, so their baseline
+is kept locally (git ignores it): record one with IMS_BENCH_UPDATE_BASELINE=1
+before comparing runs. A case with neither baseline to compare is skipped.
+
+Configuration (environment variables):
+    IMS_BENCH_PRODUCTS          products in the generated dataset (default 10000);
+                                other tables scale from it
+    IMS_BENCH_SEED              dataset seed (default 42)
+    IMS_BENCH_ITERATIONS        timed requests per case (default 20)
+    IMS_BENCH_BASELINE          local latency baseline (default benchmarks/baseline.json)
+    IMS_BENCH_QUERY_BASELINE    committed query baseline (default benchmarks/queries.json)
+    IMS_BENCH_RESULTS           results file (default benchmarks/results/latest.json)
+    IMS_BENCH_UPDATE_BASELINE   set to 1 to store this run as the new baseline (both
+                                files); a case missing from the query baseline fails
+    IMS_BENCH_TOLERANCE         allowed p95 latency growth, as a fraction (default 0.5)
+    IMS_BENCH_QUERY_TOLERANCE   allowed queries-per-request growth (default 0.0)
+    IMS_BENCH_SLACK_MS          absolute latency slack for very fast cases (default 2)
+    IMS_BENCH_DIALECT           sqlite (default) or postgresql
+    IMS_BENCH_DATABASE_URL      PostgreSQL server to use instead of starting a throwaway
+                                one with the local initdb/pg_ctl; its tables are dropped
+Per-case tolerances can be set in the baseline files with a "tolerance" key
+(latency) or a "query_tolerance" key (queries). Each dialect keeps its own
+baselines and results file.
+"""
+
+import glob
+import importlib.util
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+import pytest
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+BENCH_PRODUCTS = int(os.getenv("IMS_BENCH_PRODUCTS", "10000"))
+BENCH_SEED = int(os.getenv("IMS_BENCH_SEED", "42"))
+BENCH_ITERATIONS = int(os.getenv("IMS_BENCH_ITERATIONS", "20"))
+BENCH_DIALECT = os.getenv("IMS_BENCH_DIALECT", "sqlite")
+BENCH_DATABASE_URL = os.getenv("IMS_BENCH_DATABASE_URL")
+_SUFFIX = "" if BENCH_DIALECT == "sqlite" else f"_{BENCH_DIALECT}"
+BASELINE_PATH = os.getenv("IMS_BENCH_BASELINE", os.path.join(BENCH_DIR, f"baseline{_SUFFIX}.json"))
+QUERY_BASELINE_PATH = os.getenv("IMS_BENCH_QUERY_BASELINE", os.path.join(BENCH_DIR, f"queries{_SUFFIX}.json"))
+RESULTS_PATH = os.getenv("IMS_BENCH_RESULTS", os.path.join(BENCH_DIR, "results", f"latest{_SUFFIX}.json"))
+UPDATE_BASELINE = os.getenv("IMS_BENCH_UPDATE_BASELINE") == "1"
+LATENCY_TOLERANCE = float(os.getenv("IMS_BENCH_TOLERANCE", "0.5"))
+QUERY_TOLERANCE = float(os.getenv("IMS_BENCH_QUERY_TOLERANCE", "0.0"))
+SLACK_MS = float(os.getenv("IMS_BENCH_SLACK_MS", "2"))
+
+# The app resolves its database path at import time, so the data dir has to be
+# in place before anything under app/ is imported.
+DATA_DIR = tempfile.mkdtemp(prefix="ims-bench-")
+os.environ["IMS_DATA_DIR"] = DATA_DIR
+# Scheduled backups and ANALYZE would land in the middle of measurements
+os.environ.setdefault("IMS_SCHEDULER", "0")
+
+
+def dataset_sizes(products: int) -> dict:
+    """Table volumes for a benchmark run, scaled from the product count"""
+    return {
+        "products": products,
+        "sales_items": products * 10,
+        "stock_movements": products * 2,
+        "returns": max(products // 10, 1),
+    }
+
+
+def _prepare_dataset() -> str:
+    """Generate (or reuse a cached copy of) the benchmark dataset as the app's database"""
+    # History ends today so the dashboard's "today" and "this month" widgets see data
+    end_date = date.today().isoformat()
+    sizes = dataset_sizes(BENCH_PRODUCTS)
+    if BENCH_DIALECT != "sqlite":
+        return _prepare_server_dataset(end_date, sizes)
+
+    from generate_benchmark_data import generate_dataset
+
+    cache_dir = os.path.join(BENCH_DIR, ".data")
+    os.makedirs(cache_dir, exist_ok=True)
+    cached = os.path.join(cache_dir, f"bench_{BENCH_SEED}_{BENCH_PRODUCTS}_{end_date}.db")
+    if not os.path.exists(cached):
+        tmp_path = cached + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        generate_dataset(f"sqlite:///{tmp_path}", seed=BENCH_SEED, end_date=end_date,
+                         progress=lambda message: None, **sizes)
+        os.replace(tmp_path, cached)
+
+    db_dir = os.path.join(DATA_DIR, "database")
+    os.makedirs(db_dir, exist_ok=True)
+    db_path = os.path.join(db_dir, "inventory.db")
+    shutil.copyfile(cached, db_path)
+    return f"sqlite:///{db_path}"
+
+
+def _prepare_server_dataset(end_date: str, sizes: dict) -> str:
+    """Load the dataset into a PostgreSQL database (there is no file to cache)"""
+    if BENCH_DIALECT != "postgresql":
+        pytest.exit(f"Unsupported IMS_BENCH_DIALECT: {BENCH_DIALECT}", returncode=4)
+    if importlib.util.find_spec("psycopg2") is None:
+        pytest.skip("psycopg2 is not installed")
+    url = BENCH_DATABASE_URL or LocalPostgres.start_session()
+    # app.database reads this on import, so set it before anything imports the app
+    os.environ["IMS_DATABASE_URL"] = url
+
+    from sqlalchemy import create_engine
+    from app.database import Base
+    from generate_benchmark_data import generate_dataset
+
+    engine = create_engine(url)
+    Base.metadata.drop_all(bind=engine)
+    engine.dispose()
+    generate_dataset(url, seed=BENCH_SEED, end_date=end_date, progress=lambda message: None, **sizes)
+    return url
+
+
+def _postgres_bindir():
+    """Directory with initdb and pg_ctl, or None when PostgreSQL is not installed"""
+    if shutil.which("pg_ctl") and shutil.which("initdb"):
+        return os.path.dirname(shutil.which("pg_ctl"))
+    if shutil.which("pg_config"):
+        bindir = subprocess.run(["pg_config", "--bindir"], capture_output=True, text=True).stdout.strip()
+        if os.path.exists(os.path.join(bindir, "pg_ctl")):
+            return bindir
+    # Debian/Ubuntu keep the server binaries out of PATH
+    candidates = sorted(glob.glob("/usr/lib/postgresql/*/bin/pg_ctl"))
+    return os.path.dirname(candidates[-1]) if candidates else None
+
+
+class LocalPostgres:
+    """Throwaway PostgreSQL cluster under the benchmark data dir"""
+
+    _current = None
+
+    def __init__(self, bindir: str, root: str):
+        self.bindir = bindir
+        self.root = root
+        self.data_dir = os.path.join(root, "pgdata")
+        self.port = None
+
+    @classmethod
+    def start_session(cls) -> str:
+        """Start the cluster used by this test session and return its URL"""
+        bindir = _postgres_bindir()
+        if bindir is None:
+            pytest.skip("PostgreSQL server binaries (initdb, pg_ctl) not found; "
+                        "install them or set IMS_BENCH_DATABASE_URL")
+        if hasattr(os, "geteuid") and os.geteuid() == 0:
+            pytest.skip("initdb refuses to run as root; set IMS_BENCH_DATABASE_URL instead")
+        cls._current = cls(bindir, os.path.join(DATA_DIR, "postgres"))
+        return cls._current.start()
+
+    @classmethod
+    def stop_session(cls):
+        if cls._current is not None:
+            cls._current.stop()
+            cls._current = None
+
+    def _run(self, program: str, *args: str):
+        subprocess.run([os.path.join(self.bindir, program), *args],
+                       check=True, capture_output=True, text=True)
+
+    def start(self) -> str:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self._run("initdb", "-D", self.data_dir, "-U", "postgres", "-A", "trust",
+                  "-E", "UTF8", "--no-sync")
+        # Durability is irrelevant for a throwaway cluster; keep it close to a tuned server otherwise
+        options = f"-p {self.port} -k {self.root} -c listen_addresses=127.0.0.1 -c fsync=off"
+        self._run("pg_ctl", "-D", self.data_dir, "-l", os.path.join(self.root, "server.log"),
+                  "-o", options, "-w", "start")
+        return f"postgresql://postgres@127.0.0.1:{self.port}/postgres"
+
+    def stop(self):
+        self._run("pg_ctl", "-D", self.data_dir, "-m", "fast", "-w", "stop")
+
+
+# Threads that catch up after a request has returned; what they run is not the request's
+BACKGROUND_THREADS = ("ims-product-index", "ims-images")
+
+
+class QueryCounter:
+    """Counts SQL statements sent to the app's engine(s) on behalf of requests"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if not threading.current_thread().name.startswith(BACKGROUND_THREADS):
+            self.count += 1
+
+
+class BenchmarkRecorder:
+    """Times requests, compares them with the baseline and collects results"""
+
+    def __init__(self, client, counter: QueryCounter):
+        self.client = client
+        self.counter = counter
+        self.results = {}
+        self.dataset = {"dialect": BENCH_DIALECT, "seed": BENCH_SEED, **dataset_sizes(BENCH_PRODUCTS)}
+        self.baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH, "r", encoding="utf-8") as f:
+                self.baseline = json.load(f).get("cases", {})
+        # Query counts depend on the data, so they are only compared on the recorded dataset
+        self.query_baseline = None
+        if os.path.exists(QUERY_BASELINE_PATH):
+            with open(QUERY_BASELINE_PATH, "r", encoding="utf-8") as f:
+                recorded = json.load(f)
+            if recorded.get("dataset") == self.dataset:
+                self.query_baseline = recorded.get("cases", {})
+
+    def measure(self, name: str, method: str, path: str, iterations: int = None, **kwargs) -> dict:
+        iterations = iterations or BENCH_ITERATIONS
+        # Warm-up request, also used to check that the endpoint works at all
+        response = self.client.request(method, path, **kwargs)
+        assert response.status_code < 400, f"{name}: {response.status_code} {response.text[:200]}"
+
+        latencies = []
+        queries = []
+        for _ in range(iterations):
+            before = self.counter.count
+            started = time.perf_counter()
+            response = self.client.request(method, path, **kwargs)
+            latencies.append((time.perf_counter() - started) * 1000.0)
+            queries.append(self.counter.count - before)
+            assert response.status_code < 400, f"{name}: {response.status_code}"
+
+        if len(latencies) > 1:
+            cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+            p50, p95 = cuts[49], cuts[94]
+        else:
+            p50 = p95 = latencies[0]
+        result = {
+            "iterations": iterations,
+            "p50_ms": round(p50, 3),
+            "p95_ms": round(p95, 3),
+            "max_ms": round(max(latencies), 3),
+            "queries_per_request": round(statistics.mean(queries), 2),
+        }
+        self.results[name] = result
+        return result
+
+    def check(self, name: str):
+        """Fail when a case regressed beyond the configured tolerances"""
+        if UPDATE_BASELINE:
+            return
+        current = self.results[name]
+        problems = []
+
+        if self.query_baseline is not None:
+            assert name in self.query_baseline, (
+                f"{name}: no entry in {QUERY_BASELINE_PATH}; run with IMS_BENCH_UPDATE_BASELINE=1 "
+                f"and commit the file"
+            )
+            base = self.query_baseline[name]
+            query_limit = base["queries_per_request"] * (1 + base.get("query_tolerance", QUERY_TOLERANCE))
+            if current["queries_per_request"] > query_limit:
+                problems.append(f"{current['queries_per_request']} queries/request > limit {query_limit:.2f} "
+                                f"(baseline {base['queries_per_request']})")
+
+        if name in self.baseline:
+            base = self.baseline[name]
+            latency_limit = base["p95_ms"] * (1 + base.get("tolerance", LATENCY_TOLERANCE)) + SLACK_MS
+            if current["p95_ms"] > latency_limit:
+                problems.append(f"p95 {current['p95_ms']:.1f}ms > limit {latency_limit:.1f}ms "
+                                f"(baseline {base['p95_ms']:.1f}ms)")
+        elif self.query_baseline is None:
+            pytest.skip(f"{name}: nothing to compare with; the query baseline was recorded on another "
+                        f"dataset and there is no local baseline (IMS_BENCH_UPDATE_BASELINE=1 records one)")
+        assert not problems, f"{name} regressed: " + "; ".join(problems)
+
+    def write(self):
+        payload = {
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "dataset": self.dataset,
+            "cases": self.results,
+        }
+        os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+        with open(RESULTS_PATH, "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=2, sort_keys=True)
+        if UPDATE_BASELINE:
+            # Keep hand-tuned per-case tolerances across baseline refreshes
+            recorded_queries = {}
+            if os.path.exists(QUERY_BASELINE_PATH):
+                with open(QUERY_BASELINE_PATH, "r", encoding="utf-8") as f:
+                    recorded_queries = json.load(f).get("cases", {})
+            latencies, queries = {}, {}
+            for name, case in payload["cases"].items():
+                latencies[name] = dict(case)
+                if "tolerance" in self.baseline.get(name, {}):
+                    latencies[name]["tolerance"] = self.baseline[name]["tolerance"]
+                queries[name] = {"queries_per_request": case["queries_per_request"]}
+                if "query_tolerance" in recorded_queries.get(name, {}):
+                    queries[name]["query_tolerance"] = recorded_queries[name]["query_tolerance"]
+            with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+                json.dump({**payload, "cases": latencies}, f, indent=2, sort_keys=True)
+            # The committed query baseline is only replaced from a run on its own dataset
+            if self.query_baseline is not None or not recorded_queries:
+                with open(QUERY_BASELINE_PATH, "w", encoding="utf-8") as f:
+                    json.dump({"dataset": self.dataset, "cases": queries}, f, indent=2, sort_keys=True)
+                    f.write("\n")
+
+
+@pytest.fixture(scope="session")
+def bench_db_url():
+    yield _prepare_dataset()
+    LocalPostgres.stop_session()
+
+
+@pytest.fixture(scope="session")
+def client(bench_db_url):
+    from fastapi.testclient import TestClient
+    from main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def bench(client):
+    from sqlalchemy import event
+    from app import database
+
+    counter = QueryCounter()
+    engines = [database.engine, database.read_engine, database.writer_engine]
+    if database.async_engine is not None:
+        engines.append(database.async_engine.sync_engine)
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", counter)
+    recorder = BenchmarkRecorder(client, counter)
+    yield recorder
+    for engine in engines:
+        event.remove(engine, "before_cursor_execute", counter)
+    recorder.write()
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
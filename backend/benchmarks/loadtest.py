@@ -0,0 +1,384 @@
+"""
+Concurrent load test simulating several POS terminals against one backend.
+
+Starts uvicorn locally on a copy of a generated dataset, then runs N terminals
+(asyncio tasks sharing one httpx client) that replay a weighted scenario mix:
+
+    sale       POST /api/sales/ with 1-4 popular products
+    stock      POST /api/products/{id}/stock (receiving / shrinkage)
+    return     POST /api/returns/ followed by PUT .../status?status=approved
+    dashboard  GET kpis, low-stock-products and recent-sales (a polling cycle)
+    report     POST /api/reports/generate, a sales PDF over all history (a long read)
+
+Reports throughput, latency percentiles, lock-timeout errors and stock
+consistency, i.e. whether every product's stock_quantity still equals its
+StockMovement ledger replayed in order.
+
+Usage (from the backend directory):
+    python benchmarks/loadtest.py --terminals 8 --duration 30 --mix sale=5,stock=2,dashboard=3
+    python benchmarks/loadtest.py --db existing.db --output results/load.json
+    # writes with a back office pulling long reports at the same time
+    python benchmarks/loadtest.py --mix sale=5,stock=2,report=1
+    # same load twice, the second run with the asyncio database engine
+    python benchmarks/loadtest.py --mix dashboard=1 --terminals 64 --compare IMS_ASYNC_DB=1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+DEFAULT_MIX = "sale=5,stock=2,return=1,dashboard=3"
+DASHBOARD_PATHS = [
+    "/api/dashboard/kpis",
+    "/api/dashboard/low-stock-products",
+    "/api/dashboard/recent-sales",
+]
+
+
+def parse_mix(text: str) -> Dict[str, int]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("sale", "stock", "return", "dashboard", "report"):
+            raise ValueError(f"Unknown scenario: {name}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ScenarioStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.ok = 0
+        self.rejected = 0      # expected business rejections (e.g. insufficient stock)
+        self.lock_errors = 0   # "database is locked" surfacing as a failed request
+        self.errors = 0
+
+    def summary(self, duration: float) -> dict:
+        latencies = sorted(self.latencies)
+        if len(latencies) > 1:
+            cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+            p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+        else:
+            p50 = p95 = p99 = latencies[0] if latencies else 0.0
+        return {
+            "requests": len(latencies),
+            "ok": self.ok,
+            "rejected": self.rejected,
+            "lock_errors": self.lock_errors,
+            "errors": self.errors,
+            "throughput_rps": round(len(latencies) / duration, 2) if duration else 0.0,
+            "p50_ms": round(p50, 2),
+            "p95_ms": round(p95, 2),
+            "p99_ms": round(p99, 2),
+        }
+
+
+class LoadTest:
+    def __init__(self, base_url: str, db_path: str, mix: Dict[str, int], seed: int):
+        self.base_url = base_url
+        self.mix = mix
+        self.seed = seed
+        self.stats: Dict[str, ScenarioStats] = defaultdict(ScenarioStats)
+        conn = sqlite3.connect(db_path)
+        try:
+            # A small hot set keeps terminals contending for the same rows, like a real till
+            self.hot_products = conn.execute(
+                "SELECT id, price FROM products WHERE is_active = 1 "
+                "ORDER BY stock_quantity DESC LIMIT 50"
+            ).fetchall()
+        finally:
+            conn.close()
+        if not self.hot_products:
+            raise RuntimeError("Dataset has no active products")
+
+    async def _request(self, client: httpx.AsyncClient, scenario: str, method: str, path: str, **kwargs):
+        stats = self.stats[scenario]
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+        except httpx.HTTPError:
+            stats.latencies.append((time.perf_counter() - started) * 1000.0)
+            stats.errors += 1
+            return None
+        stats.latencies.append((time.perf_counter() - started) * 1000.0)
+        if response.status_code < 400:
+            stats.ok += 1
+        elif "database is locked" in response.text:
+            stats.lock_errors += 1
+        elif response.status_code < 500:
+            stats.rejected += 1
+        else:
+            stats.errors += 1
+        return response
+
+    async def _sale(self, client, rng: random.Random):
+        picks = rng.sample(self.hot_products, rng.randint(1, min(4, len(self.hot_products))))
+        body = {
+            "items": [{"product_id": pid, "quantity": rng.randint(1, 3), "unit_price": price} for pid, price in picks],
+            "payment_method": rng.choice(["cash", "card"]),
+        }
+        await self._request(client, "sale", "POST", "/api/sales/", json=body)
+
+    async def _stock(self, client, rng: random.Random):
+        product_id, _ = rng.choice(self.hot_products)
+        movement_type = "in" if rng.random() < 0.8 else "out"
+        body = {"product_id": product_id, "movement_type": movement_type,
+                "quantity": rng.randint(1, 20), "notes": "load test"}
+        await self._request(client, "stock", "POST", f"/api/products/{product_id}/stock", json=body)
+
+    async def _return(self, client, rng: random.Random):
+        product_id, price = rng.choice(self.hot_products)
+        body = {"items": [{"product_id": product_id, "quantity": 1, "unit_price": price, "condition": "good"}],
+                "reason": "load test"}
+        response = await self._request(client, "return", "POST", "/api/returns/", json=body)
+        if response is not None and response.status_code < 400:
+            return_id = response.json()["id"]
+            await self._request(client, "return", "PUT", f"/api/returns/{return_id}/status",
+                                params={"status": "approved"})
+
+    async def _dashboard(self, client, rng: random.Random):
+        for path in DASHBOARD_PATHS:
+            await self._request(client, "dashboard", "GET", path)
+
+    async def _report(self, client, rng: random.Random):
+        body = {"report_type": "sales", "format": "pdf"}
+        await self._request(client, "report", "POST", "/api/reports/generate", json=body)
+
+    async def _terminal(self, client, index: int, deadline: float):
+        rng = random.Random(self.seed * 1000 + index)
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        handlers = {"sale": self._sale, "stock": self._stock, "return": self._return, "dashboard": self._dashboard,
+                    "report": self._report}
+        while time.perf_counter() < deadline:
+            await handlers[rng.choices(names, weights=weights)[0]](client, rng)
+
+    async def run(self, terminals: int, duration: float) -> float:
+        limits = httpx.Limits(max_connections=terminals, max_keepalive_connections=terminals)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=60.0) as client:
+            started = time.perf_counter()
+            deadline = started + duration
+            await asyncio.gather(*(self._terminal(client, i, deadline) for i in range(terminals)))
+            return time.perf_counter() - started
+
+
+def check_stock_consistency(db_path: str) -> dict:
+    """Replay every product's StockMovement ledger and compare it with stock_quantity.
+
+    Each product's replay starts from its latest stock_checkpoints row, when it
+    has one, so movements moved to the archive are covered by the checkpoint.
+    `mismatches` counts products whose replayed ledger differs from the stored
+    stock; `broken_chains` counts movements whose previous_stock does not match
+    the preceding movement's new_stock (a lost update between two writers).
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        replayed: Dict[int, int] = {}
+        broken_chains = 0
+        last_new: Dict[int, int] = {}
+        # product id -> id of the last movement its checkpoint covers
+        covered: Dict[int, int] = {}
+        has_checkpoints = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stock_checkpoints'"
+        ).fetchone()
+        if has_checkpoints:
+            checkpoints = conn.execute(
+                "SELECT product_id, stock, movement_id FROM stock_checkpoints "
+                "WHERE movement_id IS NOT NULL ORDER BY product_id, movement_id"
+            )
+            for product_id, stock, movement_id in checkpoints:
+                replayed[product_id] = last_new[product_id] = stock
+                covered[product_id] = movement_id
+        rows = conn.execute(
+            "SELECT id, product_id, movement_type, quantity, previous_stock, new_stock "
+            "FROM stock_movements ORDER BY product_id, id"
+        )
+        for movement_id, product_id, movement_type, quantity, previous_stock, new_stock in rows:
+            if movement_id <= covered.get(product_id, 0):
+                continue
+            balance = replayed.get(product_id, 0)
+            if movement_type == "in":
+                balance += quantity
+            elif movement_type == "out":
+                balance -= quantity
+            else:  # adjustment sets an absolute level
+                balance = quantity
+            replayed[product_id] = balance
+            if product_id in last_new and last_new[product_id] != previous_stock:
+                broken_chains += 1
+            last_new[product_id] = new_stock
+
+        mismatches = []
+        negative = 0
+        for product_id, stock_quantity in conn.execute("SELECT id, stock_quantity FROM products"):
+            if (stock_quantity or 0) < 0:
+                negative += 1
+            if replayed.get(product_id, 0) != (stock_quantity or 0):
+                mismatches.append({"product_id": product_id, "stock_quantity": stock_quantity,
+                                   "ledger": replayed.get(product_id, 0)})
+        return {
+            "consistent": not mismatches and not broken_chains and not negative,
+            "mismatches": len(mismatches),
+            "broken_chains": broken_chains,
+            "negative_stock": negative,
+            "examples": mismatches[:10],
+        }
+    finally:
+        conn.close()
+
+
+def _prepare_db(data_dir: str, source: Optional[str], products: int, seed: int) -> str:
+    db_dir = os.path.join(data_dir, "database")
+    os.makedirs(db_dir, exist_ok=True)
+    db_path = os.path.join(db_dir, "inventory.db")
+    if source:
+        shutil.copyfile(source, db_path)
+    else:
+        from generate_benchmark_data import generate_dataset
+        generate_dataset(f"sqlite:///{db_path}", seed=seed, products=products,
+                         sales_items=products * 10, stock_movements=products * 2,
+                         returns=max(products // 10, 1), progress=lambda message: None)
+    return db_path
+
+
+def _start_server(data_dir: str, port: int, extra_env: Dict[str, str]) -> subprocess.Popen:
+    env = dict(os.environ, IMS_DATA_DIR=data_dir, **extra_env)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Backend exited during startup")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1.0).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Backend did not become healthy within 30s")
+
+
+def run_load_test(mix: Dict[str, int], terminals: int, duration: float, seed: int = 42,
+                  products: int = 2000, source_db: Optional[str] = None,
+                  extra_env: Optional[Dict[str, str]] = None) -> dict:
+    data_dir = tempfile.mkdtemp(prefix="ims-load-")
+    try:
+        db_path = _prepare_db(data_dir, source_db, products, seed)
+        port = _free_port()
+        server = _start_server(data_dir, port, extra_env or {})
+        try:
+            load = LoadTest(f"http://127.0.0.1:{port}", db_path, mix, seed)
+            elapsed = asyncio.run(load.run(terminals, duration))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+        scenarios = {name: stats.summary(elapsed) for name, stats in sorted(load.stats.items())}
+        writes = [scenarios[name] for name in ("sale", "stock", "return") if name in scenarios]
+        return {
+            "terminals": terminals,
+            "duration_s": round(elapsed, 2),
+            "mix": mix,
+            "env": extra_env or {},
+            "total_rps": round(sum(s["requests"] for s in scenarios.values()) / elapsed, 2),
+            "write_ok_rps": round(sum(s["ok"] for s in writes) / elapsed, 2),
+            "lock_errors": sum(s["lock_errors"] for s in scenarios.values()),
+            "errors": sum(s["errors"] for s in scenarios.values()),
+            "scenarios": scenarios,
+            "stock_consistency": check_stock_consistency(db_path),
+        }
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def _print_report(result: dict):
+    print(f"\n{result['terminals']} terminals, {result['duration_s']}s, env={result['env'] or '-'}")
+    print(f"{'scenario':<10} {'reqs':>7} {'rps':>8} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} "
+          f"{'ok':>6} {'rej':>5} {'lock':>5} {'err':>5}")
+    for name, s in result["scenarios"].items():
+        print(f"{name:<10} {s['requests']:>7} {s['throughput_rps']:>8} {s['p50_ms']:>8} {s['p95_ms']:>8} "
+              f"{s['p99_ms']:>8} {s['ok']:>6} {s['rejected']:>5} {s['lock_errors']:>5} {s['errors']:>5}")
+    print(f"total {result['total_rps']} req/s, successful writes {result['write_ok_rps']}/s, "
+          f"lock errors {result['lock_errors']}, errors {result['errors']}")
+    consistency = result["stock_consistency"]
+    status = "OK" if consistency["consistent"] else "VIOLATIONS"
+    print(f"stock consistency: {status} (mismatches {consistency['mismatches']}, "
+          f"broken chains {consistency['broken_chains']}, negative {consistency['negative_stock']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent POS load test")
+    parser.add_argument("--terminals", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Scenario weights (default {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--products", type=int, default=2000, help="Size of the generated dataset")
+    parser.add_argument("--db", help="Use a copy of this database instead of generating one")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the backend process (repeatable)")
+    parser.add_argument("--compare", action="append", default=[], metavar="KEY=VALUE",
+                        help="Repeat the run with this extra backend environment and compare (repeatable)")
+    parser.add_argument("--output", help="Write the JSON result to this file")
+    args = parser.parse_args()
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    runs = [extra_env]
+    if args.compare:
+        runs.append(dict(extra_env, **dict(item.split("=", 1) for item in args.compare)))
+
+    results = []
+    for env in runs:
+        result = run_load_test(parse_mix(args.mix), args.terminals, args.duration, seed=args.seed,
+                               products=args.products, source_db=args.db, extra_env=env)
+        _print_report(result)
+        results.append(result)
+
+    if len(results) > 1:
+        base, other = results
+        print(f"\ncompare: {base['total_rps']} -> {other['total_rps']} req/s, "
+              f"successful writes {base['write_ok_rps']} -> {other['write_ok_rps']}/s")
+        for name in base["scenarios"]:
+            if name in other["scenarios"]:
+                before, after = base["scenarios"][name], other["scenarios"][name]
+                print(f"  {name:<10} p95 {before['p95_ms']} -> {after['p95_ms']} ms, "
+                      f"{before['throughput_rps']} -> {after['throughput_rps']} req/s")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results[0] if len(results) == 1 else results, f, indent=2)
+    consistent = all(result["stock_consistency"]["consistent"] for result in results)
+    sys.exit(0 if consistent else 1)
+
+
+if __name__ == "__main__":
+    main()
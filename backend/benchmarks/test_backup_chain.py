@@ -0,0 +1,130 @@
+"""
+Incremental backup chains: a restore must rebuild exactly the database each
+backup was taken from, and a chain with a missing link must not restore at all.
+
+These run against a small database of their own, not the benchmark dataset.
+"""
+
+import os
+import sqlite3
+
+import pytest
+
+pytestmark = pytest.mark.skipif(
+    os.getenv("IMS_BENCH_DIALECT", "sqlite") != "sqlite", reason="file backups are SQLite-only"
+)
+
+ROWS = 5000
+
+
+def _connect(path):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    return conn
+
+
+def _write(path, start, count):
+    """Insert count rows, then update and delete some older ones"""
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT INTO items (id, name, quantity) VALUES (?, ?, ?)",
+                [(i, f"item {i} " + "x" * 100, i % 50) for i in range(start, start + count)],
+            )
+            conn.execute("UPDATE items SET quantity = quantity + 1 WHERE id % 7 = 0")
+            conn.execute("DELETE FROM items WHERE id % 13 = 0 AND id < ?", (start,))
+            conn.execute("INSERT INTO log (note) VALUES (?)", (f"wrote {count} from {start}",))
+    finally:
+        conn.close()
+
+
+def _state(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {
+            "integrity": conn.execute("PRAGMA integrity_check").fetchone()[0],
+            "items": conn.execute("SELECT count(*), coalesce(sum(quantity), 0) FROM items").fetchone(),
+            "log": conn.execute("SELECT count(*) FROM log").fetchone()[0],
+        }
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "inventory.db")
+    conn = _connect(path)
+    conn.executescript("""
+        CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT NOT NULL, quantity INTEGER NOT NULL);
+        CREATE INDEX ix_items_quantity ON items (quantity);
+        CREATE TABLE log (id INTEGER PRIMARY KEY, note TEXT);
+    """)
+    conn.close()
+    _write(path, 1, ROWS)
+    return path
+
+
+@pytest.fixture
+def backups(tmp_path, db_path, monkeypatch):
+    """app.backups pointed at db_path and a backup directory of this test's own"""
+    from app import backups
+
+    backup_dir = str(tmp_path / "backups")
+    monkeypatch.setattr(backups, "BACKUP_DIR", backup_dir)
+    monkeypatch.setattr(backups, "CATALOG_PATH", os.path.join(backup_dir, "catalog.db"))
+    monkeypatch.setattr(backups, "_catalog_ready", False)
+    monkeypatch.setattr(backups, "ARCHIVE_ENABLED", False)
+    monkeypatch.setattr(backups, "database_path", lambda: db_path)
+    return backups
+
+
+def _take(backups, kind, compression):
+    job = backups.run_backup(backups.BackupJob(compression, kind))
+    assert job.status == "completed", job.error
+    assert job.kind == kind
+    return job
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+def test_restore_incremental_chain(backups, db_path, compression):
+    full = _take(backups, "full", compression)
+    full_state = _state(db_path)
+
+    _write(db_path, ROWS + 1, 500)
+    first = _take(backups, "incremental", compression)
+    first_state = _state(db_path)
+    assert first.parent == full.filename
+
+    _write(db_path, ROWS + 501, 2000)
+    second = _take(backups, "incremental", compression)
+    second_state = _state(db_path)
+    assert second.parent == first.filename
+    assert backups.backup_chain(second.filename) == [full.filename, first.filename, second.filename]
+
+    _write(db_path, ROWS + 2501, 100)
+    for job, expected in ((second, second_state), (first, first_state), (full, full_state)):
+        backups.restore_backup(job.filename)
+        state = _state(db_path)
+        assert state["integrity"] == "ok"
+        assert state == expected, job.filename
+
+
+def test_missing_delta_fails_without_restoring(backups, db_path):
+    full = _take(backups, "full", "none")
+    _write(db_path, ROWS + 1, 500)
+    first = _take(backups, "incremental", "none")
+    _write(db_path, ROWS + 501, 500)
+    second = _take(backups, "incremental", "none")
+    _write(db_path, ROWS + 1001, 100)
+    live_state = _state(db_path)
+
+    os.remove(os.path.join(backups.BACKUP_DIR, first.filename))
+    with pytest.raises(ValueError, match="broken"):
+        backups.restore_backup(second.filename)
+
+    assert _state(db_path) == live_state
+    leftovers = [name for name in os.listdir(backups.BACKUP_DIR)
+                 if name.startswith((backups.TEMP_PREFIX, "pre_restore_backup_"))]
+    assert leftovers == []
+    assert os.path.exists(os.path.join(backups.BACKUP_DIR, full.filename))
@@ -0,0 +1,123 @@
+"""
+Endpoint latency / query-count benchmarks for every router.
+
+Run from the backend directory:
+    python -m pytest benchmarks -q
+    IMS_BENCH_UPDATE_BASELINE=1 python -m pytest benchmarks -q   # refresh the baseline
+"""
+
+import pytest
+
+REPORT_TYPES = ["sales", "inventory", "categories", "low_stock"]
+REPORT_FORMATS = ["pdf", "excel", "csv"]
+
+READ_CASES = [
+    # (name, path, iterations or None for the default)
+    ("products.list", "/api/products/", None),
+    ("products.list_large_page", "/api/products/?limit=500", None),
+    ("products.search", "/api/products/?search=Lamp", None),
+    ("products.filter_category", "/api/products/?category_id=3&is_active=true", None),
+    ("products.detail", "/api/products/1", None),
+    ("products.lookup", "/api/products/lookup?code=SKU-00000001", None),
+    ("products.movements", "/api/products/1/movements", None),
+    ("products.low_stock", "/api/products/low-stock/", 5),
+    ("products.stock_as_of", "/api/products/stock-as-of?date=2025-06-30", 5),
+    ("categories.list", "/api/categories/", None),
+    ("categories.detail", "/api/categories/1", None),
+    ("sales.list", "/api/sales/", None),
+    ("sales.detail", "/api/sales/1", None),
+    ("sales.today_summary", "/api/sales/today/summary", None),
+    ("sales.monthly_summary", "/api/sales/monthly/summary", None),
+    ("returns.list", "/api/returns/", None),
+    ("dashboard.kpis", "/api/dashboard/kpis", None),
+    ("dashboard.sales_chart_24h", "/api/dashboard/sales-chart?days=1", None),
+    ("dashboard.sales_chart_7d", "/api/dashboard/sales-chart?days=7", None),
+    ("dashboard.sales_chart_30d", "/api/dashboard/sales-chart?days=30", None),
+    ("dashboard.sales_chart_12m", "/api/dashboard/sales-chart?days=12", None),
+    ("dashboard.category_distribution", "/api/dashboard/category-distribution", None),
+    ("dashboard.low_stock_products", "/api/dashboard/low-stock-products", None),
+    ("dashboard.recent_sales", "/api/dashboard/recent-sales", None),
+    ("dashboard.top_selling_products", "/api/dashboard/top-selling-products", None),
+    ("dashboard.sales_vs_returns_7", "/api/dashboard/sales-vs-returns?period=7", None),
+    ("dashboard.sales_vs_returns_12", "/api/dashboard/sales-vs-returns?period=12", None),
+    ("settings.dict", "/api/settings/dict", None),
+    ("invoices.sale", "/api/sales/1/invoice", 10),
+    ("invoices.return", "/api/returns/1/invoice", 10),
+    ("backups.list", "/api/settings/backups/list", None),
+]
+
+
+@pytest.mark.parametrize("name,path,iterations", READ_CASES, ids=[case[0] for case in READ_CASES])
+def test_read_endpoint(bench, name, path, iterations):
+    bench.measure(name, "GET", path, iterations=iterations)
+    bench.check(name)
+
+
+@pytest.mark.parametrize("report_format", REPORT_FORMATS)
+@pytest.mark.parametrize("report_type", REPORT_TYPES)
+def test_report(bench, report_type, report_format):
+    name = f"reports.{report_type}.{report_format}"
+    body = {"report_type": report_type, "format": report_format}
+    if report_type == "sales":
+        # A month of sales keeps the PDF/Excel table size representative but bounded
+        from datetime import date, timedelta
+        body["start_date"] = (date.today() - timedelta(days=30)).isoformat()
+        body["end_date"] = date.today().isoformat()
+    bench.measure(name, "POST", "/api/reports/generate", iterations=3, json=body)
+    bench.check(name)
+
+
+def test_conditional_get(bench):
+    from app.etags import ETAGS_ENABLED
+
+    if not ETAGS_ENABLED:
+        pytest.skip("ETags are off for this database")
+    etag = bench.client.get("/api/products/").headers["etag"]
+    headers = {"If-None-Match": etag}
+    assert bench.client.get("/api/products/", headers=headers).status_code == 304
+    bench.measure("products.list_not_modified", "GET", "/api/products/", headers=headers)
+    bench.check("products.list_not_modified")
+
+
+def test_create_sale(bench):
+    from sqlalchemy import select
+    from app.database import engine
+    from app.models import Product
+
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(Product.id, Product.price)
+            .where(Product.is_active)
+            .order_by(Product.stock_quantity.desc())
+            .limit(3)
+        ).all()
+    body = {
+        "items": [{"product_id": pid, "quantity": 1, "unit_price": price} for pid, price in rows],
+        "payment_method": "cash",
+    }
+    bench.measure("sales.create", "POST", "/api/sales/", json=body)
+    bench.check("sales.create")
+
+
+def test_create_backup(bench):
+    from app.database import IS_SQLITE
+
+    if not IS_SQLITE:
+        pytest.skip("file backups are SQLite-only")
+    bench.measure("backups.create", "POST", "/api/settings/backup", iterations=3)
+    bench.check("backups.create")
+
+
+def test_import_products(bench):
+    # The warm-up request creates the products; the measured ones update them
+    lines = ["sku,name,category_id,price,cost,stock_quantity"]
+    lines += [f"IMPORT-{i:06d},Imported product {i},{i % 3 + 1},9.99,5.00,{i % 20}" for i in range(1000)]
+    files = {"file": ("products.csv", "\n".join(lines).encode(), "text/csv")}
+    bench.measure("products.import_1000", "POST", "/api/products/import", iterations=3, files=files)
+    bench.check("products.import_1000")
+
+
+def test_bulk_stock_update(bench):
+    body = {"mode": "delta", "items": [{"product_id": i, "quantity": 1} for i in range(1, 501)]}
+    bench.measure("products.stock_bulk_500", "POST", "/api/products/stock/bulk", iterations=3, json=body)
+    bench.check("products.stock_bulk_500")
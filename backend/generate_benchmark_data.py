@@ -0,0 +1,400 @@
+"""
+Synthetic dataset generator for benchmarking the Inventory Management System
+Builds a large database with realistic distributions:
+  - Zipf-distributed product popularity for sales, returns and stock movements
+  - Seasonal sales volume (yearly wave, December peak, busier weekends, shop hours)
+The output is deterministic for a given seed and end date.
+
+Example (benchmark scale):
+    python generate_benchmark_data.py --output bench.db --products 1000000 \
+        --sales-items 10000000 --stock-movements 2000000 --returns 100000 --seed 42
+"""
+
+import argparse
+import itertools
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import bindparam, create_engine, event
+
+from app.database import Base
+from app.migrations import rebuild_category_counts
+from app.models import Category, Product, Sale, SalesItem, StockMovement, Return, ReturnItem
+
+DEFAULT_END_DATE = "2025-12-31"
+ZIPF_EXPONENT = 1.1
+
+_ADJECTIVES = [
+    "Classic", "Premium", "Compact", "Deluxe", "Eco", "Smart", "Portable", "Heavy-Duty",
+    "Wireless", "Organic", "Vintage", "Ultra", "Mini", "Pro", "Essential", "Family",
+]
+_NOUNS = [
+    "Headphones", "Cable", "Mouse", "Shirt", "Jeans", "Notebook", "Lamp", "Bottle",
+    "Backpack", "Mat", "Puzzle", "Blocks", "Charger", "Kettle", "Towel", "Pen Set",
+    "Speaker", "Jacket", "Planter", "Ball",
+]
+_CATEGORY_NAMES = [
+    "Electronics", "Clothing", "Books", "Home & Garden", "Sports", "Toys", "Grocery",
+    "Beauty", "Automotive", "Office", "Pet Supplies", "Kitchen", "Music", "Health",
+]
+_UNITS = ["pcs", "pcs", "pcs", "set", "box", "kg", "pack"]
+_PAYMENT_METHODS = ["cash", "cash", "cash", "card", "card", "mobile"]
+_RETURN_STATUSES = ["pending", "approved", "approved", "refunded", "refunded", "refunded", "rejected"]
+_CONDITIONS = ["good", "good", "good", "damaged", "defective"]
+_ITEMS_PER_SALE = [1, 2, 3, 4, 5, 6]
+_ITEMS_PER_SALE_CUM = list(itertools.accumulate([30, 25, 18, 12, 9, 6]))
+_LINE_QUANTITIES = [1, 2, 3, 5]
+_LINE_QUANTITIES_CUM = list(itertools.accumulate([70, 20, 7, 3]))
+# Relative traffic per hour of day (shop opens at 8, peaks after work)
+_HOUR_WEIGHTS = [0, 0, 0, 0, 0, 0, 0, 1, 4, 6, 7, 8, 9, 8, 7, 7, 8, 10, 11, 9, 6, 3, 1, 0]
+
+
+def _chunks(iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _zipf_cum_weights(n: int, exponent: float = ZIPF_EXPONENT) -> List[float]:
+    return list(itertools.accumulate(1.0 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+def _day_weight(day: datetime) -> float:
+    """Seasonal demand: yearly wave peaking in December plus busier weekends"""
+    yearly = 1.0 + 0.35 * math.cos(2 * math.pi * (day.timetuple().tm_yday - 350) / 365.0)
+    if day.month == 12:
+        yearly *= 1.4
+    weekly = 1.3 if day.weekday() >= 5 else 1.0
+    return yearly * weekly
+
+
+class _Timeline:
+    """Draws seasonal timestamps inside a window of `days` ending at `end`"""
+
+    def __init__(self, rng: random.Random, end: datetime, days: int):
+        self.rng = rng
+        self.start = end - timedelta(days=days - 1)
+        self.days = [self.start + timedelta(days=i) for i in range(days)]
+        self.day_cum = list(itertools.accumulate(_day_weight(d) for d in self.days))
+        self.hour_cum = list(itertools.accumulate(_HOUR_WEIGHTS))
+
+    def sorted_timestamps(self, n: int) -> List[datetime]:
+        days = self.rng.choices(self.days, cum_weights=self.day_cum, k=n)
+        hours = self.rng.choices(range(24), cum_weights=self.hour_cum, k=n)
+        stamps = [
+            d + timedelta(hours=h, seconds=self.rng.randrange(3600))
+            for d, h in zip(days, hours)
+        ]
+        stamps.sort()
+        return stamps
+
+
+def generate_dataset(
+    url: str,
+    seed: int = 42,
+    categories: int = 14,
+    products: int = 10000,
+    sales_items: int = 100000,
+    stock_movements: int = 20000,
+    returns: int = 1000,
+    days: int = 365,
+    end_date: Optional[str] = None,
+    chunk_size: int = 20000,
+    progress: Callable[[str], None] = print,
+) -> Dict[str, int]:
+    """Create the schema at `url` and fill it with synthetic data.
+
+    Returns the number of rows written per table.
+    """
+    rng = random.Random(seed)
+    end = datetime.fromisoformat(end_date or DEFAULT_END_DATE).replace(hour=0, minute=0, second=0, microsecond=0)
+    timeline = _Timeline(rng, end, days)
+
+    engine = create_engine(url)
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def _fast_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=OFF")
+            cursor.execute("PRAGMA synchronous=OFF")
+            cursor.close()
+
+    Base.metadata.create_all(bind=engine)
+    counts: Dict[str, int] = {}
+    started = time.perf_counter()
+
+    def log(message: str):
+        progress(f"[{time.perf_counter() - started:7.1f}s] {message}")
+
+    with engine.begin() as conn:
+        # Categories
+        category_rows = []
+        for i in range(categories):
+            base = _CATEGORY_NAMES[i % len(_CATEGORY_NAMES)]
+            name = base if i < len(_CATEGORY_NAMES) else f"{base} {i // len(_CATEGORY_NAMES) + 1}"
+            category_rows.append({
+                "id": i + 1,
+                "name": name,
+                "description": f"{name} products",
+                "created_at": timeline.start,
+            })
+        conn.execute(Category.__table__.insert(), category_rows)
+        counts["categories"] = len(category_rows)
+        log(f"categories: {len(category_rows)}")
+
+        # Products (stock is filled in after the movement ledger is simulated)
+        prices: List[float] = []
+
+        def product_rows() -> Iterator[dict]:
+            for i in range(1, products + 1):
+                price = round(min(rng.lognormvariate(3.0, 0.9), 5000.0), 2)
+                prices.append(price)
+                yield {
+                    "id": i,
+                    "name": f"{rng.choice(_ADJECTIVES)} {rng.choice(_NOUNS)} {i}",
+                    "description": None if rng.random() < 0.3 else f"Synthetic product {i}",
+                    "sku": f"SKU-{i:08d}",
+                    "barcode": f"{2000000000000 + i}",
+                    "category_id": rng.randint(1, categories),
+                    "price": price,
+                    "cost": round(price * rng.uniform(0.4, 0.8), 2),
+                    "stock_quantity": 0,
+                    "min_stock_level": rng.choice([5, 10, 10, 15, 20]),
+                    "unit": rng.choice(_UNITS),
+                    "image_url": None,
+                    "is_active": rng.random() > 0.03,
+                    "created_at": timeline.start,
+                }
+
+        for chunk in _chunks(product_rows(), chunk_size):
+            conn.execute(Product.__table__.insert(), chunk)
+        counts["products"] = products
+        rebuild_category_counts(conn)
+        log(f"products: {products}")
+
+        # Zipf popularity: rank 1 is the best seller, ranks are shuffled over ids
+        popularity = list(range(1, products + 1))
+        rng.shuffle(popularity)
+        popularity_cum = _zipf_cum_weights(products)
+
+        def pick_products(k: int) -> List[int]:
+            return rng.choices(popularity, cum_weights=popularity_cum, k=k)
+
+        # Stock movement ledger: initial stock-in for as many products as the budget
+        # allows, then Zipf-weighted in/out/adjustment traffic with running balances
+        stock = [0] * (products + 1)
+        initial_count = min(products, stock_movements // 2)
+        movement_stamps = timeline.sorted_timestamps(stock_movements - initial_count)
+
+        def movement_rows() -> Iterator[dict]:
+            movement_id = 0
+            for product_id in range(1, initial_count + 1):
+                movement_id += 1
+                quantity = rng.randint(20, 500)
+                stock[product_id] = quantity
+                yield {
+                    "id": movement_id, "product_id": product_id, "movement_type": "in",
+                    "quantity": quantity, "previous_stock": 0, "new_stock": quantity,
+                    "reference_id": None, "notes": "Initial stock", "created_at": timeline.start,
+                }
+            for created_at, product_id in zip(movement_stamps, pick_products(len(movement_stamps))):
+                movement_id += 1
+                previous = stock[product_id]
+                roll = rng.random()
+                if roll < 0.1:
+                    movement_type, quantity = "adjustment", max(previous + rng.randint(-5, 5), 0)
+                    new = quantity
+                elif roll < 0.55 or previous == 0:
+                    movement_type, quantity = "in", rng.randint(10, 200)
+                    new = previous + quantity
+                else:
+                    movement_type, quantity = "out", rng.randint(1, max(previous, 1))
+                    new = previous - quantity
+                stock[product_id] = new
+                yield {
+                    "id": movement_id, "product_id": product_id, "movement_type": movement_type,
+                    "quantity": quantity, "previous_stock": previous, "new_stock": new,
+                    "reference_id": None, "notes": None, "created_at": created_at,
+                }
+
+        for chunk in _chunks(movement_rows(), chunk_size):
+            conn.execute(StockMovement.__table__.insert(), chunk)
+        counts["stock_movements"] = stock_movements
+        log(f"stock_movements: {stock_movements}")
+
+        product_table = Product.__table__
+        stock_update = product_table.update()\
+            .where(product_table.c.id == bindparam("b_id"))\
+            .values(stock_quantity=bindparam("b_stock"), updated_at=end)
+        stocked = ({"b_id": pid, "b_stock": qty} for pid, qty in enumerate(stock) if qty)
+        for chunk in _chunks(stocked, chunk_size):
+            conn.execute(stock_update, chunk)
+        log("product stock levels set from ledger")
+
+        # Sales: items per sale are drawn first so the sale count is exact,
+        # then sales are spread over the seasonal timeline in id order
+        sizes: List[int] = []
+        remaining = sales_items
+        while remaining > 0:
+            for size in rng.choices(_ITEMS_PER_SALE, cum_weights=_ITEMS_PER_SALE_CUM, k=remaining // 3 + 1):
+                size = min(size, remaining)
+                sizes.append(size)
+                remaining -= size
+                if remaining == 0:
+                    break
+        sale_stamps = timeline.sorted_timestamps(len(sizes))
+
+        sale_chunk: List[dict] = []
+        item_chunk: List[dict] = []
+        item_id = 0
+        for sale_id, (size, created_at) in enumerate(zip(sizes, sale_stamps), start=1):
+            total = 0.0
+            quantities = rng.choices(_LINE_QUANTITIES, cum_weights=_LINE_QUANTITIES_CUM, k=size)
+            for product_id, quantity in zip(pick_products(size), quantities):
+                item_id += 1
+                unit_price = prices[product_id - 1]
+                line_total = round(quantity * unit_price, 2)
+                total += line_total
+                item_chunk.append({
+                    "id": item_id, "sale_id": sale_id, "product_id": product_id,
+                    "quantity": quantity, "unit_price": unit_price, "total_price": line_total,
+                })
+            discount = round(total * 0.05, 2) if rng.random() < 0.1 else 0.0
+            sale_chunk.append({
+                "id": sale_id,
+                "sale_number": f"SALE-B{sale_id:09d}",
+                "total_amount": round(total, 2),
+                "discount": discount,
+                "tax": 0.0,
+                "final_amount": round(total - discount, 2),
+                "payment_method": rng.choice(_PAYMENT_METHODS),
+                "notes": None,
+                "created_at": created_at,
+            })
+            if len(item_chunk) >= chunk_size:
+                conn.execute(Sale.__table__.insert(), sale_chunk)
+                conn.execute(SalesItem.__table__.insert(), item_chunk)
+                sale_chunk, item_chunk = [], []
+        if sale_chunk:
+            conn.execute(Sale.__table__.insert(), sale_chunk)
+        if item_chunk:
+            conn.execute(SalesItem.__table__.insert(), item_chunk)
+        counts["sales"] = len(sizes)
+        counts["sales_items"] = sales_items
+        log(f"sales: {len(sizes)}, sales_items: {sales_items}")
+
+        # Returns reference random sales and Zipf-popular products
+        return_chunk: List[dict] = []
+        return_item_chunk: List[dict] = []
+        return_item_id = 0
+        return_stamps = timeline.sorted_timestamps(returns)
+        for return_id, created_at in enumerate(return_stamps, start=1):
+            total = 0.0
+            for product_id in pick_products(rng.choice([1, 1, 1, 2])):
+                return_item_id += 1
+                unit_price = prices[product_id - 1]
+                total += unit_price
+                return_item_chunk.append({
+                    "id": return_item_id, "return_id": return_id, "product_id": product_id,
+                    "quantity": 1, "unit_price": unit_price, "total_price": unit_price,
+                    "condition": rng.choice(_CONDITIONS),
+                })
+            status = rng.choice(_RETURN_STATUSES)
+            return_chunk.append({
+                "id": return_id,
+                "return_number": f"RET-B{return_id:08d}",
+                "original_sale_id": rng.randint(1, len(sizes)) if sizes else None,
+                "total_amount": round(total, 2),
+                "refund_method": rng.choice(["cash", "card", "store_credit"]),
+                "reason": rng.choice(["Defective", "Wrong size", "Changed mind", None]),
+                "status": status,
+                "created_at": created_at,
+                "processed_at": created_at + timedelta(days=rng.randint(0, 3)) if status == "refunded" else None,
+            })
+            if len(return_chunk) >= chunk_size:
+                conn.execute(Return.__table__.insert(), return_chunk)
+                conn.execute(ReturnItem.__table__.insert(), return_item_chunk)
+                return_chunk, return_item_chunk = [], []
+        if return_chunk:
+            conn.execute(Return.__table__.insert(), return_chunk)
+            conn.execute(ReturnItem.__table__.insert(), return_item_chunk)
+        counts["returns"] = returns
+        counts["return_items"] = return_item_id
+        log(f"returns: {returns}")
+
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            conn.exec_driver_sql("ANALYZE")
+    elif engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            # Rows were inserted with explicit ids; move the id sequences past them
+            for table in Base.metadata.sorted_tables:
+                if "id" in table.c:
+                    conn.exec_driver_sql(
+                        f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                        f"COALESCE((SELECT MAX(id) FROM {table.name}), 0) + 1, false)"
+                    )
+            conn.exec_driver_sql("ANALYZE")
+    engine.dispose()
+    log("done")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic benchmark database")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--output", help="Path of the SQLite file to create")
+    target.add_argument("--url", help="SQLAlchemy URL of an existing, empty database")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--categories", type=int, default=14)
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--sales-items", type=int, default=100000)
+    parser.add_argument("--stock-movements", type=int, default=20000)
+    parser.add_argument("--returns", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=365, help="Length of the sales history window")
+    parser.add_argument("--end-date", default=DEFAULT_END_DATE, help="Last day of the history (YYYY-MM-DD)")
+    parser.add_argument("--force", action="store_true", help="Overwrite the output file if it exists")
+    args = parser.parse_args()
+
+    if args.output:
+        if os.path.exists(args.output) and not args.force:
+            parser.error(f"{args.output} already exists (use --force to overwrite)")
+        # Build next to the target and rename, so a half-written file is never picked up
+        tmp_path = f"{args.output}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        url = f"sqlite:///{os.path.abspath(tmp_path)}"
+    else:
+        url = args.url
+
+    counts = generate_dataset(
+        url,
+        seed=args.seed,
+        categories=args.categories,
+        products=args.products,
+        sales_items=args.sales_items,
+        stock_movements=args.stock_movements,
+        returns=args.returns,
+        days=args.days,
+        end_date=args.end_date,
+    )
+
+    if args.output:
+        os.replace(tmp_path, args.output)
+    print("Benchmark data generated:")
+    for table, count in counts.items():
+        print(f"  {table}: {count}")
+
+
+if __name__ == "__main__":
+    main()
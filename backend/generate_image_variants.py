@@ -0,0 +1,60 @@
+"""
+Backfill thumbnail / medium WebP variants for images already in the uploads dir
+New uploads get their variants automatically; run this once after upgrading, or
+with --force after changing the variant sizes in app/images.py; variants that
+come out different are written under a new name, the old ones are left for the
+upload GC. Needs Pillow.
+A running app lists variants at startup, so ones written while it runs show up
+in API responses after its next upload GC or a restart.
+
+Example:
+    python generate_image_variants.py --workers 8
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import images
+from app.routers.upload import ALLOWED_EXTENSIONS
+
+
+def find_originals():
+    """Uploaded images that are not themselves variants"""
+    for filename in sorted(os.listdir(images.UPLOAD_DIR)):
+        if filename.startswith(".") or images.is_variant(filename):
+            continue
+        if os.path.splitext(filename)[1].lower() in ALLOWED_EXTENSIONS:
+            yield filename
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate resized variants for uploaded product images")
+    parser.add_argument("--workers", type=int, default=images.IMAGE_WORKERS)
+    parser.add_argument("--force", action="store_true", help="Regenerate variants that already exist")
+    args = parser.parse_args()
+
+    if not images.variants_enabled():
+        parser.error("Pillow is not installed (pip install Pillow)")
+
+    images.load_variants()
+    originals = list(find_originals())
+    started = time.perf_counter()
+    written = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = executor.map(lambda filename: images.generate_variants(filename, force=args.force), originals)
+        for done, files in enumerate(results, start=1):
+            written += len(files)
+            if done % 100 == 0 or done == len(originals):
+                print(f"  {done}/{len(originals)} images")
+
+    print(f"Wrote {written} variants for {len(originals)} images in {time.perf_counter() - started:.1f}s "
+          f"({images.UPLOAD_DIR})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,41 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import OperationalError
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
 import uvicorn
 from contextlib import asynccontextmanager
 import os
+import re
 import sys
 
-from app.database import create_tables
+from app.database import create_tables, async_engine
+from app.writer import write_queue
 from app.paths import get_data_dir
-from app.routers import products, categories, sales, dashboard, reports, settings, returns, upload
+from app.static import ImmutableStaticFiles
+from app import profiling, images, backups, maintenance, product_import, product_index, stocktake
+from app.scheduler import scheduler
+from app.routers import products, categories, sales, dashboard, reports, settings, returns, upload, admin
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     create_tables()
+    images.load_variants()
+    product_index.start()
+    write_queue.start()
+    scheduler.start()
     yield
     # Shutdown
+    await scheduler.stop()
+    write_queue.stop()
+    images.shutdown()
+    backups.shutdown()
+    if async_engine is not None:
+        await async_engine.dispose()
 
 
 app = FastAPI(
@@ -33,8 +52,105 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[profiling.PROFILE_ID_HEADER],
 )
 
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """Sample the request when it carries a valid X-IMS-Profile header"""
+    if request.url.path.startswith("/api/admin/profiles") or \
+            not profiling.is_authorized(request.headers.get(profiling.PROFILE_HEADER)):
+        return await call_next(request)
+
+    sampler = profiling.StackSampler()
+    sampler.start()
+    try:
+        response = await call_next(request)
+    finally:
+        sampler.detach()
+        await run_in_threadpool(sampler.stop)
+    response.headers[profiling.PROFILE_ID_HEADER] = await run_in_threadpool(profiling.save_profile, sampler)
+    return response
+
+
+# Request body limits of the upload endpoints
+UPLOAD_LIMITS = [
+    (re.compile(r"/api/upload/product-images/\d+/?"), upload.MAX_REQUEST_SIZE),
+    (re.compile(r"/api/upload/product-image(/\d+)?/?"), upload.MAX_SINGLE_REQUEST_SIZE),
+    (re.compile(r"/api/products/import/?"), product_import.MAX_UPLOAD_SIZE),
+    (re.compile(r"/api/products/stock/bulk/csv/?"), stocktake.MAX_CSV_SIZE),
+]
+
+
+class UploadSizeLimit:
+    """Refuse upload bodies over their route's limit with a 413.
+
+    A Content-Length over the limit is refused before the body is read; bodies
+    without one (chunked) are counted as they stream in.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = None
+        if scope["type"] == "http" and scope["method"] == "POST":
+            limit = next((size for pattern, size in UPLOAD_LIMITS if pattern.fullmatch(scope["path"])), None)
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse(status_code=413, content={"detail": "Upload too large"})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request" and received <= limit:
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised once, while the form is parsed and before the endpoint runs;
+                    # later reads (waiting for the client to disconnect) get the rest
+                    raise HTTPException(status_code=413, detail="Upload too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+app.add_middleware(UploadSizeLimit)
+
+
+@app.middleware("http")
+async def maintenance_gate(request: Request, call_next):
+    """Answer API requests with a retryable 503 while the database is being swapped"""
+    if not request.url.path.startswith("/api/"):
+        return await call_next(request)
+    if maintenance.gate.active:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": f"Maintenance in progress ({maintenance.gate.reason})"},
+            headers={"Retry-After": str(maintenance.RETRY_AFTER)},
+        )
+    with maintenance.gate.track():
+        return await call_next(request)
+
+
+@app.exception_handler(OperationalError)
+async def database_busy_handler(request: Request, exc: OperationalError):
+    """Report SQLite lock timeouts as a retryable 503 instead of a bare 500"""
+    if "database is locked" in str(exc.orig):
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "database is locked"},
+            headers={"Retry-After": "1"}
+        )
+    raise exc
+
+
 # Include routers
 app.include_router(products.router, prefix="/api/products", tags=["products"])
 app.include_router(categories.router, prefix="/api/categories", tags=["categories"])
@@ -44,9 +160,10 @@ app.include_router(reports.router, prefix="/api/reports", tags=["reports"])
 app.include_router(settings.router, prefix="/api/settings", tags=["settings"])
 app.include_router(returns.router, prefix="/api", tags=["returns"])
 app.include_router(upload.router, prefix="/api", tags=["upload"])
+app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
 
 # Serve uploaded files from the data directory (works in packaged app)
-app.mount("/uploads", StaticFiles(directory=get_data_dir('uploads')), name="uploads")
+app.mount("/uploads", ImmutableStaticFiles(directory=get_data_dir('uploads')), name="uploads")
 
 
 @app.get("/")
@@ -30,6 +30,7 @@ interface Category {
   description: string;
   is_active: boolean;
   product_count?: number;
+  active_product_count?: number;
 }
 
 const Categories: React.FC = () => {
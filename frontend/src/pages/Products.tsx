@@ -45,6 +45,8 @@ interface Product {
   unit: string;
   is_active: boolean;
   image_url?: string;
+  thumbnail_url?: string | null;
+  medium_url?: string | null;
   images?: string[];
   category: {
     id: number;
@@ -451,8 +453,9 @@ const Products: React.FC = () => {
                       <div className="w-16 h-16 bg-gray-100 rounded-lg flex items-center justify-center overflow-hidden">
                         {product.image_url ? (
                           <img 
-                            src={`${API_BASE_URL.replace('/api','')}${product.image_url}`} 
+                            src={`${API_BASE_URL.replace('/api','')}${product.thumbnail_url || product.image_url}`} 
                             alt={product.name}
+                            loading="lazy"
                             className="w-full h-full object-cover"
                           />
                         ) : (
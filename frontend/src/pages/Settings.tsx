@@ -103,8 +103,18 @@ const Settings: React.FC = () => {
   // Create backup
   const backupMutation = useMutation({
     mutationFn: async () => {
-      const res = await settingsApi.createBackup();
-      return res.data as { message: string; backup_file: string; backup_path: string; created_at: string };
+      // Backups run in the background; poll the job until it finishes
+      let res = await settingsApi.createBackup();
+      let job = res.data as { job_id: string; status: string; backup_file: string | null; error: string | null };
+      while (!['completed', 'failed', 'cancelled'].includes(job.status)) {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        res = await settingsApi.getBackupJob(job.job_id);
+        job = res.data;
+      }
+      if (job.status !== 'completed') {
+        throw new Error(job.error || `Backup ${job.status}`);
+      }
+      return job;
     },
     onSuccess: () => {
       setIsBackupDialogOpen(false);
@@ -120,8 +130,8 @@ const Settings: React.FC = () => {
   const { data: backupsResp, isLoading: isBackupsLoading } = useQuery({
     queryKey: ['settings', 'backups'],
     queryFn: async () => {
-      const res = await settingsApi.listBackups();
-      return res.data as { backups: Array<{ filename: string; size: number; created_at: string; modified_at: string }> };
+      const res = await settingsApi.listBackups({ limit: 50 });
+      return res.data as { backups: Array<{ filename: string; size: number; created_at: string }>; total: number };
     },
   });
 
@@ -132,7 +142,8 @@ const Settings: React.FC = () => {
     },
     onSuccess: () => {
       setIsRestoreDialogOpen(false);
-      alert('Database restored successfully. Please restart the application.');
+      queryClient.invalidateQueries();
+      alert('Database restored successfully.');
     },
     onError: (e: any) => {
       alert(`Failed to restore backup: ${e?.message || 'Unknown error'}`);
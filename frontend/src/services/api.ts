@@ -94,7 +94,8 @@ export const settingsApi = {
     },
   }),
   createBackup: () => api.post('/settings/backup'),
-  listBackups: () => api.get('/settings/backups/list'),
+  getBackupJob: (jobId: string) => api.get(`/settings/backup/jobs/${jobId}`),
+  listBackups: (params?: any) => api.get('/settings/backups/list', { params }),
   restoreBackup: (filename: string) => api.post(`/settings/restore/${filename}`),
   reset: () => api.post('/settings/reset'),
   export: () => api.get('/settings/export/json'),